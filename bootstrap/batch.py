@@ -0,0 +1,86 @@
+import collections
+import functools
+import multiprocessing
+import multiprocessing.pool
+from lexer import tokenize, LexerError
+from parser import parse_iter
+from translator import translate, translate_stream
+import optimizer
+import peephole
+
+
+# the outcome of compiling one source: code and strings, or the error.
+# errors has every syntax error when there are any, and otherwise just
+# the error, so a program with several mistakes needs only one compile.
+Compiled = collections.namedtuple('Compiled',
+    ['code', 'strings', 'error', 'errors'])
+
+
+def compile_source(source, optimize=False):
+    """Compile one program the way pb.py does, returning a Compiled.
+
+    Lexer, parser and translator errors are returned rather than raised,
+    so one bad program doesn't take a whole batch down with it."""
+    syntax_errors = []
+    def statements():
+        del syntax_errors[:]
+        return parse_iter(tokenize(source), errors=syntax_errors)
+
+    try:
+        if optimize:
+            ast = list(statements())
+            if not syntax_errors:
+                (ast, removed) = optimizer.optimize(ast)
+                (code, strings) = translate(ast, inline=True, memoize=True)
+                code = peephole.optimize(code)
+        else:
+            ctx = translate_stream(statements)
+            (code, strings) = (ctx.code, ctx.string_table)
+    except Exception, e:
+        if isinstance(e, LexerError):
+            syntax_errors.append(e)
+        elif not syntax_errors:
+            return Compiled(None, None, e, [e])
+        # anything else comes from translating what's left of a program
+        # with syntax errors, and those are what need fixing
+    if syntax_errors:
+        return Compiled(None, None, syntax_errors[0], syntax_errors)
+    return Compiled(code, strings, None, [])
+
+
+def compile_batch(sources, optimize=False, workers=None, threads=False):
+    """Compile many programs at once, returning a Compiled for each source,
+    in order.
+
+    The work is spread over a pool of worker processes, or threads if
+    threads is set. workers defaults to the number of CPUs."""
+    if threads:
+        pool = multiprocessing.pool.ThreadPool(workers)
+    else:
+        pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(functools.partial(compile_source, optimize=optimize),
+            sources)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    sources = []
+    for path in sys.argv[1:]:
+        with open(path, 'r') as f:
+            sources.append(f.read())
+    if not sources:
+        from samples import sample_prog
+        sources = [sample_prog] * 200
+
+    start = time.time()
+    results = compile_batch(sources)
+    print "compiled", len(results), "programs in %.3fs" % (time.time() - start)
+    for (i, result) in enumerate(results):
+        for error in result.errors:
+            print "program", i, "failed:", error
@@ -0,0 +1,438 @@
+import sys
+from vm import BasicVM, Opcode, VmError, ErrCtx, Status, WaitingForInput, decode
+
+
+class Uncompilable(RuntimeError):
+    """Python couldn't compile a block's source, like when it's too big or
+    too deeply nested for its parser"""
+    pass
+
+
+class BlockVM(BasicVM):
+    """A BasicVM that runs basic blocks compiled to Python functions.
+
+    The first time execution reaches an address, the straight-line code
+    from there up to the next jump, GOSUB, RETURN or HALT is turned into
+    the source of one Python function and compiled. Values that stay
+    inside the block live in Python locals instead of on the VM stack;
+    whatever is left over is pushed onto the real stack before the block
+    exits. Each block returns the address to continue at.
+
+    Results, output and VmError locations are the same as BasicVM.Run.
+    The debugger still steps through the bytecode one instruction at a
+    time. With max_steps, Run stops at the first block boundary after
+    that many instructions.
+
+    INPUT always starts a new block, so a block never has to stop half
+    way through to wait for input."""
+
+    # opcode => name of the method that generates Python source for it
+    GENERATORS = {
+        Opcode.NOOP:        "gen_noop",
+        Opcode.CLEAR:       "gen_clear",
+        Opcode.PRINT:       "gen_print",
+        Opcode.PRINTNUMLIT: "gen_print",
+        Opcode.PRINTSTRLIT: "gen_printstrlit",
+        Opcode.LITERAL1:    "gen_const",
+        Opcode.LITERAL2:    "gen_const",
+        Opcode.LITERAL4:    "gen_const",
+        Opcode.STRING2:     "gen_const",
+        Opcode.CONST2:      "gen_pooled",
+        Opcode.FLOAT4:      "gen_const",
+        Opcode.NAME:        "gen_name",
+        Opcode.STORENUM:    "gen_storenum",
+        Opcode.STORESTR:    "gen_storestr",
+        Opcode.RETRV:       "gen_retrv",
+        Opcode.INPUT:       "gen_input",
+        Opcode.LOADSLOT:    "gen_loadslot",
+        Opcode.STORESLOT:   "gen_storeslot",
+        Opcode.STORESTRSLOT: "gen_storestrslot",
+        Opcode.INPUTSLOT:   "gen_inputslot",
+        Opcode.ADD:         "gen_arith",
+        Opcode.SUBTRACT:    "gen_arith",
+        Opcode.MULTIPLY:    "gen_arith",
+        Opcode.DIVIDE:      "gen_arith",
+        Opcode.EQUAL:       "gen_compare",
+        Opcode.LT:          "gen_compare",
+        Opcode.LTE:         "gen_compare",
+        Opcode.PUSHSCOPE:   "gen_pushscope",
+        Opcode.POPSCOPE:    "gen_popscope",
+        Opcode.MEMOSTORE:   "gen_memostore",
+        # these end a block
+        Opcode.JUMP:        "gen_jump",
+        Opcode.JUMPIF0:     "gen_jumpif0",
+        Opcode.JUMPABS:     "gen_jumpabs",
+        Opcode.JUMPIFNOTEQ: "gen_jumpifnot",
+        Opcode.JUMPIFNOTLT: "gen_jumpifnot",
+        Opcode.JUMPIFNOTLTE: "gen_jumpifnot",
+        Opcode.GOSUB:       "gen_gosub",
+        Opcode.CALLSUB:     "gen_callsub",
+        Opcode.MEMOCALL:    "gen_memocall",
+        Opcode.RETURN:      "gen_return",
+        Opcode.HALT:        "gen_halt",
+        Opcode.EOM_HALT:    "gen_halt",
+    }
+
+    ARITH = {
+        Opcode.ADD:         ("+", "ADD"),
+        Opcode.SUBTRACT:    ("-", "SUBTRACT"),
+        Opcode.MULTIPLY:    ("*", "MULTIPLY"),
+        Opcode.DIVIDE:      ("/", "DIVIDE"),
+    }
+
+    COMPARE = {
+        Opcode.EQUAL:       "==",
+        Opcode.LT:          "<",
+        Opcode.LTE:         "<=",
+        Opcode.JUMPIFNOTEQ: "==",
+        Opcode.JUMPIFNOTLT: "<",
+        Opcode.JUMPIFNOTLTE: "<=",
+    }
+
+    def Load(self, code, string_table, predecode=False, verified=None,
+            lines=None, names=None):
+        # blocks are keyed by byte offset, so there's nothing to gain from
+        # pre-decoding, and they already leave out the type checks they can
+        BasicVM.Load(self, code, string_table, verified=verified, lines=lines,
+            names=names)
+        self.blocks = {}
+
+    def Run(self, max_steps=None):
+        if self.debugger:
+            return BasicVM.Run(self, max_steps)
+
+        blocks = self.blocks
+        budget = sys.maxint if max_steps is None else max_steps
+        ip = self.IP
+        try:
+            while not self.halted and budget > 0:
+                block = blocks.get(ip)
+                if block is None:
+                    block = self.CompileBlock(ip)
+                ip = block(self, self.STACK, self.IP_STACK, self.string_table)
+                budget -= block.size
+        except VmError, e:
+            self.IP = e.args[1].loc
+            raise
+        except WaitingForInput:
+            # blocks wait before they've done anything, so ip is still the
+            # start of the block with the INPUT in it
+            self.IP = ip
+            return Status.WAITING
+        finally:
+            self.output.flush()
+        self.IP = ip
+        return Status.HALTED if self.halted else Status.YIELDED
+
+    def CompileBlock(self, start):
+        source = self.BlockSource(start)
+        namespace = {"VmError": VmError, "ErrCtx": ErrCtx}
+        try:
+            code = compile(source, "<block %#04x>" % start, "exec")
+        except (MemoryError, RuntimeError), e:
+            # out of parser stack or recursion depth; anything else is a
+            # bug in the source we made, and raised as it is
+            raise Uncompilable(e, start)
+        exec code in namespace
+        block = namespace["block"]
+        block.size = self.size
+        self.blocks[start] = block
+        return block
+
+    def BlockSource(self, start):
+        """Python source for the block of code starting at start"""
+        self.lines = ["def block(vm, STACK, IPS, STRINGS):", "S = vm.SLOTS"]
+        self.stack = []     # (python expression, known to be a number)
+        self.slots = {}     # slot => expression holding its current value
+        self.name = None    # expression for the name register, if known
+        self.temps = 0
+        self.start = start
+        self.size = 0       # in instructions
+
+        ended = False
+        try:
+            for (offset, op, arg) in decode(self.code, start):
+                self.offset = offset
+                self.size += 1
+                ended = self.Generate(op, arg)
+                if ended:
+                    break
+        except VmError:
+            # a truncated instruction; running it fails the same way
+            # reading past the end of the bytecode does
+            self.flush()
+            self.emit("raise IndexError('ran off the end of memory')")
+            ended = True
+
+        if not ended:
+            # ran off the end of memory
+            self.offset = max(start, len(self.code))
+            self.gen_halt(Opcode.EOM_HALT, None)
+
+        return "\n    ".join(self.lines) + "\n"
+
+    def Generate(self, op, arg):
+        """Emit source for one instruction. Returns True if it ends the
+        block."""
+        if op not in self.GENERATORS:
+            self.flush()
+            self.emit("raise VmError('unexpected opcode', ErrCtx(e=%d, loc=%d))"
+                % (op, self.offset))
+            return True
+        return getattr(self, self.GENERATORS[op])(op, arg)
+
+    # helpers for the generators
+
+    def emit(self, line):
+        self.lines.append(line)
+
+    def temp(self):
+        self.temps += 1
+        return "t%d" % self.temps
+
+    def push(self, expr, numeric):
+        self.stack.append((expr, numeric))
+
+    def pop(self):
+        if self.stack:
+            return self.stack.pop()
+        t = self.temp()
+        self.emit("%s = STACK.pop()" % t)
+        return (t, False)
+
+    def flush(self):
+        """Put the values still held in locals onto the real stack"""
+        if len(self.stack) == 1:
+            self.emit("STACK.append(%s)" % self.stack[0][0])
+        elif self.stack:
+            self.emit("STACK.extend((%s,))" % ", ".join(e for (e, n) in self.stack))
+        self.stack = []
+
+    def fail(self, message, e):
+        """A statement that raises a VmError for the current instruction,
+        leaving the real stack the way BasicVM would have"""
+        spill = ""
+        if self.stack:
+            spill = "STACK.extend((%s,)); " % ", ".join(e for (e, n) in self.stack)
+        return "%sraise VmError(%r, ErrCtx(e=%s, loc=%d))" % (spill, message, e, self.offset)
+
+    def after(self):
+        """Address of the instruction after the current one"""
+        return self.offset + {
+            Opcode.JUMPIF0: 1,
+            Opcode.JUMPIFNOTEQ: 3,
+            Opcode.JUMPIFNOTLT: 3,
+            Opcode.JUMPIFNOTLTE: 3,
+        }[self.code[self.offset]]
+
+    def name_reg(self):
+        return self.name if self.name is not None else "vm.NAME_REG"
+
+    # straight-line instructions
+
+    def gen_noop(self, op, arg):
+        pass
+
+    def gen_clear(self, op, arg):
+        self.emit("vm.op_clear()")
+
+    def gen_print(self, op, arg):
+        (val, numeric) = self.pop()
+        self.emit("vm.output.write(%s)" % val)
+
+    def gen_printstrlit(self, op, arg):
+        (index, numeric) = self.pop()
+        self.emit("vm.output.write(STRINGS[%s])" % index)
+
+    def gen_const(self, op, arg):
+        self.push(repr(arg), True)
+
+    def gen_pooled(self, op, arg):
+        value = self.string_table[arg]
+        self.push(repr(value), type(value) is not str)
+
+    def gen_name(self, op, arg):
+        self.emit("vm.NAME_REG = %r" % arg)
+        self.name = repr(arg)
+
+    def gen_retrv(self, op, arg):
+        name = self.name_reg()
+        t = self.temp()
+        self.emit("if %s not in vm.VARS: %s"
+            % (name, self.fail("RETRV: variable is not defined", name)))
+        self.emit("%s = vm.VARS[%s]" % (t, name))
+        self.push(t, False)
+
+    def gen_storenum(self, op, arg):
+        (num, numeric) = self.pop()
+        if not numeric:
+            self.emit("if type(%s) is str: %s" % (num, self.fail("expected a number", num)))
+        self.emit("vm.VARS[%s] = %s" % (self.name_reg(), num))
+
+    def gen_storestr(self, op, arg):
+        (index, numeric) = self.pop()
+        self.emit("vm.VARS[%s] = STRINGS[%s]" % (self.name_reg(), index))
+
+    def input_boundary(self):
+        """End the block right before an INPUT that isn't the first
+        instruction. Returns True if it did."""
+        if self.offset == self.start:
+            return False
+        self.size -= 1
+        self.flush()
+        self.emit("return %d" % self.offset)
+        return True
+
+    def gen_input(self, op, arg):
+        if self.input_boundary():
+            return True
+        self.emit("vm.VARS[%s] = vm.ReadInput()" % self.name_reg())
+
+    def gen_loadslot(self, op, arg):
+        if arg in self.slots:
+            self.push(*self.slots[arg])
+            return
+        t = self.temp()
+        self.emit("%s = S[%d]" % (t, arg))
+        self.emit("if %s is None: %s" % (t, self.fail("LOADSLOT: variable is not defined", "vm.SlotName(%d)" % arg)))
+        self.slots[arg] = (t, False)
+        self.push(t, False)
+
+    def gen_storeslot(self, op, arg):
+        (num, numeric) = self.pop()
+        if not numeric:
+            self.emit("if type(%s) is str: %s" % (num, self.fail("expected a number", num)))
+        self.emit("S[%d] = %s" % (arg, num))
+        # it's definitely a number now
+        self.slots[arg] = (num, True)
+
+    def gen_storestrslot(self, op, arg):
+        (index, numeric) = self.pop()
+        t = self.temp()
+        self.emit("%s = S[%d] = STRINGS[%s]" % (t, arg, index))
+        self.slots[arg] = (t, False)
+
+    def gen_inputslot(self, op, arg):
+        if self.input_boundary():
+            return True
+        t = self.temp()
+        self.emit("%s = S[%d] = vm.ReadInput()" % (t, arg))
+        self.slots[arg] = (t, False)
+
+    def gen_arith(self, op, arg):
+        (op2, numeric2) = self.pop()
+        (op1, numeric1) = self.pop()
+        (operator, opname) = self.ARITH[op]
+        checks = ["type(%s) is str" % val for (val, numeric)
+            in ((op1, numeric1), (op2, numeric2)) if not numeric]
+        if checks:
+            self.emit("if %s: %s" % (" or ".join(checks),
+                self.fail(opname + ": expected both operands to be numeric",
+                    "(%s, %s)" % (op1, op2))))
+        t = self.temp()
+        self.emit("%s = %s %s %s" % (t, op1, operator, op2))
+        self.push(t, True)
+
+    def gen_compare(self, op, arg):
+        (op1, numeric1) = self.pop()
+        (op2, numeric2) = self.pop()
+        t = self.temp()
+        self.emit("%s = 1 if %s %s %s else 0" % (t, op1, self.COMPARE[op], op2))
+        self.push(t, True)
+
+    def gen_pushscope(self, op, arg):
+        self.emit("vm.op_pushscope()")
+        self.emit("S = vm.SLOTS")
+        self.slots = {}
+
+    def gen_popscope(self, op, arg):
+        self.emit("vm.op_popscope()")
+        self.emit("S = vm.SLOTS")
+        self.slots = {}
+
+    def gen_memostore(self, op, arg):
+        (val, numeric) = self.pop()
+        self.emit("vm.memo.put(vm.MEMO_STACK.pop(), %s)" % val)
+        self.push(val, numeric)
+
+    # instructions that end a block
+
+    def gen_jump(self, op, arg):
+        (addr, numeric) = self.pop()
+        self.flush()
+        self.emit("return %s" % addr)
+        return True
+
+    def gen_jumpif0(self, op, arg):
+        (addr, numeric) = self.pop()
+        (test, numeric) = self.pop()
+        self.flush()
+        self.emit("if %s == 0: return %s" % (test, addr))
+        self.emit("return %d" % self.after())
+        return True
+
+    def gen_jumpabs(self, op, arg):
+        self.flush()
+        self.emit("return %d" % arg)
+        return True
+
+    def gen_jumpifnot(self, op, arg):
+        (op1, numeric1) = self.pop()
+        (op2, numeric2) = self.pop()
+        self.flush()
+        self.emit("if not %s %s %s: return %d" % (op1, self.COMPARE[op], op2, arg))
+        self.emit("return %d" % self.after())
+        return True
+
+    def gen_gosub(self, op, arg):
+        self.emit("IPS.append(%d)" % self.offset)
+        (addr, numeric) = self.pop()
+        self.flush()
+        self.emit("return %s" % addr)
+        return True
+
+    def gen_callsub(self, op, arg):
+        self.flush()
+        self.emit("vm.op_pushscope()")
+        # return to the last byte of CALLSUB, like BasicVM does
+        self.emit("IPS.append(%d)" % (self.offset + 2))
+        self.emit("return %d" % arg)
+        return True
+
+    def gen_memocall(self, op, arg):
+        (addr, numeric) = self.pop()
+        self.flush()
+        # return to the count byte, like BasicVM does
+        self.emit("return vm.MemoCall(%s, %d, %d)" % (addr, arg, self.offset + 1))
+        return True
+
+    def gen_return(self, op, arg):
+        self.flush()
+        self.emit("return IPS.pop() + 1")
+        return True
+
+    def gen_halt(self, op, arg):
+        self.flush()
+        self.emit("vm.halted = True")
+        self.emit("return %d" % (self.offset + 1))
+        return True
+
+
+if __name__ == "__main__":
+    from lexer import tokenize
+    from parser import parse
+    from translator import translate
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r') as f:
+            prog = f.read()
+    else:
+        from samples import sample_prog as prog
+
+    (code, strings) = translate(parse(tokenize(prog)))
+    vm = BlockVM()
+    vm.Load(code, strings)
+    vm.Run()
+    for start in sorted(vm.blocks):
+        print
+        print vm.BlockSource(start)
@@ -0,0 +1,213 @@
+import collections
+import re
+import struct
+from lexer import tokenize, keywords
+from parser import parse
+from translator import TContext, TranslatorError, codegen_program, MAX_LITERAL2
+
+
+# one label-delimited piece of a program, translated as if it started at
+# address 0
+#   code      its bytecode, without metadata bytes
+#   labels    label => offset in code, for the labels it defines
+#   fixups    (offset in code, label) for every label address it uses
+#   accepts   label => ACCEPT count, for the COMPUTE checks
+#   computes  (label, argument count) for every COMPUTE in it
+#   lines     (offset in code, line in the region) for its statements
+Region = collections.namedtuple('Region',
+    ['code', 'labels', 'fixups', 'accepts', 'computes', 'lines'])
+
+# a line that lexes as ID COLON NEWLINE. The lexer tries BE before
+# identifiers, so an identifier can't start with it.
+LABEL_LINE = r'[ \t]*(?!BE)([A-Za-z][A-Za-z0-9_]*)[ \t]*:[ \t]*(//.*)?'
+label_line = re.compile(LABEL_LINE + r'\n?$').match
+
+# the first label line in a string from pos on, without going line by line
+find_label_line = re.compile(r'^' + LABEL_LINE + r'$', re.M).search
+
+
+def split_regions(source):
+    """Split source into label-delimited chunks of text. Every chunk but
+    maybe the first starts with a label line."""
+    regions = []
+    current = []
+    for line in source.splitlines(True):
+        if current and is_label(line):
+            regions.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        regions.append("".join(current))
+    return regions
+
+
+def is_label(line):
+    match = label_line(line)
+    return match is not None and match.group(1) not in keywords
+
+
+def needs_wide(size, fixups, wide):
+    """Whether code needs 4-byte label addresses, given its size with
+    metadata and its number of label fixups when translated with wide or
+    narrow ones. Only the label addresses change size, so one way's size
+    gives the other's."""
+    if wide:
+        size -= 2 * fixups
+    return size > MAX_LITERAL2
+
+
+class IncrementalCompiler(object):
+    """Compiles a program that's being edited, keeping what it can between
+    calls to Compile.
+
+    The source is split into regions at its labels. Regions whose text
+    hasn't changed since the last Compile aren't lexed, parsed or
+    translated again, they're just linked back together, so the cost of a
+    recompile follows the size of the edit rather than of the program.
+
+    Slot numbers and constant pool entries are shared by every region and
+    never taken back, so regions can be reused as-is wherever they end up.
+    After a lot of editing the pool may hold strings nothing uses any more;
+    a new IncrementalCompiler starts clean."""
+
+    def __init__(self):
+        self.regions = {}       # region text => Region
+        self.string_table = []
+        self.const_index = {}
+        self.slot_table = {}
+        self.wide = False
+        self.label_table = {}
+        self.line_table = []
+
+    def Compile(self, source):
+        """Compile the latest version of source, returning (code, strings)
+        like translate. The label table is left in self.label_table, and
+        (offset, line) pairs for linetable in self.line_table."""
+        texts = split_regions(source)
+        regions = [self.CompileRegion(text) for text in texts]
+        # only keep what the current version uses
+        self.regions = dict(zip(texts, regions))
+
+        # label addresses need a LITERAL4 while the code is too big for a
+        # LITERAL2, and can go back to one once an edit shrinks it again
+        wide = needs_wide(4 + sum(len(r.code) for r in regions),
+            sum(len(r.fixups) for r in regions), self.wide)
+        if wide != self.wide:
+            self.wide = wide
+            self.regions = {}
+            regions = [self.CompileRegion(text) for text in texts]
+            self.regions = dict(zip(texts, regions))
+
+        # the line each region starts on
+        firsts = [0]
+        for text in texts[:-1]:
+            firsts.append(firsts[-1] + text.count("\n"))
+        return self.Link(regions, firsts)
+
+    def CompileRegion(self, text):
+        region = self.regions.get(text)
+        if region is not None:
+            return region
+
+        ctx = TContext(wide=self.wide)
+        ctx.string_table = self.string_table
+        ctx.const_index = self.const_index
+        ctx.slot_table = self.slot_table
+        return translate_region(text, ctx)
+
+    def Link(self, regions, firsts):
+        (code, self.label_table, self.line_table) = link(regions, firsts, self.wide)
+        return (code, self.string_table)
+
+
+def translate_region(text, ctx):
+    """Translate one region's text with ctx, which says whether addresses
+    are wide and holds the slot and constant tables to use"""
+    # leave out the metadata bytes, and make offsets relative to what's left
+    base = len(ctx.code)
+    codegen_program(parse(tokenize(text), lines=True), ctx)
+    return Region(
+        code=ctx.code[base:],
+        labels=dict((label, addr - base)
+            for (label, addr) in ctx.label_table.items()),
+        fixups=[(addr - base, label) for (label, addr) in ctx.label_fixups],
+        accepts=ctx.check_accepts,
+        computes=ctx.check_computes,
+        lines=[(addr - base, line) for (addr, line) in ctx.line_table],
+    )
+
+
+def link(regions, firsts, wide):
+    """Put regions together into a program, starting on the given lines,
+    and fill in their label addresses. Returns (code, label table, line
+    table), the same as translating the whole program would give."""
+    code = bytearray([ord("P"), ord("B"), ord("0"), ord("1")])
+    labels = {}
+    accepts = {}
+    bases = []
+    lines = []
+    for (region, first) in zip(regions, firsts):
+        bases.append(len(code))
+        for (offset, line) in region.lines:
+            if lines and lines[-1][0] == len(code) + offset:
+                lines.pop()
+            lines.append((len(code) + offset, first + line))
+        for (label, offset) in region.labels.items():
+            if label.startswith("$IF_"):
+                # labels the translator makes up for IFs are named after
+                # where the IF starts, so they're only unique within a
+                # region until they're renamed for where it ends up
+                label = "$IF_" + str(len(code) + int(label[4:]) - 4)
+            elif label in labels:
+                raise TranslatorError("label already exists", label)
+            labels[label] = len(code) + offset
+        accepts.update(region.accepts)
+        code.extend(region.code)
+
+    fmt = ">i" if wide else ">h"
+    for (region, base) in zip(regions, bases):
+        for (offset, label) in region.fixups:
+            if label in region.labels:
+                addr = base + region.labels[label]
+            elif label in labels:
+                addr = labels[label]
+            else:
+                raise TranslatorError("undefined label", label)
+            pos = base + offset
+            code[pos:pos+struct.calcsize(fmt)] = struct.pack(fmt, addr)
+
+    for region in regions:
+        for (compute_label, compute_count) in region.computes:
+            if accepts[compute_label] != compute_count:
+                raise TranslatorError("Incorrect argument count for a COMPUTE", compute_label)
+
+    return (code, labels, lines)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from translator import translate
+
+    if len(sys.argv) > 1:
+        print "opening file", sys.argv[1]
+        with open(sys.argv[1], 'r') as f:
+            prog = f.read()
+    else:
+        from samples import sample_prog as prog
+        prog = prog + "".join("sub%d:\nLET x BE %d\nRETURN x\n" % (i, i)
+            for i in range(2000))
+
+    start = time.time()
+    translate(parse(tokenize(prog)))
+    print "full compile: %.3fs" % (time.time() - start)
+
+    compiler = IncrementalCompiler()
+    start = time.time()
+    compiler.Compile(prog)
+    print "first incremental compile: %.3fs" % (time.time() - start)
+
+    edited = prog.replace("\n", "\nLET edited BE 1\n", 1)
+    start = time.time()
+    compiler.Compile(edited)
+    print "recompile after a one-line edit: %.3fs" % (time.time() - start)
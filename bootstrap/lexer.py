@@ -1,6 +1,7 @@
 # shamelessly borrowed and adapted from
 # https://docs.python.org/3/library/re.html#writing-a-tokenizer
 
+import array
 import collections
 import re
 import sys
@@ -10,34 +11,157 @@ class LexerError(RuntimeError):
 
 Token = collections.namedtuple('Token', ['typ', 'value', 'line', 'column'])
 
+keywords = {'IF', 'THEN', 'PRINT', 'GOTO', 'INPUT', 'LET', 'CALL',
+    'COMPUTE', 'AS', 'ACCEPT', 'RETURN', 'CLEAR', 'END'}
+
+token_specification = [
+    ('NUMBER',  r'(\-)?\d+(\.\d*)?'), # Integer or decimal number
+    ('STRING',  r'"([^"])*"'),   # Simple strings (no escape character)
+    ('ASSIGN',  r'BE'),          # Assignment operator
+    ('ID',      r'[A-Za-z][A-Za-z0-9_]*'),  # Identifiers
+    ('COMMENT', r'\/\/.*'),      # Comments
+    ('ARITHOP', r'[+*\/\-]'),    # Arithmetic operators
+    ('COMPOP',  r'<|<=|=|!=|=>|>'),    # Comparison operators
+    ('COLON',   r':'),           # Colon (as in labels)
+    ('COMMA',   r','),           # Comma (as in expression lists)
+    ('LPAREN',  r'\('),           # Left parenthesis
+    ('RPAREN',  r'\)'),           # Left parenthesis
+    ('NEWLINE', r'\n'),          # Line endings
+    ('SKIP',    r'[ \t]+'),      # Skip over spaces and tabs
+]
+get_token = re.compile('|'.join('(?P<%s>%s)' % pair
+    for pair in token_specification)).match
+
+# how much tokenize_file reads at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class TokenType(object):
+    """Small integer codes for the token types, for compact token streams
+    and for the parser to compare instead of the type names"""
+
+    NUMBER      = 0
+    STRING      = 1
+    ASSIGN      = 2
+    ID          = 3
+    ARITHOP     = 4
+    COMPOP      = 5
+    COLON       = 6
+    COMMA       = 7
+    LPAREN      = 8
+    RPAREN      = 9
+    NEWLINE     = 10
+
+    # keywords
+    IF          = 20
+    THEN        = 21
+    PRINT       = 22
+    GOTO        = 23
+    INPUT       = 24
+    LET         = 25
+    CALL        = 26
+    COMPUTE     = 27
+    AS          = 28
+    ACCEPT      = 29
+    RETURN      = 30
+    CLEAR       = 31
+    END         = 32
+
+# type name => code, and back
+TYPE_CODES = dict((name, code) for (name, code) in vars(TokenType).items()
+    if not name.startswith("_"))
+TYPE_NAMES = dict((code, name) for (name, code) in TYPE_CODES.items())
+
+
+class TokenArray(object):
+    """A token stream stored column by column: a byte array of type codes
+    and integer arrays of lines, columns and values, where a value is an
+    index into a table of the distinct value strings. Each identifier,
+    keyword or operator is stored once however often it comes up, so a
+    token takes about 13 bytes rather than a namedtuple and its strings.
+
+    Indexing or iterating gives Tokens like tokenize's, built as they're
+    asked for. The parser reads the columns directly."""
+
+    def __init__(self, tokens=()):
+        self.types = array.array('B')
+        self.values = array.array('l')
+        self.lines = array.array('l')
+        self.columns = array.array('l')
+        self.strings = []       # value index => value
+        self.string_ids = {}    # value => value index
+        self.extend(tokens)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        return Token(TYPE_NAMES[self.types[i]], self.strings[self.values[i]],
+            self.lines[i], self.columns[i])
+
+    def __iter__(self):
+        for i in xrange(len(self.types)):
+            yield self[i]
+
+    def append(self, token):
+        self.extend((token,))
+
+    def extend(self, tokens):
+        (types, values) = (self.types.append, self.values.append)
+        (lines, columns) = (self.lines.append, self.columns.append)
+        (strings, string_ids) = (self.strings, self.string_ids)
+        for (typ, value, line, column) in tokens:
+            index = string_ids.get(value)
+            if index is None:
+                index = string_ids[value] = len(strings)
+                strings.append(intern(value))
+            types(TYPE_CODES[typ])
+            values(index)
+            lines(line)
+            columns(column)
+
+
 def tokenize(s):
-    keywords = {'IF', 'THEN', 'PRINT', 'GOTO', 'INPUT', 'LET', 'CALL',
-        'COMPUTE', 'AS', 'ACCEPT', 'RETURN', 'CLEAR', 'END'}
-    token_specification = [
-        ('NUMBER',  r'(\-)?\d+(\.\d*)?'), # Integer or decimal number
-        ('STRING',  r'"([^"])*"'),   # Simple strings (no escape character)
-        ('ASSIGN',  r'BE'),          # Assignment operator
-        ('ID',      r'[A-Za-z][A-Za-z0-9_]*'),  # Identifiers
-        ('COMMENT', r'\/\/.*'),      # Comments
-        ('ARITHOP', r'[+*\/\-]'),    # Arithmetic operators
-        ('COMPOP',  r'<|<=|=|!=|=>|>'),    # Comparison operators
-        ('COLON',   r':'),           # Colon (as in labels)
-        ('COMMA',   r','),           # Comma (as in expression lists)
-        ('LPAREN',  r'\('),           # Left parenthesis
-        ('RPAREN',  r'\)'),           # Left parenthesis
-        ('NEWLINE', r'\n'),          # Line endings
-        ('SKIP',    r'[ \t]'),       # Skip over spaces and tabs
-    ]
-    tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in token_specification)
-    get_token = re.compile(tok_regex).match
+    """Tokenize a string, or anything else re can match against, like an
+    mmap of a source file, which is read straight from the mapping."""
+    return scan([s])
+
+
+def tokenize_file(f, chunk_size=CHUNK_SIZE):
+    """Tokenize a file object a chunk at a time, so only about a chunk of
+    the source is in memory however big it is. The tokens are the same as
+    tokenize would give for the whole file."""
+    return scan(iter(lambda: f.read(chunk_size), ""))
+
+
+def tokenize_compact(s):
+    """Tokenize a string into a TokenArray"""
+    return TokenArray(tokenize(s))
+
+
+def scan(chunks):
+    """Tokenize the source that's the chunks put end to end. Positions are
+    in the whole source, and tokens can span chunks."""
+    chunks = iter(chunks)
+    s = next(chunks, "")
+    more = next(chunks, None)   # the chunk after s, None at the end
+    base = 0                    # offset of s in the whole source
     line = 1
-    pos = line_start = 0
-    mo = get_token(s)
-    while mo is not None:
+    pos = line_start = 0        # line_start is in the whole source
+    while True:
+        mo = get_token(s, pos)
+        if more is not None and (mo is None or mo.end() == len(s)):
+            # the token might not be all there yet, so go again with the
+            # next chunk on the end, dropping what's done with
+            (s, base, pos) = (s[pos:] + more, base + pos, 0)
+            more = next(chunks, None)
+            continue
+        if mo is None:
+            break
         typ = mo.lastgroup
         if typ == 'NEWLINE':
-            yield Token(typ, "\n", line, mo.start()-line_start)
-            line_start = pos + 1
+            yield Token(typ, "\n", line, base+mo.start()-line_start)
+            line_start = base + mo.end()
             line += 1
         elif typ == 'COMMENT':
             pass
@@ -48,9 +172,8 @@ def tokenize(s):
             if typ == 'STRING':
                 # remove the surrounding quotes
                 val = val[1:-1]
-            yield Token(typ, val, line, mo.start()-line_start)
+            yield Token(typ, val, line, base+mo.start()-line_start)
         pos = mo.end()
-        mo = get_token(s, pos)
     if pos != len(s):
         raise LexerError('Unexpected character %r on line %d' %(s[pos], line))
 
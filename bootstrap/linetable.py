@@ -0,0 +1,60 @@
+"""Compact tables mapping bytecode offsets to source lines.
+
+A table is a string of byte pairs, like CPython's co_lnotab: how far the
+offset moves on from the last entry (0 to 254) and how far the line does
+(-127 to 126). Bigger steps are split over several pairs, padded with an
+offset step of 255 or a line step of 127 or -128, so a pair is padding
+exactly when it has one of those and otherwise ends an entry. Each entry
+says that code from its offset on comes from its line, up to the offset
+of the next entry.
+
+That's about 2 bytes a statement, so a running VM can keep it around
+without keeping the source, tokens or AST."""
+
+
+def encode(pairs):
+    """Build a table from (offset, line) pairs, in order of offset"""
+    out = bytearray()
+    (last_offset, last_line) = (0, 0)
+    for (offset, line) in pairs:
+        (offset_step, line_step) = (offset - last_offset, line - last_line)
+        if offset_step < 0:
+            raise ValueError("line table offsets go backwards", offset)
+        while offset_step >= 255:
+            out.extend((255, 0))
+            offset_step -= 255
+        while line_step >= 127:
+            out.extend((offset_step, 127))
+            (offset_step, line_step) = (0, line_step - 127)
+        while line_step <= -128:
+            out.extend((offset_step, 128))
+            (offset_step, line_step) = (0, line_step + 128)
+        out.extend((offset_step, line_step & 0xff))
+        (last_offset, last_line) = (offset, line)
+    return str(out)
+
+
+def decode(table):
+    """The (offset, line) entries of a table, with split steps put back
+    together"""
+    (offset, line) = (0, 0)
+    entries = []
+    for i in range(0, len(table) - 1, 2):
+        offset_step = ord(table[i])
+        step = ord(table[i+1])
+        offset += offset_step
+        line += step - 256 if step > 127 else step
+        if offset_step != 255 and step not in (127, 128):
+            entries.append((offset, line))
+    return entries
+
+
+def line_for(table, loc):
+    """The source line of the code at byte offset loc, or None if the table
+    doesn't cover it"""
+    result = None
+    for (offset, line) in decode(table):
+        if offset > loc:
+            break
+        result = line
+    return result
@@ -0,0 +1,35 @@
+import collections
+
+
+class LruCache(object):
+    """A dict that holds at most size entries, dropping the least recently
+    used one to make room for a new one. Counts hits and misses, for
+    seeing how well memoization is doing.
+
+    None is what get returns for a miss, so it can't be stored."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        # back in at the most recently used end
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.size:
+            self.entries.popitem(last=False)
+        self.entries[key] = value
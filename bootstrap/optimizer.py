@@ -0,0 +1,235 @@
+import pprint
+import sys
+from parser import PClear, PLabel, PLet, PPrint, PIf, PGoto, PInput, PEnd
+from parser import PExpr, PVar, PNumber, PArith, PString
+from parser import PCall, PCompute, PReturn, PAccept, PLine
+
+
+def optimize(ast):
+    """Fold constant expressions, resolve IFs with constant comparisons and
+    drop code that can never run.
+
+    Returns the new statement list and the number of VM instructions the
+    translator no longer has to emit for it."""
+    before = sum(cost(op) for op in ast)
+
+    ast = [fold_stmt(op) for op in ast]
+    ast = [op for op in ast if op is not None]
+
+    # removing dead code can orphan labels and vice versa, so keep going
+    # until neither finds anything
+    while True:
+        size = len(ast)
+        ast = drop_unreachable(ast)
+        ast = drop_unused_labels(ast)
+        if len(ast) == size:
+            break
+
+    return (ast, before - sum(cost(op) for op in ast))
+
+
+def cost(op):
+    """How many instructions the translator emits for a statement"""
+    if type(op) in (PLabel, PLine):
+        return 0
+    elif type(op) == PLet:
+        return cost_expr(op.rhs) + 1
+    elif type(op) == PPrint:
+        return sum(cost_expr(item) + 1 for item in op.rhs)
+    elif type(op) == PIf:
+        return cost_expr(op.expr1) + cost_expr(op.expr2) + 3 + cost(op.stmt)
+    elif type(op) == PGoto:
+        return 2
+    elif type(op) == PInput:
+        return len(op.rhs)
+    elif type(op) == PCall:
+        return 3
+    elif type(op) == PCompute:
+        return sum(cost_expr(arg) for arg in op.args) + 4
+    elif type(op) == PAccept:
+        return len(op.rhs)
+    elif type(op) == PReturn:
+        return cost_expr(op.expr) + 2 if op.expr else 2
+    return 1
+
+def cost_expr(expr):
+    if type(expr) == PExpr:
+        return len(expr.expr)
+    return 1
+
+
+def fold_stmt(op):
+    """Fold the expressions in a statement. Returns None if the statement
+    turned out to do nothing."""
+    if type(op) == PLet:
+        return PLet(op.id, fold_expr(op.rhs))
+
+    elif type(op) == PPrint:
+        return PPrint([fold_expr(item) for item in op.rhs])
+
+    elif type(op) == PCompute:
+        return PCompute(op.label, op.id, [fold_expr(arg) for arg in op.args])
+
+    elif type(op) == PReturn:
+        return PReturn(fold_expr(op.expr) if op.expr else op.expr)
+
+    elif type(op) == PIf:
+        expr1 = fold_expr(op.expr1)
+        expr2 = fold_expr(op.expr2)
+        result = compare(expr1, op.compop, expr2)
+        if result is None:
+            return PIf(expr1, op.compop, expr2, fold_stmt(op.stmt) or op.stmt)
+        elif result:
+            return fold_stmt(op.stmt)
+        else:
+            return None
+
+    return op
+
+
+def constant(expr):
+    """The integer value of an expression, or None if it isn't constant"""
+    if type(expr) == PExpr and len(expr.expr) == 1 and \
+            type(expr.expr[0]) == PNumber and "." not in expr.expr[0].value:
+        return int(expr.expr[0].value)
+    return None
+
+
+def compare(expr1, compop, expr2):
+    """Statically evaluate a comparison, or None if that isn't possible"""
+    (a, b) = (constant(expr1), constant(expr2))
+    if a is None or b is None:
+        return None
+    # !=, > and >= currently share opcodes with =, < and <= in the VM, so
+    # they are left for the VM to decide
+    if compop == "=":
+        return a == b
+    elif compop == "<":
+        return a < b
+    elif compop == "<=":
+        return a <= b
+    return None
+
+
+def fold_expr(expr):
+    """Fold the constant parts of an RPN expression.
+
+    Only integers get folded: FLOAT4 literals are single precision but the
+    VM does its arithmetic in double precision, so folding floats would
+    change results. Integers don't overflow in the VM, so they fold
+    whatever their size, and the translator picks a LITERAL2, a LITERAL4
+    or a pool entry for the result."""
+    if type(expr) != PExpr:
+        return expr
+
+    # each entry is either an int (a constant) or a list of RPN items
+    stack = []
+    for item in expr.expr:
+        if type(item) == PNumber and "." not in item.value:
+            stack.append(int(item.value))
+        elif type(item) == PArith:
+            if len(stack) < 2:
+                return expr
+            b = stack.pop()
+            a = stack.pop()
+            value = None
+            if type(a) != list and type(b) != list:
+                value = arith(a, item.op, b)
+            if value is not None:
+                stack.append(value)
+            else:
+                stack.append(rpn(a) + rpn(b) + [item])
+        else:
+            stack.append([item])
+
+    if len(stack) != 1:
+        return expr
+    return PExpr(rpn(stack[0]))
+
+def rpn(entry):
+    if type(entry) == list:
+        return entry
+    return [PNumber(value=str(entry))]
+
+def arith(a, op, b):
+    if op == "+":
+        value = a + b
+    elif op == "-":
+        value = a - b
+    elif op == "*":
+        value = a * b
+    elif op == "/":
+        if b == 0:
+            # leave it for the VM to report
+            return None
+        value = a / b
+    else:
+        return None
+    return value
+
+
+def terminates(op):
+    """Whether control never falls through to the next statement"""
+    return type(op) in (PEnd, PGoto, PReturn)
+
+def drop_unreachable(ast):
+    """Drop statements between an END/GOTO/RETURN and the next label.
+
+    ACCEPTs stay, since the COMPUTE argument count check looks at them."""
+    result = []
+    reachable = True
+    for op in ast:
+        if type(op) == PLabel:
+            reachable = True
+        elif not reachable and type(op) != PAccept:
+            continue
+        result.append(op)
+        if terminates(op):
+            reachable = False
+    return result
+
+def referenced_labels(ast):
+    labels = set()
+    for op in ast:
+        while type(op) == PIf:
+            op = op.stmt
+        if type(op) == PGoto:
+            labels.add(op.id)
+        elif type(op) in (PCall, PCompute):
+            labels.add(op.label)
+    return labels
+
+def drop_unused_labels(ast):
+    """Drop labels nothing jumps to, calls or computes.
+
+    A label with an ACCEPT after it stays, since the translator checks the
+    ACCEPT against the nearest label before it."""
+    used = referenced_labels(ast)
+    result = []
+    for (i, op) in enumerate(ast):
+        if type(op) == PLabel and op.id not in used:
+            region = []
+            for following in ast[i+1:]:
+                if type(following) == PLabel:
+                    break
+                region.append(following)
+            if not any(type(stmt) == PAccept for stmt in region):
+                continue
+        result.append(op)
+    return result
+
+
+if __name__ == "__main__":
+    from lexer import tokenize
+    from parser import parse
+
+    if len(sys.argv) > 1:
+        print "opening file", sys.argv[1]
+        with open(sys.argv[1], 'r') as f:
+            prog = f.read()
+    else:
+        from samples import sample_prog as prog
+
+    (ast, removed) = optimize(parse(tokenize(prog)))
+    pprint.pprint(ast)
+    print "\nRemoved", removed, "instructions"
@@ -0,0 +1,180 @@
+import collections
+import cPickle
+import multiprocessing
+from lexer import tokenize, keywords, LexerError
+from parser import parse_iter, ParserError
+from translator import TContext, TranslatorError, translate_stream, slot_names
+from translator import MAX_LITERAL2
+from incremental import translate_region, link, find_label_line, needs_wide
+from vm import decode, SLOT_OPS, POOL_OPS
+
+
+# one piece of a program, translated on its own with its own tables
+#   region     its incremental.Region
+#   slots      its variable names, in slot order
+#   strings    its constant pool
+#   slot_refs  offsets in region.code of the slot numbers it uses
+#   pool_refs  offsets in region.code of the constant pool indexes it uses
+Chunk = collections.namedtuple('Chunk',
+    ['region', 'slots', 'strings', 'slot_refs', 'pool_refs'])
+
+# smaller pieces than this cost more to send to a worker than to translate
+MIN_CHUNK_SIZE = 16 * 1024
+
+# pieces per worker, so one slow piece doesn't hold up the others
+CHUNKS_PER_WORKER = 4
+
+# what makes translate_parallel go serial instead: the errors a piece can
+# hit where the whole program might not, like a string that runs over a
+# line that looks like a label, and the pool not being able to start or
+# pass things between processes. Anything else is a bug, and raised.
+FALL_BACK_ERRORS = (LexerError, ParserError, TranslatorError, KeyError,
+    cPickle.PicklingError, cPickle.UnpicklingError, OSError)
+
+
+def split_chunks(source, count, min_size=MIN_CHUNK_SIZE):
+    """Split source at label lines into at most about count pieces of text
+    of about the same size"""
+    size = max(len(source) // count, min_size)
+    starts = [0]
+    match = find_label_line(source, size)
+    while match is not None:
+        if match.group(1) in keywords:
+            match = find_label_line(source, match.end())
+            continue
+        if match.start() > starts[-1]:
+            starts.append(match.start())
+        match = find_label_line(source, match.start() + size)
+    ends = starts[1:] + [len(source)]
+    return [source[start:end] for (start, end) in zip(starts, ends)]
+
+
+def translate_chunk(args):
+    """Translate one piece in a worker, noting where its slot numbers and
+    pool indexes are so they can be renumbered for the whole program"""
+    (text, wide) = args
+    ctx = TContext(wide=wide)
+    region = translate_region(text, ctx)
+    slot_refs = []
+    pool_refs = []
+    for (offset, op, operand) in decode(region.code, 0):
+        if op in SLOT_OPS:
+            slot_refs.append(offset + 1)
+        elif op in POOL_OPS:
+            pool_refs.append(offset + 1)
+    return Chunk(region, slot_names(ctx), ctx.string_table, slot_refs, pool_refs)
+
+
+def translate_parallel(source, workers=None, min_chunk=MIN_CHUNK_SIZE,
+        errors=None):
+    """Translate one program on several processes, returning the TContext.
+
+    The source is split into pieces at labels, which are lexed, parsed and
+    translated in a pool of workers and then linked together. Slots and
+    constant pool entries are numbered by first use, piece by piece, so the
+    code, strings, labels and lines are the same, byte for byte, as
+    translate_stream gives for the whole source with lines. Like it,
+    there's no inlining or memoizing. workers defaults to the number of
+    CPUs.
+
+    If a piece fails with a syntax or translation error, or the pool
+    does, the program is translated serially instead, so errors are the
+    ones the serial translator gives. Given an errors list, that collects
+    the syntax errors the way parse does."""
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    try:
+        pool = multiprocessing.Pool(processes=workers)
+    except OSError:
+        return translate_serial(source, errors)
+    try:
+        texts = split_chunks(source, workers * CHUNKS_PER_WORKER, min_chunk)
+        # the line each piece starts on
+        firsts = [0]
+        for text in texts[:-1]:
+            firsts.append(firsts[-1] + text.count("\n"))
+
+        # guess whether label addresses need 4 bytes, and go again if not
+        wide = len(source) > MAX_LITERAL2
+        chunks = pool.map(translate_chunk, [(text, wide) for text in texts])
+        if needs_wide(4 + sum(len(chunk.region.code) for chunk in chunks),
+                sum(len(chunk.region.fixups) for chunk in chunks), wide) != wide:
+            wide = not wide
+            chunks = pool.map(translate_chunk, [(text, wide) for text in texts])
+        return merge(chunks, firsts, wide)
+    except FALL_BACK_ERRORS:
+        return translate_serial(source, errors)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def translate_serial(source, errors=None):
+    """What translate_parallel has to match"""
+    def statements():
+        if errors is not None:
+            # only keep the last pass's, if it takes two
+            del errors[:]
+        return parse_iter(tokenize(source), lines=True, errors=errors)
+    return translate_stream(statements)
+
+
+def merge(chunks, firsts, wide):
+    """Link translated pieces into one program, in a TContext"""
+    ctx = TContext(wide=wide)
+    for chunk in chunks:
+        slots = [ctx.slot_table.setdefault(name, len(ctx.slot_table))
+            for name in chunk.slots]
+        pool = []
+        for value in chunk.strings:
+            key = (type(value), value)
+            if key not in ctx.const_index:
+                ctx.const_index[key] = len(ctx.string_table)
+                ctx.string_table.append(value)
+            pool.append(ctx.const_index[key])
+        if len(ctx.slot_table) > 0x10000:
+            raise TranslatorError("too many variables", chunk.slots[-1])
+        if len(ctx.string_table) > 0x10000:
+            raise TranslatorError("too many constants", chunk.strings[-1])
+        renumber(chunk.region.code, chunk.slot_refs, slots)
+        renumber(chunk.region.code, chunk.pool_refs, pool)
+
+    (ctx.code, ctx.label_table, ctx.line_table) = link(
+        [chunk.region for chunk in chunks], firsts, wide)
+    return ctx
+
+
+def renumber(code, refs, numbers):
+    """Replace each 2-byte number at the offsets in refs with what numbers
+    maps it to"""
+    if numbers == range(len(numbers)):
+        # the first piece, or one that only uses new names
+        return
+    for pos in refs:
+        number = numbers[code[pos] << 8 | code[pos+1]]
+        code[pos] = number >> 8
+        code[pos+1] = number & 0xff
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r') as f:
+            source = f.read()
+    else:
+        from samples import sample_prog
+        source = sample_prog + "".join(
+            "sub%d:\nLET x BE %d\nPRINT \"sub\", x * y\nRETURN x\n" % (i, i)
+            for i in range(20000))
+
+    start = time.time()
+    serial = translate_serial(source)
+    print "serial: %.3fs" % (time.time() - start)
+
+    start = time.time()
+    ctx = translate_parallel(source)
+    print "parallel, %d CPUs: %.3fs" % (multiprocessing.cpu_count(),
+        time.time() - start)
+    print "same code:", ctx.code == serial.code
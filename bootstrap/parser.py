@@ -1,7 +1,8 @@
 import pprint
 import sys
-from lexer import Token
+from lexer import Token, TokenArray, TokenType, TYPE_CODES
 import collections
+import itertools
 
 
 class ParserError(RuntimeError):
@@ -25,6 +26,8 @@ PCall    = collections.namedtuple('PCall', ['label'])
 PCompute = collections.namedtuple('PCompute', ['label', 'id', 'args'])
 PReturn  = collections.namedtuple('PReturn', ['expr'])
 PAccept  = collections.namedtuple('PAccept', ['rhs'])
+# not a statement: the source line of the statement after it
+PLine    = collections.namedtuple('PLine', ['line'])
 
 
 operator_table = {
@@ -36,120 +39,150 @@ operator_table = {
 
 
 class Parser(object):
-    def __init__(self, tokens):
+    """Parses a stream of Tokens. The current token's type code is in typ,
+    which is what the parser compares, its value in value and the token
+    itself in token.
+
+    Without an errors list, the first syntax error is raised. With one,
+    every ParserError goes in it, and parsing carries on from the next
+    line, leaving out the statement that had the error."""
+
+    # first token's type code => the method that parses the statement
+    STATEMENTS = {
+        TokenType.LET:      "m_let",
+        TokenType.PRINT:    "m_print",
+        TokenType.IF:       "m_if",
+        TokenType.GOTO:     "m_goto",
+        TokenType.INPUT:    "m_input",
+        TokenType.CLEAR:    "m_clear",
+        TokenType.CALL:     "m_call",
+        TokenType.COMPUTE:  "m_compute",
+        TokenType.RETURN:   "m_return",
+        TokenType.ACCEPT:   "m_accept",
+        TokenType.END:      "m_end",
+    }
+
+    def __init__(self, tokens, lines=False, errors=None):
+        self.typ = None
+        self.value = None
+        self.lines = lines
+        self.errors = errors
+        self.dispatch = dict((typ, getattr(self, name))
+            for (typ, name) in self.STATEMENTS.items())
+        self.open(tokens)
+
+    def open(self, tokens):
         self.token_iter = iter(tokens)
         self.token = None
 
     def next(self):
+        """Move on to the next token, returning its type code"""
         self.token = self.token_iter.next()
-        return self.token
+        self.value = self.token.value
+        self.typ = TYPE_CODES[self.token.typ]
+        return self.typ
 
     def parse(self):
-        ast = []
+        return list(self.statements())
+
+    def statements(self):
+        """Generate the statements one at a time, reading only as many
+        tokens as each one needs"""
         while True:
             try:
                 self.next()
             except StopIteration:
                 break
 
-            if self.token.typ == "NEWLINE":
-                continue
-
-            elif self.token.typ == "ID":    # should be a line label
-                ast.append(self.m_label())
-                continue
+            try:
+                if self.typ == TokenType.NEWLINE:
+                    continue
 
-            else:
-                ast.append(self.m_stmt())
+                elif self.typ == TokenType.ID:    # should be a line label
+                    yield self.m_label()
+                    continue
 
-        return ast
+                else:
+                    if self.lines:
+                        yield PLine(self.token.line)
+                    yield self.m_stmt()
+            except StopIteration:
+                # a generator would just stop, dropping the statement
+                error = ParserError("unexpected end of input", self.token)
+                if self.errors is None:
+                    raise error
+                self.errors.append(error)
+                break
+            except ParserError, e:
+                if self.errors is None:
+                    raise
+                self.errors.append(e)
+                self.skip_line()
+
+    def skip_line(self):
+        """Drop tokens up to the end of the line, to get back in step after
+        an error"""
+        try:
+            while self.typ != TokenType.NEWLINE:
+                self.next()
+        except StopIteration:
+            pass
 
     def m_stmt(self):
-        if self.token.typ == "LET":
-            return self.m_let()
-
-        elif self.token.typ == "PRINT":
-            return self.m_print()
-
-        elif self.token.typ == "IF":
-            return self.m_if()
-
-        elif self.token.typ == "GOTO":
-            return self.m_goto()
-
-        elif self.token.typ == "INPUT":
-            return self.m_input()
-
-        elif self.token.typ == "CLEAR":
-            return self.m_clear()
-
-        elif self.token.typ == "CALL":
-            return self.m_call()
-
-        elif self.token.typ == "COMPUTE":
-            return self.m_compute()
-
-        elif self.token.typ == "RETURN":
-            return self.m_return()
-
-        elif self.token.typ == "ACCEPT":
-            return self.m_accept()
-
-        elif self.token.typ == "END":
-            return self.m_end()
-
-        else:
+        handler = self.dispatch.get(self.typ)
+        if handler is None:
             raise ParserError("unexpected token", self.token)
+        return handler()
 
     def m_label(self):
         id = self.token
-        (colon, newline) = (self.next(), self.next())
         # make sure colon and newline matched
-        if colon.typ == "COLON" and newline.typ == "NEWLINE":
+        if self.next() == TokenType.COLON and self.next() == TokenType.NEWLINE:
             return PLabel(id.value)
         raise ParserError("error parsing line label", id)
 
     def m_let(self):
-        (var, assign) = (self.next(), self.next())
-        if var.typ == "ID" and assign.typ == "ASSIGN":
+        (var_typ, var) = (self.next(), self.value)
+        if var_typ == TokenType.ID and self.next() == TokenType.ASSIGN:
             self.next()
-            return PLet(var.value, self.p_expr_or_string())
+            return PLet(var, self.p_expr_or_string())
         raise ParserError("error parsing LET statement", self.token)
 
     def m_return(self):
         self.next()
-        if self.token.typ == "NEWLINE":
+        if self.typ == TokenType.NEWLINE:
             return PReturn(expr=None)
         else:
             return PReturn(expr=self.p_expr())
 
     def m_call(self):
-        label = self.next()
-        if label.typ == "ID":
-            return PCall(label=label.value)
+        if self.next() == TokenType.ID:
+            return PCall(label=self.value)
         else:
             raise ParserError("error parsing CALL, expected a label", self.token)
 
     def m_compute(self):
-        (var, az, label) = (self.next(), self.next(), self.next())
-        if var.typ == "ID" and az.typ == "AS" and label.typ == "ID":
+        (var_typ, var) = (self.next(), self.value)
+        if (var_typ == TokenType.ID and self.next() == TokenType.AS
+                and self.next() == TokenType.ID):
+            label = self.value
             self.next()
-            return PCompute(label=label.value, id=var.value, args=self.p_arglist())
+            return PCompute(label=label, id=var, args=self.p_arglist())
         else:
-            raise ParserError("error parsing COMPUTE")
+            raise ParserError("error parsing COMPUTE", self.token)
 
     def m_accept(self):
         accept_vals = []
         self.next()
         while True:
-            if self.token.typ == "ID":
-                accept_vals.append(PVar(self.token.value))
+            if self.typ == TokenType.ID:
+                accept_vals.append(PVar(self.value))
                 self.next()
                 continue
-            elif self.token.typ == "COMMA":
+            elif self.typ == TokenType.COMMA:
                 self.next()
                 continue
-            elif self.token.typ == "NEWLINE":
+            elif self.typ == TokenType.NEWLINE:
                 break
             else:
                 raise ParserError("unexpected token", self.token)
@@ -160,10 +193,10 @@ class Parser(object):
         print_vals = []
         self.next()
         while True:
-            if self.token.typ == "COMMA":
+            if self.typ == TokenType.COMMA:
                 self.next()
                 continue
-            elif self.token.typ == "NEWLINE":
+            elif self.typ == TokenType.NEWLINE:
                 break
             else:
                 print_vals.append(self.p_expr_or_string())
@@ -175,31 +208,30 @@ class Parser(object):
     def m_if(self):
         self.next()
         expr1 = self.p_expr_or_string()
-        compop = self.token
+        (compop_typ, compop) = (self.typ, self.value)
         self.next()
         expr2 = self.p_expr_or_string()
-        then = self.token
-        if compop.typ == "COMPOP" and then.typ == "THEN":
+        if compop_typ == TokenType.COMPOP and self.typ == TokenType.THEN:
             self.next()
-            return PIf(expr1, compop.value, expr2, self.m_stmt())
+            return PIf(expr1, compop, expr2, self.m_stmt())
         raise ParserError("error parsing IF statement", self.token)
 
     def m_goto(self):
         self.next()
-        if self.token.typ == "ID":
-            return PGoto(self.token.value)
+        if self.typ == TokenType.ID:
+            return PGoto(self.value)
         raise ParserError("error parsing GOTO statement", self.token)
 
     def m_input(self):
         input_vars = []
         while True:
             self.next()
-            if self.token.typ == "ID":
-                input_vars.append(PVar(self.token.value))
+            if self.typ == TokenType.ID:
+                input_vars.append(PVar(self.value))
                 continue
-            elif self.token.typ == "COMMA":
+            elif self.typ == TokenType.COMMA:
                 continue
-            elif self.token.typ == "NEWLINE":
+            elif self.typ == TokenType.NEWLINE:
                 break
             else:
                 raise ParserError("error parsing INPUT statement", self.token)
@@ -214,22 +246,20 @@ class Parser(object):
 
     def p_arglist(self):
         args = []
-        while self.token.typ != "NEWLINE":
-            if self.token.typ == "COMMA":
-                break
-
-            else:
-                args.append(self.p_expr())
-
-            self.next()
+        while self.typ != TokenType.NEWLINE:
+            args.append(self.p_expr())
+            if self.typ == TokenType.COMMA:
+                self.next()
+            elif self.typ != TokenType.NEWLINE:
+                raise ParserError("expected ',' or the end of the line", self.token)
 
         return args
 
     def p_expr_or_string(self):
-        if self.token.typ == "STRING":
-            string_token = self.token
+        if self.typ == TokenType.STRING:
+            value = self.value
             self.next()
-            return PString(string_token.value)
+            return PString(value)
         else:
             return self.p_expr()
 
@@ -239,29 +269,31 @@ class Parser(object):
         http://en.wikipedia.org/wiki/Shunting_yard_algorithm"""
         global operator_table
 
-        allowed = ["NUMBER", "ID", "ARITHOP", "LPAREN", "RPAREN"]
+        allowed = (TokenType.NUMBER, TokenType.ID, TokenType.ARITHOP,
+            TokenType.LPAREN, TokenType.RPAREN)
 
-        op_stack = []
+        op_stack = []   # operator values, and "(" for an open parenthesis
+        parens = []     # the open parenthesis tokens, for errors
         expr = []
 
-        while self.token.typ in allowed:
-            if self.token.typ == "NUMBER":
-                expr.append(PNumber(value=self.token.value))
+        while self.typ in allowed:
+            if self.typ == TokenType.NUMBER:
+                expr.append(PNumber(value=self.value))
 
-            elif self.token.typ == "ID":
-                expr.append(PVar(id=self.token.value))
+            elif self.typ == TokenType.ID:
+                expr.append(PVar(id=self.value))
 
-            elif self.token.typ == "ARITHOP":
-                o1 = self.token
-                o1la = operator_table[o1.value]["left_associative"]
-                o1p = operator_table[o1.value]["precedence"]
+            elif self.typ == TokenType.ARITHOP:
+                o1 = self.value
+                o1la = operator_table[o1]["left_associative"]
+                o1p = operator_table[o1]["precedence"]
                 try:
                     o2 = op_stack[-1]
-                    while o2.typ == "ARITHOP":
-                        o2p = operator_table[o2.value]["precedence"]
+                    while o2 != "(":
+                        o2p = operator_table[o2]["precedence"]
                         if (o1la and o1p == o2p) or o1p < o2p:
                             op_stack.pop()
-                            expr.append(PArith(op=o2.value))
+                            expr.append(PArith(op=o2))
                         else:
                             break
                         o2 = op_stack[-1]
@@ -270,15 +302,16 @@ class Parser(object):
                     pass
                 op_stack.append(o1)
 
-            elif self.token.typ == "LPAREN":
-                op_stack.append(self.token)
+            elif self.typ == TokenType.LPAREN:
+                op_stack.append("(")
+                parens.append(self.token)
 
-            elif self.token.typ == "RPAREN":
+            elif self.typ == TokenType.RPAREN:
                 try:
                     peek = op_stack[-1]
-                    while peek.typ != "LPAREN":
+                    while peek != "(":
                         op_stack.pop()
-                        expr.append(PArith(op=peek.value))
+                        expr.append(PArith(op=peek))
                         peek = op_stack[-1]
                 except IndexError:
                     pass
@@ -286,6 +319,7 @@ class Parser(object):
                 # now the stack is either empty or has LPAREN at the top
                 if len(op_stack) > 0:
                     op_stack.pop()
+                    parens.pop()
                 else:
                     raise ParserError("mismatched parentheses, expected '('", self.token)
 
@@ -295,16 +329,56 @@ class Parser(object):
 
         while len(op_stack) > 0:
             remaining_op = op_stack.pop()
-            if remaining_op.typ != "LPAREN":
-                expr.append(PArith(op=remaining_op.value))
+            if remaining_op != "(":
+                expr.append(PArith(op=remaining_op))
             else:
-                raise ParserError("mismatched parentheses, expected ')'", remaining_op)
+                raise ParserError("mismatched parentheses, expected ')'", parens.pop())
 
+        if not expr:
+            # and nothing was read, so PRINT would keep on trying
+            raise ParserError("expected an expression", self.token)
         return PExpr(expr)
 
 
-def parse(tokens):
-    return Parser(tokens).parse()
+class CompactParser(Parser):
+    """Parses a TokenArray, reading the type codes straight out of its
+    array and only making a Token when something asks for one."""
+
+    def open(self, tokens):
+        self.tokens = tokens
+        self.columns = itertools.izip(tokens.types, tokens.values)
+        self.strings = tokens.strings
+        self.index = -1
+
+    @property
+    def token(self):
+        return self.tokens[self.index]
+
+    def next(self):
+        (self.typ, value) = self.columns.next()
+        self.value = self.strings[value]
+        self.index += 1
+        return self.typ
+
+
+def parse(tokens, lines=False, errors=None):
+    """Parse tokens into a list of statements. With lines set, every
+    statement is preceded by a PLine with its line number. The tokens can
+    be any iterable of Tokens, or a TokenArray.
+
+    Given an errors list, every syntax error is added to it rather than
+    the first being raised, so one pass finds them all. Each is a
+    ParserError whose second argument is the token, with its position."""
+    return list(parse_iter(tokens, lines, errors))
+
+
+def parse_iter(tokens, lines=False, errors=None):
+    """Like parse, but generates the statements as it parses them. Given a
+    generator of tokens too, nothing before the current statement needs to
+    stay in memory."""
+    if isinstance(tokens, TokenArray):
+        return CompactParser(tokens, lines, errors).statements()
+    return Parser(tokens, lines, errors).statements()
 
 
 if __name__ == "__main__":
@@ -1,31 +1,144 @@
 #!/usr/bin/env python
 from lexer import tokenize
-from parser import parse
-from translator import translate, disassemble
+from parser import parse, parse_iter, ParserError
+from translator import translate_context, translate_stream, slot_names
+from translator import TranslatorError
+from translator import disassemble
+from parallel import translate_parallel
+import optimizer
+import peephole
 from vm import BasicVM, VmError
+from blockvm import BlockVM
+from tiered import TieredVM
+from vmio import StreamInput
+from verifier import verify, VerifierError
+from linetable import encode, line_for
+import pbc
 
 import argparse
+import os
 
 parser = argparse.ArgumentParser(description='Run the PhoneBasic compiler.')
 parser.add_argument('source', type=file,
                    help='input file')
+parser.add_argument('--input', type=file,
+                   help="read INPUT lines from a file instead of the console")
 parser.add_argument('--debug', help="enable debugging", action="store_true")
+parser.add_argument('-O', '--optimize', help="optimize the program before running it",
+                   action="store_true")
+parser.add_argument('--predecode', help="decode the bytecode before running it",
+                   action="store_true")
+parser.add_argument('--compile', help="run basic blocks compiled to Python",
+                   action="store_true")
+parser.add_argument('--interpret', help="don't compile hot loops to Python",
+                   action="store_true")
+parser.add_argument('--verify', help="verify the bytecode, and skip the checks it proves unnecessary",
+                   action="store_true")
+parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                   help="without -O, compile on N processes at once")
+parser.add_argument('--no-cache', help="don't read or write a compiled .pbc file",
+                   action="store_true")
+
+
+def show_location(program, source, loc):
+    line = line_for(program.lines, loc)
+    if line is not None:
+        print "line %d: %s" % (line, source.splitlines()[line-1].strip())
+    disassemble(program.code[loc-3:loc+3], 0, loc)
+
+
+# every syntax error in the program, found in one pass
+errors = []
 
 try:
     args = parser.parse_args()
     prog = args.source.read()
-    (code, strings) = translate(parse(tokenize(prog)))
+    cache = os.path.splitext(args.source.name)[0] + ".pbc"
+    flags = pbc.OPTIMIZED if args.optimize else 0
+
+    program = None
+    if not args.no_cache:
+        program = pbc.load_cached(cache, prog, flags)
+        if program and args.debug:
+            print "using", cache
+
+    if program is None:
+        def statements():
+            # only keep the last pass's, if translate_stream takes two
+            del errors[:]
+            return parse_iter(tokenize(prog), lines=True, errors=errors)
+
+        try:
+            if args.optimize:
+                ast = parse(tokenize(prog), lines=True, errors=errors)
+                if errors:
+                    raise errors[0]
+                (ast, removed) = optimizer.optimize(ast)
+                if args.debug:
+                    print "optimizer removed", removed, "instructions"
+                ctx = translate_context(ast, inline=True, memoize=True)
+            elif args.jobs > 1:
+                ctx = translate_parallel(prog, args.jobs, errors=errors)
+            else:
+                # nothing needs the whole AST, so translate it as it's parsed
+                ctx = translate_stream(statements)
+        except (TranslatorError, KeyError):
+            # what's left of a program with syntax errors may not translate,
+            # like a GOTO to a label that didn't parse, but the syntax
+            # errors are what need fixing
+            if not errors:
+                raise
+        if errors:
+            raise errors[0]
+        (code, labels) = (ctx.code, ctx.label_table)
+        if args.optimize:
+            code = peephole.optimize(code, labels, ctx.line_table)
+        program = pbc.Program(code, ctx.string_table, labels,
+            pbc.source_hash(prog), flags, encode(ctx.line_table),
+            slot_names(ctx))
+        if not args.no_cache:
+            try:
+                pbc.save(cache, program)
+            except (IOError, OSError, pbc.PbcError):
+                # not being able to cache it is no reason not to run it
+                pass
+
+    (code, strings) = (program.code, program.strings)
 
-    vm = BasicVM()
-    vm.Load(code, strings)
-    if args.debug:
-        vm.SetDebugger(True)
+    if args.compile:
+        vm = BlockVM()
+    elif args.predecode or args.interpret:
+        vm = BasicVM()
+    else:
+        # interpret, and compile loops once they get hot
+        vm = TieredVM()
     try:
+        verified = None
+        if args.verify:
+            verified = verify(code, strings)
+            if args.debug:
+                print "verified: max stack", verified.max_stack, \
+                    "max calls", verified.max_calls
+        vm.Load(code, strings, predecode=args.predecode, verified=verified,
+            lines=program.lines, names=program.names)
+        if args.input:
+            vm.SetInput(StreamInput(args.input))
+        if args.debug:
+            vm.SetDebugger(True)
         vm.Run()
+        if args.debug:
+            print "memo cache:", vm.memo.hits, "hits,", vm.memo.misses, "misses"
+    except VerifierError, e:
+        print "Verification error", e.args
+        show_location(program, prog, e.args[1].loc)
     except VmError, e:
         print "Execution error", e.args
-        loc = e.args[1].loc
-        disassemble(code[loc-3:loc+3], 0, loc)
+        show_location(program, prog, e.args[1].loc)
 
+except ParserError, first:
+    for e in errors or [first]:
+        token = e.args[1]
+        print "Syntax error on line %d, column %d: %s (%r)" % (token.line,
+            token.column + 1, e.args[0], token.value)
 except IOError, e:
     print "couldn't find or open file", e.filename
@@ -0,0 +1,172 @@
+import collections
+import hashlib
+import struct
+
+
+class PbcError(RuntimeError):
+    pass
+
+
+# a compiled program as stored in a .pbc file
+Program = collections.namedtuple('Program',
+    ['code', 'strings', 'labels', 'source_hash', 'flags', 'lines', 'names'])
+
+MAGIC = "PB01"
+VERSION = 5
+
+# flags: how the program was compiled
+OPTIMIZED = 0x01
+
+# constant pool entry types
+CONST_STR = ord("s")
+CONST_INT = ord("i")
+CONST_FLOAT = ord("f")
+
+# Layout, all numbers big-endian:
+#
+#   "PB01"                      magic, same as the bytecode's own
+#   B version, B flags
+#   20s SHA-1 of the source
+#   I length, code              including its own metadata bytes
+#   I count, constants          B type, then
+#                                   s: I length, bytes
+#                                   i: I length, decimal digits
+#                                   f: d
+#   I count, labels             H length, name, i offset
+#   I length, line table        see linetable
+#   I count, variable names     H length, name; in slot order
+
+
+def source_hash(source):
+    return hashlib.sha1(source).digest()
+
+
+def dumps(program):
+    """Serialize a Program"""
+    out = [MAGIC, struct.pack(">BB20s", VERSION, program.flags, program.source_hash)]
+
+    out.append(struct.pack(">I", len(program.code)))
+    out.append(str(program.code))
+
+    out.append(struct.pack(">I", len(program.strings)))
+    for value in program.strings:
+        if type(value) is str:
+            out.append(struct.pack(">BI", CONST_STR, len(value)))
+            out.append(value)
+        elif type(value) in (int, long):
+            # ints can be any size, so they're stored as text
+            digits = str(value)
+            out.append(struct.pack(">BI", CONST_INT, len(digits)))
+            out.append(digits)
+        elif type(value) is float:
+            out.append(struct.pack(">Bd", CONST_FLOAT, value))
+        else:
+            raise PbcError("can't store constant", value)
+
+    out.append(struct.pack(">I", len(program.labels)))
+    for (label, offset) in sorted(program.labels.items()):
+        if len(label) > 0xffff:
+            raise PbcError("label too long to store", label[:32])
+        out.append(struct.pack(">H", len(label)))
+        out.append(label)
+        out.append(struct.pack(">i", offset))
+
+    out.append(struct.pack(">I", len(program.lines)))
+    out.append(program.lines)
+
+    out.append(struct.pack(">I", len(program.names)))
+    for name in program.names:
+        if len(name) > 0xffff:
+            raise PbcError("variable name too long to store", name[:32])
+        out.append(struct.pack(">H", len(name)))
+        out.append(name)
+
+    return "".join(out)
+
+
+def loads(data):
+    """Deserialize a Program, raising PbcError if data isn't a .pbc file
+    this version can read"""
+    if data[:4] != MAGIC:
+        raise PbcError("not a compiled program")
+    try:
+        (version, flags, hashed) = struct.unpack_from(">BB20s", data, 4)
+        if version != VERSION:
+            raise PbcError("unsupported version", version)
+        pos = 26
+
+        (length,) = struct.unpack_from(">I", data, pos)
+        pos += 4
+        code = bytearray(data[pos:pos+length])
+        pos += length
+
+        strings = []
+        (count,) = struct.unpack_from(">I", data, pos)
+        pos += 4
+        for _ in range(count):
+            typ = ord(data[pos])
+            pos += 1
+            if typ == CONST_FLOAT:
+                strings.append(struct.unpack_from(">d", data, pos)[0])
+                pos += 8
+                continue
+            (length,) = struct.unpack_from(">I", data, pos)
+            pos += 4
+            value = data[pos:pos+length]
+            pos += length
+            if typ == CONST_STR:
+                strings.append(value)
+            elif typ == CONST_INT:
+                strings.append(int(value))
+            else:
+                raise PbcError("unknown constant type", typ)
+
+        labels = {}
+        (count,) = struct.unpack_from(">I", data, pos)
+        pos += 4
+        for _ in range(count):
+            (length,) = struct.unpack_from(">H", data, pos)
+            label = data[pos+2:pos+2+length]
+            pos += 2 + length
+            labels[label] = struct.unpack_from(">i", data, pos)[0]
+            pos += 4
+
+        (length,) = struct.unpack_from(">I", data, pos)
+        pos += 4
+        lines = data[pos:pos+length]
+        pos += length
+
+        names = []
+        (count,) = struct.unpack_from(">I", data, pos)
+        pos += 4
+        for _ in range(count):
+            (length,) = struct.unpack_from(">H", data, pos)
+            names.append(data[pos+2:pos+2+length])
+            pos += 2 + length
+    except (struct.error, IndexError, ValueError):
+        raise PbcError("truncated or corrupt compiled program")
+
+    if pos != len(data):
+        raise PbcError("trailing bytes after compiled program")
+    return Program(code, strings, labels, hashed, flags, lines, names)
+
+
+def load_cached(path, source, flags):
+    """The Program in path if it was compiled from source with the same
+    flags, otherwise None"""
+    try:
+        with open(path, 'rb') as f:
+            program = loads(f.read())
+    except (IOError, PbcError):
+        return None
+    if program.source_hash != source_hash(source) or program.flags != flags:
+        return None
+    return program
+
+
+def save(path, program):
+    # serialize first, so a program that can't be stored doesn't leave an
+    # empty file behind
+    data = dumps(program)
+    with open(path, 'wb') as f:
+        f.write(data)
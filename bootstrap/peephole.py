@@ -0,0 +1,134 @@
+import struct
+import sys
+from vm import Opcode, ADDR_OPS, LITERAL_OPS, JUMPS, decode
+
+
+# compare opcode => the fused compare-and-branch that replaces
+# compare; LITERAL2 addr; JUMPIF0
+COMPARE_BRANCHES = {
+    Opcode.EQUAL:   Opcode.JUMPIFNOTEQ,
+    Opcode.LT:      Opcode.JUMPIFNOTLT,
+    Opcode.LTE:     Opcode.JUMPIFNOTLTE,
+}
+
+
+def optimize(code, labels=None, lines=None):
+    """Rewrite common translator output into fused superinstructions.
+
+        LITERAL2 addr; JUMP                 => JUMPABS addr
+        compare; LITERAL2 addr; JUMPIF0     => JUMPIFNOT<compare> addr
+        PUSHSCOPE; LITERAL2 addr; GOSUB     => CALLSUB addr
+
+    Destinations are relocated to the new offsets. Nothing gets fused if a
+    jump could land in the middle of it. Code that can't be relocated
+    safely (a jump into the middle of an instruction) comes back as-is.
+
+    Returns the new code, which has the same metadata bytes as the old. If
+    a label table (label => offset) or a list of (offset, line) pairs is
+    given, it's updated to match."""
+    insns = list(decode(code))
+
+    # every address that code can jump or GOSUB to
+    targets = set()
+    for (n, (offset, op, arg)) in enumerate(insns):
+        if op in ADDR_OPS:
+            targets.add(arg)
+        elif n > 0 and op in JUMPS and \
+                insns[n-1][1] in LITERAL_OPS:
+            targets.add(insns[n-1][2])
+
+    out = bytearray(code[0:4])
+    relocated = {}      # old offset => new offset
+    fixups = []         # (position in out, old destination, format)
+
+    def fusable(n, ops):
+        if n + len(ops) > len(insns):
+            return False
+        for (k, op) in enumerate(ops):
+            if op is not None and insns[n+k][1] != op:
+                return False
+            if k > 0 and insns[n+k][0] in targets:
+                return False
+        return True
+
+    def next_offset(n):
+        return insns[n+1][0] if n + 1 < len(insns) else len(code)
+
+    def emit_addr_op(opcode, dest):
+        out.append(opcode)
+        fixups.append((len(out), dest, ">h"))
+        out.extend([0, 0])
+
+    n = 0
+    while n < len(insns):
+        (offset, op, arg) = insns[n]
+        relocated[offset] = len(out)
+
+        if op == Opcode.LITERAL2 and fusable(n, [Opcode.LITERAL2, Opcode.JUMP]):
+            emit_addr_op(Opcode.JUMPABS, arg)
+            n += 2
+
+        elif op in COMPARE_BRANCHES and \
+                fusable(n, [None, Opcode.LITERAL2, Opcode.JUMPIF0]):
+            emit_addr_op(COMPARE_BRANCHES[op], insns[n+1][2])
+            n += 3
+
+        elif op == Opcode.PUSHSCOPE and \
+                fusable(n, [Opcode.PUSHSCOPE, Opcode.LITERAL2, Opcode.GOSUB]):
+            emit_addr_op(Opcode.CALLSUB, insns[n+1][2])
+            n += 3
+
+        else:
+            if op in ADDR_OPS:
+                emit_addr_op(op, arg)
+            elif op in JUMPS and n > 0 \
+                    and insns[n-1][1] == Opcode.LITERAL1:
+                # no room to relocate a 1-byte address
+                return code
+            elif op in JUMPS and n > 0 \
+                    and insns[n-1][1] in (Opcode.LITERAL2, Opcode.LITERAL4):
+                # an address literal that didn't get fused still needs
+                # relocating; wide programs only have these
+                fmt = ">h" if insns[n-1][1] == Opcode.LITERAL2 else ">i"
+                fixups.append((relocated[insns[n-1][0]] + 1, insns[n-1][2], fmt))
+                out.extend(code[offset:next_offset(n)])
+            else:
+                out.extend(code[offset:next_offset(n)])
+            n += 1
+
+    for (pos, dest, fmt) in fixups:
+        if dest >= len(code):
+            new_dest = len(out)
+        elif dest in relocated:
+            new_dest = relocated[dest]
+        else:
+            return code
+        packed = struct.pack(fmt, new_dest)
+        out[pos:pos+len(packed)] = packed
+
+    if labels is not None:
+        for (label, offset) in labels.items():
+            labels[label] = relocated.get(offset, len(out))
+    if lines is not None:
+        lines[:] = [(relocated.get(offset, len(out)), line)
+            for (offset, line) in lines]
+    return out
+
+
+if __name__ == "__main__":
+    from lexer import tokenize
+    from parser import parse
+    from translator import translate, disassemble
+
+    if len(sys.argv) > 1:
+        print "opening file", sys.argv[1]
+        with open(sys.argv[1], 'r') as f:
+            prog = f.read()
+    else:
+        from samples import sample_prog as prog
+
+    (code, strings) = translate(parse(tokenize(prog)))
+    optimized = optimize(code)
+    print "Before: %d bytes, after: %d bytes" % (len(code), len(optimized))
+    print "\nDisassembly:"
+    disassemble(optimized)
@@ -0,0 +1,94 @@
+import collections
+from vm import Status
+
+
+class Scheduler(object):
+    """Runs many VMs cooperatively on one thread.
+
+    Each ready VM gets a time slice of slice_steps instructions in turn. A
+    VM that wants input is parked until Feed gives it some, so thousands of
+    sessions that spend most of their time waiting on their users cost
+    nothing while they wait.
+
+    The callbacks are all optional:
+    * on_halt(vm) when a program finishes
+    * on_wait(vm) when a program is parked waiting for input
+    * on_error(vm, e) when a program dies with a VmError, or any other
+      exception from its run like a ZeroDivisionError; it's dropped and
+      the others carry on"""
+
+    def __init__(self, slice_steps=1000, on_halt=None, on_wait=None, on_error=None):
+        self.slice_steps = slice_steps
+        self.on_halt = on_halt
+        self.on_wait = on_wait
+        self.on_error = on_error
+        self.ready = collections.deque()
+        self.waiting = set()
+
+    def Add(self, vm):
+        """Schedule a loaded VM. It must not block on input."""
+        vm.SetBlockingInput(False)
+        self.ready.append(vm)
+
+    def Feed(self, vm, data):
+        """Give a VM a line of input, waking it up if it was waiting"""
+        vm.Feed(data)
+        if vm in self.waiting:
+            self.waiting.remove(vm)
+            self.ready.append(vm)
+
+    def RunSlice(self):
+        """Give the VM at the front of the queue one time slice. Returns
+        False if nothing was ready to run."""
+        if not self.ready:
+            return False
+        vm = self.ready.popleft()
+        try:
+            status = vm.Run(self.slice_steps)
+        except Exception, e:
+            if self.on_error:
+                self.on_error(vm, e)
+            return True
+
+        if status == Status.YIELDED:
+            self.ready.append(vm)
+        elif status == Status.WAITING:
+            self.waiting.add(vm)
+            if self.on_wait:
+                self.on_wait(vm)
+        elif self.on_halt:
+            self.on_halt(vm)
+        return True
+
+    def Run(self):
+        """Run until every VM has either halted or is waiting for input"""
+        while self.RunSlice():
+            pass
+
+
+if __name__ == "__main__":
+    from lexer import tokenize
+    from parser import parse
+    from translator import translate
+    from vm import BasicVM
+
+    (code, strings) = translate(parse(tokenize("""INPUT name
+PRINT "Hello", name
+END
+""")))
+
+    def waiting(vm):
+        print "session", sessions.index(vm), "is waiting"
+
+    scheduler = Scheduler(on_wait=waiting)
+    sessions = []
+    for i in range(3):
+        vm = BasicVM()
+        vm.Load(code, strings)
+        scheduler.Add(vm)
+        sessions.append(vm)
+
+    scheduler.Run()
+    for (i, vm) in reversed(list(enumerate(sessions))):
+        scheduler.Feed(vm, "user %d" % i)
+    scheduler.Run()
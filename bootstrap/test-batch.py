@@ -0,0 +1,61 @@
+import unittest
+from lexer import tokenize
+from parser import parse
+from translator import translate
+from batch import compile_source, compile_batch
+
+good = """LET a BE 1
+PRINT "a is", a
+"""
+
+other = """LET b BE 2
+PRINT "b"
+"""
+
+bad = """GOTO
+"""
+
+class TestBatch(unittest.TestCase):
+    """
+    Tests for compiling many programs
+    """
+
+    def test_translate_twice(self):
+        # nothing carries over from one translation to the next
+        first = translate(parse(tokenize(good)))
+        translate(parse(tokenize(other)))
+        self.assertEqual(translate(parse(tokenize(good))), first)
+
+    def test_error(self):
+        result = compile_source(bad)
+        self.assertEqual(result.code, None)
+        self.assertTrue(result.error is not None)
+        self.assertEqual(result.errors, [result.error])
+
+    def test_syntax_errors(self):
+        # all of them, whether or not the rest gets translated
+        for optimize in (False, True):
+            result = compile_source(bad + good + bad + "LET b BE ~\n", optimize)
+            self.assertEqual([type(e).__name__ for e in result.errors],
+                ["ParserError", "ParserError", "LexerError"])
+            self.assertEqual(result.error, result.errors[0])
+            self.assertEqual(compile_source(good, optimize).errors, [])
+
+    def check_batch(self, threads):
+        sources = [good, bad, other] * 4
+        expected = [compile_source(source) for source in sources]
+        results = compile_batch(sources, workers=3, threads=threads)
+        self.assertEqual(len(results), len(sources))
+        for (result, want) in zip(results, expected):
+            self.assertEqual(result.code, want.code)
+            self.assertEqual(result.strings, want.strings)
+            self.assertEqual(type(result.error), type(want.error))
+
+    def test_threads(self):
+        self.check_batch(threads=True)
+
+    def test_processes(self):
+        self.check_batch(threads=False)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+from blockvm import BlockVM
+from vm import BasicVM, Opcode, VmError, Status
+from testutil import program
+
+class TestBlockVM(unittest.TestCase):
+    """
+    The block compiler has to end up in the same state as the interpreter
+    """
+
+    def assertSameRun(self, code, strings=[]):
+        results = []
+        for vm in (BasicVM(), BlockVM()):
+            vm.Load(code, strings)
+            try:
+                vm.Run()
+                error = None
+            except VmError, e:
+                error = e.args
+            results.append((vm.IP, vm.halted, vm.STACK, vm.SLOTS, vm.IP_STACK, error))
+        self.assertEqual(results[0], results[1])
+        return results[1]
+
+    def test_loop(self):
+        # x = 0; loop: x = x + 1; IF x < 3 THEN GOTO loop
+        self.assertSameRun(program(
+            Opcode.LITERAL1, 0,             # 0x04
+            Opcode.STORESLOT, 0, 0,         # 0x06
+            Opcode.LOADSLOT, 0, 0,          # 0x09 loop:
+            Opcode.LITERAL1, 1,             # 0x0c
+            Opcode.ADD,                     # 0x0e
+            Opcode.STORESLOT, 0, 0,         # 0x0f
+            Opcode.LITERAL1, 3,             # 0x12
+            Opcode.LOADSLOT, 0, 0,          # 0x14
+            Opcode.LT,                      # 0x17
+            Opcode.LITERAL2, 0, 0x20,       # 0x18
+            Opcode.JUMPIF0,                 # 0x1b
+            Opcode.LITERAL2, 0, 0x09,       # 0x1c
+            Opcode.JUMP,                    # 0x1f
+            Opcode.HALT,                    # 0x20
+        ))
+
+    def test_gosub(self):
+        # values left on the stack have to survive the block boundary
+        self.assertSameRun(program(
+            Opcode.LITERAL1, 5,             # 0x04
+            Opcode.PUSHSCOPE,               # 0x06
+            Opcode.LITERAL2, 0, 0x0f,       # 0x07
+            Opcode.GOSUB,                   # 0x0a
+            Opcode.STORESLOT, 0, 0,         # 0x0b
+            Opcode.HALT,                    # 0x0e
+            Opcode.STORESLOT, 0, 1,         # 0x0f
+            Opcode.LOADSLOT, 0, 1,          # 0x12
+            Opcode.LOADSLOT, 0, 1,          # 0x15
+            Opcode.MULTIPLY,                # 0x18
+            Opcode.LITERAL1, 9,             # 0x19
+            Opcode.POPSCOPE,                # 0x1b
+            Opcode.RETURN,                  # 0x1c
+        ))
+
+    def test_memocall(self):
+        # COMPUTE a AS Square 3, then COMPUTE b AS Square 3 again
+        code = program(
+            Opcode.LITERAL1, 3,             # 0x04
+            Opcode.LITERAL2, 0, 0x1b,       # 0x06
+            Opcode.MEMOCALL, 1,             # 0x09
+            Opcode.MEMOSTORE,               # 0x0b
+            Opcode.STORESLOT, 0, 0,         # 0x0c
+            Opcode.LITERAL1, 3,             # 0x0f
+            Opcode.LITERAL2, 0, 0x1b,       # 0x11
+            Opcode.MEMOCALL, 1,             # 0x14
+            Opcode.MEMOSTORE,               # 0x16
+            Opcode.STORESLOT, 0, 1,         # 0x17
+            Opcode.HALT,                    # 0x1a
+            Opcode.STORESLOT, 0, 2,         # 0x1b
+            Opcode.LOADSLOT, 0, 2,          # 0x1e
+            Opcode.LOADSLOT, 0, 2,          # 0x21
+            Opcode.MULTIPLY,                # 0x24
+            Opcode.POPSCOPE,                # 0x25
+            Opcode.RETURN,                  # 0x26
+        )
+        self.assertSameRun(code)
+        vm = BlockVM()
+        vm.Load(code, [])
+        vm.Run()
+        self.assertEqual(vm.SLOTS, [9, 9, None])
+        self.assertEqual((vm.memo.hits, vm.memo.misses), (1, 1))
+
+    def test_type_error(self):
+        result = self.assertSameRun(program(
+            Opcode.LITERAL1, 0,
+            Opcode.STORESTRSLOT, 0, 0,
+            Opcode.LITERAL1, 1,
+            Opcode.LOADSLOT, 0, 0,
+            Opcode.SUBTRACT,
+        ), ["a string"])
+        self.assertEqual(result[-1][1].loc, 14)
+
+    def test_constant_pool(self):
+        self.assertSameRun(program(
+            Opcode.CONST2, 0, 1,
+            Opcode.LITERAL1, 1,
+            Opcode.ADD,
+            Opcode.STORESLOT, 0, 0,
+            Opcode.STRING2, 0, 0,
+            Opcode.STORESTRSLOT, 0, 1,
+            Opcode.HALT,
+        ), ["x", 100000])
+
+    def test_undefined(self):
+        result = self.assertSameRun(program(
+            Opcode.LITERAL1, 1,
+            Opcode.LOADSLOT, 0, 1,
+        ))
+        self.assertEqual(result[-1][1].loc, 6)
+
+    def test_bad_opcode(self):
+        result = self.assertSameRun(program(Opcode.NOOP, 199))
+        self.assertEqual(result[-1][1].e, 199)
+
+    def test_run_off_the_end(self):
+        self.assertSameRun(program(Opcode.LITERAL1, 1, Opcode.LITERAL1, 2))
+
+    def test_waiting_for_input(self):
+        vm = BlockVM()
+        vm.Load(program(
+            Opcode.LITERAL1, 7,             # 0x04
+            Opcode.INPUTSLOT, 0, 0,         # 0x06
+            Opcode.LOADSLOT, 0, 0,          # 0x09
+            Opcode.HALT,                    # 0x0c
+        ), [])
+        vm.SetBlockingInput(False)
+        self.assertEqual(vm.Run(), Status.WAITING)
+        self.assertEqual((vm.IP, vm.STACK), (6, [7]))
+        vm.Feed("hello")
+        self.assertEqual(vm.Run(), Status.HALTED)
+        self.assertEqual(vm.STACK, [7, "hello"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+from lexer import tokenize
+from parser import parse
+from translator import translate, translate_context, TranslatorError
+from incremental import IncrementalCompiler, split_regions
+from incremental import label_line, find_label_line
+from vm import BasicVM
+from vmio import MemoryOutput
+
+source = """LET a BE 1
+top:
+PRINT "a is", a
+LET a BE a + 1
+IF a < 3 THEN GOTO top
+GOTO done
+
+unused:
+PRINT "never"
+
+done:
+PRINT "done"
+"""
+
+def run(code, strings):
+    vm = BasicVM()
+    out = MemoryOutput()
+    vm.SetOutput(out)
+    vm.Load(code, strings)
+    vm.Run()
+    return out.getvalue()
+
+class TestIncremental(unittest.TestCase):
+    """
+    Tests for recompiling edited programs
+    """
+
+    def test_split(self):
+        self.assertEqual(split_regions("PRINT 1\nx:\nPRINT 2\n  y :\n"),
+            ["PRINT 1\n", "x:\nPRINT 2\n", "  y :\n"])
+
+    def test_label_lines(self):
+        # finding label lines in the whole text finds the same ones as
+        # going line by line
+        text = "x:\n  y : // hi\nBEx:\nLET a BE 1\nz: PRINT 1\n\tw:\nv:"
+        lines = text.splitlines(True)
+        self.assertEqual([line for line in lines if label_line(line)],
+            ["x:\n", "  y : // hi\n", "\tw:\n", "v:"])
+        found = []
+        match = find_label_line(text)
+        while match is not None:
+            found.append(match.group(0))
+            match = find_label_line(text, match.end() + 1)
+        self.assertEqual(found, [line.rstrip("\n") for line in lines if label_line(line)])
+
+    def test_same_as_translate(self):
+        compiler = IncrementalCompiler()
+        self.assertEqual(compiler.Compile(source), translate(parse(tokenize(source))))
+        ctx = translate_context(parse(tokenize(source), lines=True))
+        self.assertEqual(compiler.label_table, ctx.label_table)
+        self.assertEqual(compiler.line_table, ctx.line_table)
+
+    def test_lines(self):
+        # regions that haven't changed move down when a line goes in above
+        compiler = IncrementalCompiler()
+        compiler.Compile(source)
+        edited = "LET z BE 0\n" + source
+        compiler.Compile(edited)
+        ctx = translate_context(parse(tokenize(edited), lines=True))
+        self.assertEqual(compiler.line_table, ctx.line_table)
+
+    def test_edit(self):
+        compiler = IncrementalCompiler()
+        compiler.Compile(source)
+        before = dict(compiler.regions)
+
+        edited = source.replace('PRINT "a is", a', 'PRINT "a =", a * 10')
+        (code, strings) = compiler.Compile(edited)
+        self.assertEqual(run(code, strings), "a = 10 \na = 20 \ndone \n")
+
+        # only the edited region was compiled again
+        changed = [text for text in compiler.regions if text not in before]
+        self.assertEqual(len(changed), 1)
+        self.assertTrue(changed[0].startswith("top:"))
+        for text in compiler.regions:
+            if text in before:
+                self.assertTrue(compiler.regions[text] is before[text])
+
+    def test_errors(self):
+        compiler = IncrementalCompiler()
+        self.assertRaises(TranslatorError, compiler.Compile, "GOTO nowhere\n")
+        self.assertRaises(TranslatorError, compiler.Compile, "x:\nEND\nx:\nEND\n")
+
+    def test_wide(self):
+        compiler = IncrementalCompiler()
+        big = "GOTO done\n" + "LET a BE 1\n" * 6000 + "done:\nLET b BE 2\n"
+        self.assertEqual(compiler.Compile(big), translate(parse(tokenize(big))))
+        self.assertTrue(compiler.wide)
+
+        # and back again once it's edited down
+        small = big.replace("LET a BE 1\n" * 6000, "LET a BE 1\n" * 10)
+        self.assertEqual(compiler.Compile(small), translate(parse(tokenize(small))))
+        self.assertFalse(compiler.wide)
+
+    def test_wide_edge(self):
+        # either side of where the code stops fitting 2-byte addresses,
+        # going both ways
+        compiler = IncrementalCompiler()
+        for count in (5458, 5459, 5458, 5460, 5457):
+            edge = "GOTO done\n" + "LET a BE 1\n" * count + "done:\nLET b BE 2\n"
+            ctx = translate_context(parse(tokenize(edge)))
+            self.assertEqual(compiler.Compile(edge), (ctx.code, ctx.string_table))
+            self.assertEqual(compiler.wide, ctx.wide)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
 import unittest
 import itertools
-from lexer import tokenize, Token, LexerError
+from lexer import tokenize, tokenize_file, tokenize_compact, Token, LexerError
+from lexer import TokenType
+import StringIO
+import mmap
+import os
+import tempfile
 
 class TestTokenize(unittest.TestCase):
     """
@@ -245,6 +250,56 @@ RETURN Var + 2
             self.assertEqual(token.line, ex.line)
             self.assertEqual(token.column, ex.column)
 
+    chunky = """top:
+LET abc BE 12.5 + -3 // a comment
+IF abc <= 10 THEN PRINT "two  words", abc
+COMPUTE x AS Sub1 abc, 2
+
+GOTO top
+"""
+
+    def test_chunks(self):
+        # every chunk size splits tokens in different places
+        expect = list(tokenize(self.chunky))
+        for size in range(1, len(self.chunky) + 2):
+            tokens = list(tokenize_file(StringIO.StringIO(self.chunky), size))
+            self.assertEqual(tokens, expect, "chunk size %d" % size)
+
+    def test_chunks_badlex(self):
+        source = "LET a BE 1\nLET b BE ~\n"
+        try:
+            list(tokenize(source))
+        except LexerError, e:
+            expect = e.args
+        for size in range(1, len(source) + 2):
+            try:
+                list(tokenize_file(StringIO.StringIO(source), size))
+            except LexerError, e:
+                self.assertEqual(e.args, expect)
+            else:
+                self.fail("no LexerError with chunk size %d" % size)
+
+    def test_mmap(self):
+        (fd, path) = tempfile.mkstemp(".bas")
+        try:
+            os.write(fd, self.chunky)
+            mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            self.assertEqual(list(tokenize(mapped)), list(tokenize(self.chunky)))
+            mapped.close()
+        finally:
+            os.close(fd)
+            os.remove(path)
+
+    def test_compact(self):
+        tokens = tokenize_compact(self.chunky)
+        self.assertEqual(list(tokens), list(tokenize(self.chunky)))
+        self.assertEqual(len(tokens), len(list(tokenize(self.chunky))))
+        self.assertEqual(tokens[0], Token("ID", "top", 1, 0))
+        self.assertEqual(tokens.types[0], TokenType.ID)
+        # each value is only stored once
+        self.assertEqual(len(tokens.strings), len(set(tokens.strings)))
+        self.assertEqual(tokens.strings.count("\n"), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from lexer import tokenize
+from parser import parse
+from translator import translate_context
+from vm import BasicVM, VmError
+from vmio import MemoryOutput
+import linetable
+import peephole
+
+source = """LET a BE 1
+
+IF a < 2 THEN GOTO skip
+PRINT "not skipped"
+skip:
+PRINT b
+"""
+
+class TestLineTable(unittest.TestCase):
+    """
+    Tests for the offset to line tables
+    """
+
+    def test_round_trip(self):
+        pairs = [(4, 1), (10, 2), (400, 3), (401, 1000), (402, 2), (1000, 2000)]
+        table = linetable.encode(pairs)
+        self.assertEqual(linetable.decode(table), pairs)
+        self.assertEqual(linetable.encode([(4, 1), (10, 3)]), "\x04\x01\x06\x02")
+
+    def test_repeated_lines(self):
+        # several entries on one line, like a statement split up by the
+        # peephole pass, and steps right at the edges of the padding
+        pairs = [(0, 0), (4, 1), (10, 1), (265, 1), (265, 128), (520, 128),
+            (521, 1), (521, 1), (1000, 0), (1255, 127)]
+        table = linetable.encode(pairs)
+        self.assertEqual(linetable.decode(table), pairs)
+        self.assertEqual(linetable.line_for(table, 264), 1)
+        self.assertEqual(linetable.line_for(table, 265), 128)
+        self.assertEqual(linetable.line_for(table, 600), 1)
+
+    def test_line_for(self):
+        table = linetable.encode([(4, 1), (10, 2), (400, 300)])
+        self.assertEqual(linetable.line_for(table, 0), None)
+        self.assertEqual(linetable.line_for(table, 4), 1)
+        self.assertEqual(linetable.line_for(table, 9), 1)
+        self.assertEqual(linetable.line_for(table, 10), 2)
+        self.assertEqual(linetable.line_for(table, 399), 2)
+        self.assertEqual(linetable.line_for(table, 5000), 300)
+
+    def check_error_line(self, optimize):
+        ctx = translate_context(parse(tokenize(source), lines=True))
+        code = ctx.code
+        if optimize:
+            code = peephole.optimize(code, lines=ctx.line_table)
+        self.assertEqual([line for (offset, line) in ctx.line_table], [1, 3, 4, 6])
+
+        vm = BasicVM()
+        vm.SetOutput(MemoryOutput())
+        vm.Load(code, ctx.string_table, lines=linetable.encode(ctx.line_table))
+        try:
+            vm.Run()
+        except VmError, e:
+            self.assertEqual(vm.Line(e.args[1].loc), 6)
+        else:
+            self.fail("PRINT b should have failed")
+
+    def test_error_line(self):
+        self.check_error_line(optimize=False)
+
+    def test_error_line_peephole(self):
+        self.check_error_line(optimize=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+from memo import LruCache
+
+class TestLruCache(unittest.TestCase):
+    """
+    Tests for the memo cache
+    """
+
+    def test_hits_and_misses(self):
+        cache = LruCache(4)
+        self.assertEqual(cache.get("a"), None)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_goes(self):
+        cache = LruCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from optimizer import optimize
+from parser import PLabel, PLet, PPrint, PIf, PGoto, PEnd
+from parser import PExpr, PString, PNumber, PVar, PArith
+from parser import PCompute, PReturn, PAccept
+
+class TestOptimizer(unittest.TestCase):
+    """
+    Tests for constant folding and dead code elimination
+    """
+
+    def test_fold(self):
+        # LET x BE 60 * 60 * 2 + y
+        (ast, removed) = optimize([
+            PLet(id='x', rhs=PExpr(expr=[
+                PNumber(value='60'),
+                PNumber(value='60'),
+                PArith(op='*'),
+                PNumber(value='2'),
+                PArith(op='*'),
+                PVar(id='y'),
+                PArith(op='+'),
+            ])),
+        ])
+        self.assertEqual(ast, [
+            PLet(id='x', rhs=PExpr(expr=[
+                PNumber(value='7200'),
+                PVar(id='y'),
+                PArith(op='+'),
+            ])),
+        ])
+        self.assertEqual(removed, 4)
+
+    def test_fold_big(self):
+        # results too big for a LITERAL2, or even a LITERAL4
+        (ast, removed) = optimize([
+            PLet(id='x', rhs=PExpr(expr=[
+                PNumber(value='100000'), PNumber(value='3'), PArith(op='*')])),
+            PLet(id='x', rhs=PExpr(expr=[
+                PNumber(value='3000000000'), PNumber(value='-2'), PArith(op='*')])),
+        ])
+        self.assertEqual(ast, [
+            PLet(id='x', rhs=PExpr(expr=[PNumber(value='300000')])),
+            PLet(id='x', rhs=PExpr(expr=[PNumber(value='-6000000000')])),
+        ])
+        self.assertEqual(removed, 4)
+
+    def test_no_fold(self):
+        # a float and a division by zero
+        stmts = [
+            PLet(id='x', rhs=PExpr(expr=[
+                PNumber(value='1.5'), PNumber(value='2'), PArith(op='*')])),
+            PLet(id='x', rhs=PExpr(expr=[
+                PNumber(value='1'), PNumber(value='0'), PArith(op='/')])),
+        ]
+        self.assertEqual(optimize(stmts), (stmts, 0))
+
+    def test_static_if(self):
+        (ast, removed) = optimize([
+            PIf(expr1=PExpr(expr=[PNumber(value='1')]), compop='<',
+                expr2=PExpr(expr=[PNumber(value='2')]),
+                stmt=PPrint(rhs=[PString(value='yes'), PString(value='\n')])),
+            PIf(expr1=PExpr(expr=[PNumber(value='1')]), compop='=',
+                expr2=PExpr(expr=[PNumber(value='2')]),
+                stmt=PPrint(rhs=[PString(value='no'), PString(value='\n')])),
+        ])
+        self.assertEqual(ast, [
+            PPrint(rhs=[PString(value='yes'), PString(value='\n')]),
+        ])
+        self.assertEqual(removed, 5 + 9)
+
+    def test_dead_code(self):
+        (ast, removed) = optimize([
+            PGoto(id='there'),
+            PPrint(rhs=[PString(value='skipped'), PString(value='\n')]),
+            PLabel(id='unused'),
+            PGoto(id='nowhere'),
+            PLabel(id='nowhere'),
+            PLabel(id='there'),
+            PCompute(label='Sub', id='x', args=[PExpr(expr=[PNumber(value='1')])]),
+            PEnd(),
+            PLet(id='dead', rhs=PExpr(expr=[PNumber(value='1')])),
+            PLabel(id='Sub'),
+            PAccept(rhs=[PVar(id='a')]),
+            PReturn(expr=PExpr(expr=[PVar(id='a')])),
+        ])
+        self.assertEqual(ast, [
+            PGoto(id='there'),
+            PLabel(id='there'),
+            PCompute(label='Sub', id='x', args=[PExpr(expr=[PNumber(value='1')])]),
+            PEnd(),
+            PLabel(id='Sub'),
+            PAccept(rhs=[PVar(id='a')]),
+            PReturn(expr=PExpr(expr=[PVar(id='a')])),
+        ])
+        self.assertEqual(removed, 4 + 2 + 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from lexer import tokenize
+from parser import parse_iter
+from translator import translate_stream, TranslatorError
+import parallel
+from parallel import translate_parallel, split_chunks
+
+source = """LET a BE 1
+LET big BE 3000000000
+top:
+PRINT "a is", a
+LET a BE a + 1
+IF a < 3 THEN GOTO top
+GOTO done
+
+unused:
+LET u BE big
+PRINT "never", u
+
+done:
+PRINT "done", big, 1.5
+LET v BE a
+IF v = 3 THEN PRINT "a is", v
+"""
+
+def serial(source):
+    return translate_stream(lambda: parse_iter(tokenize(source), lines=True))
+
+
+class TestParallel(unittest.TestCase):
+    """
+    Tests for compiling pieces of a program in parallel
+    """
+
+    def setUp(self):
+        # fail rather than quietly falling back to a serial translation
+        self.fallback = parallel.translate_serial
+        def no_fallback(source, errors=None):
+            raise AssertionError("translated serially")
+        parallel.translate_serial = no_fallback
+        self.merge = parallel.merge
+
+    def tearDown(self):
+        parallel.translate_serial = self.fallback
+        parallel.merge = self.merge
+
+    def assertSameAsSerial(self, source, min_chunk=1):
+        expect = serial(source)
+        ctx = translate_parallel(source, 2, min_chunk)
+        self.assertEqual(ctx.code, expect.code)
+        self.assertEqual(ctx.string_table, expect.string_table)
+        self.assertEqual(ctx.label_table, expect.label_table)
+        self.assertEqual(ctx.line_table, expect.line_table)
+        self.assertEqual(ctx.slot_table, expect.slot_table)
+        self.assertEqual(ctx.wide, expect.wide)
+
+    def test_split(self):
+        self.assertEqual(split_chunks(source, 100, 1),
+            [source[:source.index("top:")],
+             source[source.index("top:"):source.index("unused:")],
+             source[source.index("unused:"):source.index("done:")],
+             source[source.index("done:"):]])
+        self.assertEqual(split_chunks(source, 2, 1000), [source])
+        # keywords aren't labels
+        self.assertEqual(split_chunks("PRINT 1\nEND:\nx:\n", 100, 1),
+            ["PRINT 1\nEND:\n", "x:\n"])
+
+    def test_same_as_serial(self):
+        self.assertSameAsSerial(source)
+        self.assertSameAsSerial(source, min_chunk=1000)
+
+    def test_wide(self):
+        big = "GOTO done\n" + "LET a BE 1\n" * 6000 + "done:\nLET b BE 2\n"
+        self.assertSameAsSerial(big)
+        # more source than a LITERAL2 reaches, but not more code
+        self.assertSameAsSerial("// " + "x" * 40000 + "\nGOTO done\ndone:\n")
+
+    def test_errors(self):
+        # the same errors as a serial translation
+        parallel.translate_serial = self.fallback
+        self.assertRaises(KeyError, translate_parallel,
+            "GOTO nowhere\nx:\nEND\n", 2, 1)
+        self.assertRaises(TranslatorError, translate_parallel,
+            "x:\nEND\ny:\nEND\nx:\nEND\n", 2, 1)
+
+        # every syntax error, from one serial parse
+        errors = []
+        translate_parallel("PRINT THEN\nx:\nLET a BE\nPRINT 1\n", 2, 1, errors)
+        self.assertEqual([e.args[1].line for e in errors], [1, 3])
+
+    def test_fall_back(self):
+        # the string looks like it has a label line in it, which starts
+        # the next piece, so only a serial translation works
+        parallel.translate_serial = self.fallback
+        source = 'PRINT "one\nx:\ntwo"\nEND\n'
+        self.assertEqual(translate_parallel(source, 2, 1).code,
+            serial(source).code)
+
+    def test_bug_raised(self):
+        # only the errors a piece can have on its own mean going serial
+        def broken(chunks, firsts, wide):
+            raise AttributeError("bug in the linker")
+        parallel.merge = broken
+        self.assertRaises(AttributeError, translate_parallel, source, 2, 1)
+
+if __name__ == '__main__':
+    unittest.main()
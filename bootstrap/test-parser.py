@@ -1,9 +1,9 @@
 import unittest
 import itertools
-from parser import parse, ParserError
+from parser import parse, parse_iter, ParserError
 from parser import PClear, PLabel, PLet, PPrint, PIf, PGoto, PInput, PEnd
-from parser import PExpr, PString, PNumber, PVar, PArith
-from lexer import Token
+from parser import PExpr, PString, PNumber, PVar, PArith, PCompute
+from lexer import Token, TokenArray, tokenize
 
 class TestParser(unittest.TestCase):
     """
@@ -174,6 +174,89 @@ class TestParser(unittest.TestCase):
             ])
         self.assertRaises(ParserError, inner)
 
+    def test_compact(self):
+        """a TokenArray parses the same as the tokens it holds"""
+        source = """top:
+LET a BE 2 * (b + 1) / 3
+IF a < 2 THEN PRINT "small", a
+INPUT a, b
+COMPUTE c AS Sub a, b
+
+GOTO top
+"""
+        tokens = list(tokenize(source))
+        self.assertEqual(parse(TokenArray(tokens), lines=True),
+            parse(tokens, lines=True))
+
+        try:
+            parse(TokenArray(tokenize("LET a BE 2 + (( 1 - 5 )\n")))
+        except ParserError, e:
+            self.assertEqual(e.args[1], Token("LPAREN", "(", 1, 13))
+        else:
+            self.fail("mismatched parentheses should have failed")
+
+    def test_parse_iter(self):
+        """statements come out as soon as their tokens have been read"""
+        read = []
+        def tokens():
+            for token in tokenize("LET a BE 1\nPRINT a\n"):
+                read.append(token)
+                yield token
+        statements = parse_iter(tokens())
+        self.assertEqual(statements.next(),
+            PLet(id='a', rhs=PExpr(expr=[PNumber(value='1')])))
+        self.assertEqual(read[-1].typ, "NEWLINE")
+        self.assertEqual(len(read), 5)
+        self.assertEqual(list(statements),
+            [PPrint(rhs=[PExpr(expr=[PVar(id='a')]), PString(value='\n')])])
+
+    def test_unexpected_end(self):
+        """a statement cut short is an error, not the end of the program"""
+        self.assertRaises(ParserError, parse, tokenize("PRINT a"))
+        self.assertRaises(ParserError, parse, TokenArray(tokenize("LET a BE")))
+
+    def test_compute_args(self):
+        """an argument list stops at the end of its line"""
+        self.assertEqual(parse(tokenize("COMPUTE c AS F a, 2\nPRINT c\n")), [
+            PCompute(label='F', id='c',
+                args=[PExpr(expr=[PVar(id='a')]), PExpr(expr=[PNumber(value='2')])]),
+            PPrint(rhs=[PExpr(expr=[PVar(id='c')]), PString(value='\n')])])
+        self.assertRaises(ParserError, parse, tokenize("COMPUTE c AS F a THEN\n"))
+
+    def test_recovery(self):
+        """every syntax error is found in one pass"""
+        source = """LET a BE 1
+PRINT THEN
+GOTO 5
+top
+LET b BE (1
+PRINT a
+IF a < 1 THEN
+LET c BE"""
+        for tokens in (tokenize(source), TokenArray(tokenize(source))):
+            errors = []
+            ast = parse(tokens, errors=errors)
+            self.assertEqual(ast, [
+                PLet(id='a', rhs=PExpr(expr=[PNumber(value='1')])),
+                PPrint(rhs=[PExpr(expr=[PVar(id='a')]), PString(value='\n')])])
+            self.assertEqual([(e.args[0], e.args[1].line, e.args[1].column)
+                    for e in errors], [
+                ("expected an expression", 2, 6),
+                ("error parsing GOTO statement", 3, 5),
+                ("error parsing line label", 4, 0),
+                ("mismatched parentheses, expected ')'", 5, 9),
+                ("unexpected token", 7, 13),
+                ("unexpected end of input", 8, 6),
+            ])
+
+        # without a list, the first one is raised
+        try:
+            parse(tokenize(source))
+        except ParserError, e:
+            self.assertEqual(e.args, errors[0].args)
+        else:
+            self.fail("PRINT THEN should have failed")
+
 
 if __name__ == '__main__':
     unittest.main()
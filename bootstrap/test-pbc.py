@@ -0,0 +1,62 @@
+import unittest
+import os
+import tempfile
+import pbc
+
+class TestPbc(unittest.TestCase):
+    """
+    Tests for the compiled program container
+    """
+
+    source = "PRINT 1\n"
+    program = pbc.Program(
+        code=bytearray("PB01\x15\x00\x01\x02\xff"),
+        strings=["\n", "hello", 123456789012345678901234567890, 1.5],
+        labels={"start": 4, "end": 9},
+        source_hash=pbc.source_hash(source),
+        flags=pbc.OPTIMIZED,
+        lines="\x04\x01\x05\x02",
+        names=["a", "total"],
+    )
+
+    def test_round_trip(self):
+        data = pbc.dumps(self.program)
+        self.assertEqual(data[:4], "PB01")
+        self.assertEqual(pbc.loads(data), self.program)
+
+    def test_corrupt(self):
+        data = pbc.dumps(self.program)
+        self.assertRaises(pbc.PbcError, pbc.loads, "PB02" + data[4:])
+        self.assertRaises(pbc.PbcError, pbc.loads, data[:-1])
+        self.assertRaises(pbc.PbcError, pbc.loads, data + "x")
+        # a version 1 file, from before there were line tables
+        self.assertRaises(pbc.PbcError, pbc.loads, "PB01\x01" + data[5:])
+        # a version 2 file, with 1-byte label lengths
+        self.assertRaises(pbc.PbcError, pbc.loads, "PB01\x02" + data[5:])
+        # a version 3 file, with the old line table padding
+        self.assertRaises(pbc.PbcError, pbc.loads, "PB01\x03" + data[5:])
+        # a version 4 file, without variable names
+        self.assertRaises(pbc.PbcError, pbc.loads, "PB01\x04" + data[5:])
+
+    def test_long_label(self):
+        program = self.program._replace(labels={"x" * 300: 4, "end": 9})
+        self.assertEqual(pbc.loads(pbc.dumps(program)), program)
+        program = self.program._replace(labels={"x" * 0x10000: 4})
+        self.assertRaises(pbc.PbcError, pbc.dumps, program)
+
+    def test_cache(self):
+        (fd, path) = tempfile.mkstemp(".pbc")
+        os.close(fd)
+        try:
+            pbc.save(path, self.program)
+            self.assertEqual(pbc.load_cached(path, self.source, pbc.OPTIMIZED),
+                self.program)
+            self.assertEqual(pbc.load_cached(path, "PRINT 2\n", pbc.OPTIMIZED),
+                None)
+            self.assertEqual(pbc.load_cached(path, self.source, 0), None)
+        finally:
+            os.remove(path)
+        self.assertEqual(pbc.load_cached(path, self.source, 0), None)
+
+if __name__ == '__main__':
+    unittest.main()
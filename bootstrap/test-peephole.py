@@ -0,0 +1,82 @@
+import unittest
+from peephole import optimize
+from vm import BasicVM, Opcode, decode
+from testutil import program
+
+class TestPeephole(unittest.TestCase):
+    """
+    Tests for the superinstruction pass
+    """
+
+    # x = 0; loop: x = x + 1; IF x < 3 THEN GOTO loop
+    loop = program(
+        Opcode.LITERAL1, 0,                 # 0x04
+        Opcode.STORESLOT, 0, 0,             # 0x06
+        Opcode.LOADSLOT, 0, 0,              # 0x09 loop:
+        Opcode.LITERAL1, 1,                 # 0x0c
+        Opcode.ADD,                         # 0x0e
+        Opcode.STORESLOT, 0, 0,             # 0x0f
+        Opcode.LITERAL1, 3,                 # 0x12
+        Opcode.LOADSLOT, 0, 0,              # 0x14
+        Opcode.LT,                          # 0x17
+        Opcode.LITERAL2, 0, 0x20,           # 0x18
+        Opcode.JUMPIF0,                     # 0x1b
+        Opcode.LITERAL2, 0, 0x09,           # 0x1c
+        Opcode.JUMP,                        # 0x1f
+        Opcode.HALT,                        # 0x20
+    )
+
+    def test_fuse(self):
+        ops = [(offset, op, arg) for (offset, op, arg) in decode(optimize(self.loop))]
+        self.assertEqual(ops[-3:], [
+            (0x17, Opcode.JUMPIFNOTLT, 0x1d),
+            (0x1a, Opcode.JUMPABS, 0x09),
+            (0x1d, Opcode.HALT, None),
+        ])
+
+    def test_labels(self):
+        labels = {"loop": 0x09, "end": 0x20}
+        optimize(self.loop, labels)
+        self.assertEqual(labels, {"loop": 0x09, "end": 0x1d})
+
+    def test_wide_addresses(self):
+        # wide addresses aren't fused, but still get relocated
+        code = program(
+            Opcode.LITERAL2, 0, 0x0c,       # 0x04
+            Opcode.JUMP,                    # 0x07
+            Opcode.HALT,                    # 0x08
+            Opcode.NOOP,                    # 0x09
+            Opcode.NOOP,                    # 0x0a
+            Opcode.NOOP,                    # 0x0b
+            Opcode.LITERAL4, 0, 0, 0, 0x08, # 0x0c
+            Opcode.JUMP,                    # 0x11
+        )
+        ops = list(decode(optimize(code)))
+        self.assertEqual(ops[0], (0x04, Opcode.JUMPABS, 0x0b))
+        self.assertEqual(ops[-2], (0x0b, Opcode.LITERAL4, 0x07))
+
+    def test_same_result(self):
+        for predecode in (False, True):
+            vm = BasicVM()
+            vm.Load(optimize(self.loop), [], predecode=predecode)
+            vm.Run()
+            self.assertEqual(vm.SLOTS, [3])
+
+    def test_no_fuse_into_target(self):
+        # the LITERAL2 is a jump target, so the GOSUB can't be fused with
+        # the PUSHSCOPE before it
+        code = program(
+            Opcode.PUSHSCOPE,               # 0x04
+            Opcode.LITERAL2, 0, 0x0a,       # 0x05
+            Opcode.GOSUB,                   # 0x08
+            Opcode.HALT,                    # 0x09
+            Opcode.LITERAL2, 0, 0x05,       # 0x0a
+            Opcode.JUMP,                    # 0x0d
+        )
+        ops = [op for (offset, op, arg) in decode(optimize(code))]
+        self.assertEqual(ops, [Opcode.PUSHSCOPE, Opcode.LITERAL2, Opcode.GOSUB,
+            Opcode.HALT, Opcode.JUMPABS])
+
+
+if __name__ == '__main__':
+    unittest.main()
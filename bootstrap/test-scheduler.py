@@ -0,0 +1,84 @@
+import unittest
+from scheduler import Scheduler
+from vm import BasicVM, Opcode
+from testutil import program
+
+class TestScheduler(unittest.TestCase):
+    """
+    Tests for running VMs cooperatively
+    """
+
+    # INPUT a
+    greet = program(
+        Opcode.INPUTSLOT, 0, 0,
+        Opcode.HALT,
+    )
+
+    # INPUT a; LET b BE a
+    store = program(
+        Opcode.INPUTSLOT, 0, 0,
+        Opcode.LOADSLOT, 0, 0,
+        Opcode.STORESLOT, 0, 1,
+        Opcode.HALT,
+    )
+
+    def test_interleave(self):
+        halted = []
+        waiting = []
+        scheduler = Scheduler(slice_steps=1,
+            on_halt=halted.append, on_wait=waiting.append)
+        vms = []
+        for i in range(3):
+            vm = BasicVM()
+            vm.Load(self.greet, [])
+            scheduler.Add(vm)
+            vms.append(vm)
+
+        scheduler.Run()
+        self.assertEqual(waiting, vms)
+        self.assertEqual(halted, [])
+
+        scheduler.Feed(vms[1], "1")
+        scheduler.Run()
+        self.assertEqual(halted, [vms[1]])
+
+    def test_error(self):
+        errors = []
+        scheduler = Scheduler(on_error=lambda vm, e: errors.append(vm))
+        vm = BasicVM()
+        vm.Load(self.store, [])
+        scheduler.Add(vm)
+        scheduler.Run()
+        # "1" is a string, so it can't be stored as a number
+        scheduler.Feed(vm, "1")
+        scheduler.Run()
+        self.assertEqual(errors, [vm])
+
+    def test_error_isolated(self):
+        # LET a BE 1 / 0
+        divide = program(
+            Opcode.LITERAL2, 0, 1,
+            Opcode.LITERAL2, 0, 0,
+            Opcode.DIVIDE,
+            Opcode.STORESLOT, 0, 0,
+            Opcode.HALT,
+        )
+        errors = []
+        halted = []
+        scheduler = Scheduler(slice_steps=1, on_halt=halted.append,
+            on_error=lambda vm, e: errors.append((vm, type(e))))
+        (bad, good) = (BasicVM(), BasicVM())
+        bad.Load(divide, [])
+        good.Load(self.store, [])
+        scheduler.Add(bad)
+        scheduler.Add(good)
+        scheduler.Run()
+        self.assertEqual(errors, [(bad, ZeroDivisionError)])
+        scheduler.Feed(good, 1)
+        scheduler.Run()
+        self.assertEqual(halted, [good])
+        self.assertEqual(good.SLOTS[1], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import StringIO
+import sys
+from lexer import tokenize
+from parser import parse
+from translator import translate
+from tiered import TieredVM
+from vm import BasicVM, VmError, Status
+from vmio import MemoryOutput
+import peephole
+
+loop = """LET i BE 0
+LET s BE 0
+CALL Hello
+loop:
+COMPUTE i AS Inc i
+
+LET s BE s + i
+IF i < 200 THEN GOTO loop
+PRINT s
+END
+Hello:
+PRINT "hello"
+RETURN
+Inc:
+ACCEPT n
+RETURN n + 1
+"""
+
+class TestTieredVM(unittest.TestCase):
+    """
+    The tiered VM has to end up in the same state as the interpreter,
+    whichever tier it's in
+    """
+
+    def run_vm(self, vm, source, optimize=False, max_steps=None):
+        (code, strings) = translate(parse(tokenize(source)))
+        if optimize:
+            code = peephole.optimize(code)
+        out = MemoryOutput()
+        vm.SetOutput(out)
+        vm.Load(code, strings)
+        try:
+            while vm.Run(max_steps) == Status.YIELDED:
+                pass
+            error = None
+        except VmError, e:
+            error = e.args
+        return (out.getvalue(), vm.IP, vm.STACK, vm.SLOTS, vm.IP_STACK, error)
+
+    def assertSameRun(self, source, optimize=False, max_steps=None):
+        vm = TieredVM()
+        result = self.run_vm(vm, source, optimize, max_steps)
+        self.assertEqual(result, self.run_vm(BasicVM(), source, optimize))
+        return vm
+
+    def test_hot_loop(self):
+        for optimize in (False, True):
+            vm = self.assertSameRun(loop, optimize)
+            # the loop and Inc got compiled, the code before it didn't
+            self.assertTrue(vm.blocks)
+            self.assertFalse(vm.blocks.get(4))
+            self.assertTrue(vm.hot[min(vm.blocks)])
+
+    def test_cold(self):
+        vm = self.assertSameRun(loop.replace("200", "20"))
+        self.assertEqual(vm.blocks, {})
+
+    def test_time_slices(self):
+        self.assertSameRun(loop, max_steps=7)
+
+    def test_error_in_hot_code(self):
+        vm = self.assertSameRun(loop.replace("PRINT s", "PRINT s\nEND")
+            .replace("LET s BE s + i", "LET s BE s + i\nIF i = 150 THEN PRINT t"))
+        self.assertTrue(vm.blocks)
+
+    def test_fall_back(self):
+        # blocks that can't be compiled are left to the interpreter
+        vm = TieredVM()
+        def too_deep(start):
+            return "def block(vm, STACK, IPS, STRINGS):\n    return %s1%s\n" % (
+                "(" * 1000, ")" * 1000)
+        vm.BlockSource = too_deep
+        result = self.run_vm(vm, loop)
+        self.assertEqual(result, self.run_vm(BasicVM(), loop))
+        self.assertEqual(vm.blocks, {})
+
+    def test_compiler_bug(self):
+        # but a bug in the block compiler isn't hidden
+        vm = TieredVM()
+        def broken(start):
+            raise KeyError(start)
+        vm.BlockSource = broken
+        self.assertRaises(KeyError, self.run_vm, vm, loop)
+
+    def test_debugger(self):
+        # stepping through a loop well past the threshold stays interpreted
+        vm = TieredVM()
+        vm.SetDebugger(True)
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            result = self.run_vm(vm, loop)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(result, self.run_vm(BasicVM(), loop))
+        self.assertEqual(vm.blocks, {})
+        self.assertEqual(vm.dispatch, vm.BuildDispatch(vm.HANDLERS))
+
+if __name__ == '__main__':
+    unittest.main()
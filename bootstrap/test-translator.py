@@ -0,0 +1,170 @@
+import unittest
+from lexer import tokenize
+from parser import parse, parse_iter
+from translator import translate, translate_context, translate_stream
+from translator import TranslatorError, slot_names
+from vm import BasicVM, VmError, Opcode, decode
+from blockvm import BlockVM
+from vmio import MemoryOutput
+
+def compile_source(source, inline=False, memoize=False):
+    return translate_context(parse(tokenize(source)), inline, memoize)
+
+def run(ctx):
+    vm = BasicVM()
+    out = MemoryOutput()
+    vm.SetOutput(out)
+    vm.Load(ctx.code, ctx.string_table)
+    vm.Run()
+    return out.getvalue()
+
+subs = """LET a BE 1
+COMPUTE b AS Plus2 a
+
+CALL Hello
+PRINT a, b
+END
+Plus2:
+ ACCEPT n
+ LET m BE n * 2
+RETURN m + 2
+Hello:
+ LET a BE 5
+ PRINT "hello", a
+RETURN
+"""
+
+class TestTranslator(unittest.TestCase):
+    """
+    Tests for the bytecode the translator generates
+    """
+
+    def test_literal_sizes(self):
+        ctx = compile_source("LET a BE 1 + 40000 + 3000000000\n")
+        ops = [(op, arg) for (offset, op, arg) in decode(ctx.code)]
+        self.assertEqual(ops[:5], [
+            (Opcode.LITERAL2, 1),
+            (Opcode.LITERAL4, 40000),
+            (Opcode.ADD, None),
+            (Opcode.CONST2, 0),
+            (Opcode.ADD, None),
+        ])
+        self.assertEqual(ctx.string_table, [3000000000])
+
+    def test_wide(self):
+        # enough code that the label at the end is out of LITERAL2 range
+        source = "GOTO done\n" + "LET a BE 1\n" * 6000 + "done:\nLET b BE 2\n"
+        ctx = compile_source(source)
+        self.assertTrue(ctx.wide)
+        self.assertTrue(ctx.label_table["done"] > 0x7fff)
+        ops = list(decode(ctx.code))
+        self.assertEqual(ops[0][1:], (Opcode.LITERAL4, ctx.label_table["done"]))
+
+        vm = BasicVM()
+        vm.Load(ctx.code, ctx.string_table)
+        vm.Run()
+        self.assertTrue(vm.halted)
+        self.assertEqual(vm.SLOTS, [None, 2])
+
+    def test_narrow(self):
+        ctx = compile_source("GOTO done\ndone:\n")
+        self.assertFalse(ctx.wide)
+        self.assertEqual(list(decode(ctx.code))[0][1:], (Opcode.LITERAL2, 8))
+
+    def test_inline(self):
+        ctx = compile_source(subs, inline=True)
+        main = [op for (offset, op, arg) in decode(ctx.code)
+            if offset < ctx.label_table["Plus2"]]
+        self.assertFalse(Opcode.GOSUB in main)
+        # the subroutines only use their own variables, so no scopes either
+        self.assertFalse(Opcode.PUSHSCOPE in main)
+        self.assertEqual(run(ctx), run(compile_source(subs)))
+        self.assertEqual(run(ctx), "hello 5 \n1 4 \n")
+
+    def test_inline_scoped(self):
+        # Peek reads a variable it doesn't set, which is undefined in its
+        # own scope, so the inlined copy still needs one
+        source = "LET a BE 1\nCOMPUTE b AS Peek a\n\nEND\n" \
+            "Peek:\nACCEPT n\nRETURN a + n\n"
+        ctx = compile_source(source, inline=True)
+        main = [op for (offset, op, arg) in decode(ctx.code)
+            if offset < ctx.label_table["Peek"]]
+        self.assertFalse(Opcode.GOSUB in main)
+        self.assertTrue(Opcode.PUSHSCOPE in main)
+        self.assertRaises(VmError, run, ctx)
+
+    def test_inline_not_inlined(self):
+        # jumps and calls keep a subroutine out of line
+        source = "COMPUTE b AS Fact 3\n\nEND\n" \
+            "Fact:\nACCEPT n\nIF n < 2 THEN RETURN 1\n" \
+            "COMPUTE m AS Fact n - 1\n\nRETURN n * m\n"
+        ctx = compile_source(source, inline=True)
+        self.assertTrue(Opcode.GOSUB in [op for (offset, op, arg) in decode(ctx.code)])
+
+    def test_memoize(self):
+        source = "COMPUTE r AS Fib 15\n\nPRINT r\nEND\n" \
+            "Fib:\nACCEPT n\nIF n < 2 THEN RETURN n\n" \
+            "COMPUTE a AS Fib n - 1\n\nCOMPUTE b AS Fib n - 2\n\nRETURN a + b\n" \
+            "Noisy:\nACCEPT n\nPRINT n\nRETURN n\n" \
+            "CallsNoisy:\nACCEPT n\nCOMPUTE m AS Noisy n\n\nRETURN m\n"
+        ctx = compile_source(source, memoize=True)
+        self.assertEqual(ctx.pure, set(["Fib"]))
+        self.assertEqual(run(ctx), "610 \n")
+
+        vm = BasicVM()
+        vm.SetOutput(MemoryOutput())
+        vm.Load(ctx.code, ctx.string_table)
+        vm.Run()
+        # each Fib n is only worked out once
+        self.assertEqual(vm.memo.misses, 16)
+
+    def test_inline_argument_count(self):
+        source = "COMPUTE b AS Plus2 1, 2\nEND\nPlus2:\nACCEPT n\nRETURN n + 2\n"
+        self.assertRaises(TranslatorError, compile_source, source, True)
+
+    def check_stream(self, source):
+        passes = []
+        def statements():
+            passes.append(1)
+            return parse_iter(tokenize(source), lines=True)
+        ctx = translate_stream(statements)
+        expect = translate_context(parse(tokenize(source), lines=True))
+        self.assertEqual(ctx.code, expect.code)
+        self.assertEqual(ctx.string_table, expect.string_table)
+        self.assertEqual(ctx.label_table, expect.label_table)
+        self.assertEqual(ctx.line_table, expect.line_table)
+        return (ctx, len(passes))
+
+    def test_stream(self):
+        (ctx, passes) = self.check_stream(subs)
+        self.assertEqual(passes, 1)
+        self.assertEqual(run(ctx), "hello 5 \n1 4 \n")
+
+    def test_stream_wide(self):
+        source = "GOTO done\n" + "LET a BE 1\n" * 6000 + "done:\nLET b BE 2\n"
+        (ctx, passes) = self.check_stream(source)
+        self.assertTrue(ctx.wide)
+        self.assertEqual(passes, 2)
+
+    def test_stream_argument_count(self):
+        source = "COMPUTE b AS Plus2 1, 2\n\nEND\nPlus2:\nACCEPT n\nRETURN n + 2\n"
+        self.assertRaises(TranslatorError, translate_stream,
+            lambda: parse_iter(tokenize(source)))
+
+    def test_undefined_name(self):
+        ctx = compile_source("LET a BE 1\nPRINT a + b\n")
+        self.assertEqual(slot_names(ctx), ["a", "b"])
+        for (cls, predecode) in [(BasicVM, False), (BasicVM, True), (BlockVM, False)]:
+            vm = cls()
+            vm.SetOutput(MemoryOutput())
+            vm.Load(ctx.code, ctx.string_table, predecode=predecode,
+                names=slot_names(ctx))
+            try:
+                vm.Run()
+            except VmError, e:
+                self.assertEqual(e.args[1].e, "b")
+            else:
+                self.fail("PRINT a + b should have failed")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import unittest
+from verifier import verify, VerifierError
+from vm import BasicVM, Opcode, VmError
+from vmio import ListInput
+from testutil import program
+
+class TestVerifier(unittest.TestCase):
+    """
+    Tests for the load-time bytecode verifier
+    """
+
+    def assertRejected(self, code, strings=[], loc=None):
+        try:
+            verify(code, strings)
+        except VerifierError, e:
+            if loc is not None:
+                self.assertEqual(e.args[1].loc, loc)
+            return e.args[0]
+        self.fail("verified a bad program")
+
+    def test_compute(self):
+        code = program(
+            Opcode.LITERAL2, 0, 5,          # 0x04
+            Opcode.CALLSUB, 0, 0x0e,        # 0x07
+            Opcode.STORESLOT, 0, 0,         # 0x0a
+            Opcode.HALT,                    # 0x0d
+            Opcode.STORESLOT, 0, 1,         # 0x0e
+            Opcode.LOADSLOT, 0, 1,          # 0x11
+            Opcode.LITERAL1, 2,             # 0x14
+            Opcode.MULTIPLY,                # 0x16
+            Opcode.POPSCOPE,                # 0x17
+            Opcode.RETURN,                  # 0x18
+        )
+        result = verify(code, [])
+        self.assertEqual(result.max_stack, 2)
+        self.assertEqual(result.max_calls, 1)
+        # the argument could be anything, since callers aren't tracked
+        self.assertEqual(result.numeric, set([0x0a, 0x16]))
+
+        vm = BasicVM()
+        vm.Load(code, [], predecode=True, verified=result)
+        vm.Run()
+        self.assertEqual(vm.SLOTS, [10, None])
+
+    def test_input_not_numeric(self):
+        # INPUT a; LET b BE a + 1
+        code = program(
+            Opcode.INPUTSLOT, 0, 0,         # 0x04
+            Opcode.LOADSLOT, 0, 0,          # 0x07
+            Opcode.LITERAL1, 1,             # 0x0a
+            Opcode.ADD,                     # 0x0c
+            Opcode.STORESLOT, 0, 1,         # 0x0d
+        )
+        result = verify(code, [])
+        self.assertEqual(result.numeric, set([0x0d]))
+
+        # the type check is still there
+        vm = BasicVM()
+        vm.SetInput(ListInput(["x"]))
+        vm.Load(code, [], predecode=True, verified=result)
+        self.assertRaises(VmError, vm.Run)
+
+    def test_recursion(self):
+        code = program(
+            Opcode.CALLSUB, 0, 0x04,        # 0x04
+        )
+        result = verify(code, [])
+        self.assertEqual((result.max_stack, result.max_calls), (None, None))
+
+    def test_memocall(self):
+        code = program(
+            Opcode.LITERAL1, 3,             # 0x04
+            Opcode.LITERAL2, 0, 0x10,       # 0x06
+            Opcode.MEMOCALL, 1,             # 0x09
+            Opcode.MEMOSTORE,               # 0x0b
+            Opcode.STORESLOT, 0, 0,         # 0x0c
+            Opcode.HALT,                    # 0x0f
+            Opcode.STORESLOT, 0, 1,         # 0x10
+            Opcode.LOADSLOT, 0, 1,          # 0x13
+            Opcode.POPSCOPE,                # 0x16
+            Opcode.RETURN,                  # 0x17
+        )
+        result = verify(code, [])
+        self.assertEqual((result.max_stack, result.max_calls), (2, 1))
+        self.assertTrue(0x0c in result.numeric)
+
+    def test_bad_opcode(self):
+        self.assertEqual(self.assertRejected(program(Opcode.NOOP, 199), loc=5),
+            "unknown opcode")
+
+    def test_truncated(self):
+        self.assertRejected(program(Opcode.LITERAL2, 0))
+
+    def test_bad_target(self):
+        self.assertRejected(program(Opcode.JUMPABS, 0, 0x05), loc=4)
+        self.assertRejected(program(Opcode.JUMPABS, 0, 0x40), loc=4)
+
+    def test_computed_jump(self):
+        self.assertRejected(program(
+            Opcode.LOADSLOT, 0, 0,
+            Opcode.JUMP,
+        ), loc=7)
+
+    def test_strings(self):
+        print_string = program(Opcode.STRING2, 0, 1, Opcode.PRINTSTRLIT)
+        verify(print_string, ["a", "b"])
+        self.assertRejected(print_string, ["a"], loc=4)
+        self.assertRejected(print_string, ["a", 5], loc=4)
+        self.assertRejected(program(Opcode.LITERAL1, 3, Opcode.PRINTSTRLIT),
+            ["a"], loc=6)
+
+    def test_underflow(self):
+        self.assertRejected(program(Opcode.LITERAL1, 1, Opcode.ADD), loc=6)
+
+    def test_call_in_loop(self):
+        # a loop that CALLs a sub ending in RETURN 7, leaving a 7 behind
+        # each time round
+        code = program(
+            Opcode.LITERAL1, 3,             # 0x04
+            Opcode.STORESLOT, 0, 0,         # 0x06
+            Opcode.CALLSUB, 0, 0x1f,        # 0x09 loop:
+            Opcode.LOADSLOT, 0, 0,          # 0x0c
+            Opcode.LITERAL1, 1,             # 0x0f
+            Opcode.SUBTRACT,                # 0x11
+            Opcode.STORESLOT, 0, 0,         # 0x12
+            Opcode.LOADSLOT, 0, 0,          # 0x15
+            Opcode.LITERAL1, 0x1e,          # 0x18
+            Opcode.JUMPIF0,                 # 0x1a
+            Opcode.LITERAL1, 0x09,          # 0x1b
+            Opcode.JUMP,                    # 0x1d
+            Opcode.HALT,                    # 0x1e
+            Opcode.LITERAL1, 7,             # 0x1f
+            Opcode.POPSCOPE,                # 0x21
+            Opcode.RETURN,                  # 0x22
+        )
+        result = verify(code, [])
+        self.assertEqual((result.max_stack, result.max_calls), (None, 1))
+        self.assertEqual(result.numeric, set([0x06, 0x11, 0x12]))
+
+        vm = BasicVM()
+        vm.Load(code, [], predecode=True, verified=result)
+        vm.Run()
+        self.assertEqual((vm.SLOTS, vm.STACK), ([0], [7, 7, 7]))
+
+    def test_return_in_main(self):
+        self.assertRejected(program(Opcode.RETURN), loc=4)
+
+    def test_depth_differs(self):
+        # IF 1 THEN push an extra value
+        result = verify(program(
+            Opcode.LITERAL1, 1,             # 0x04
+            Opcode.LITERAL1, 0x0b,          # 0x06
+            Opcode.JUMPIF0,                 # 0x08
+            Opcode.LITERAL1, 7,             # 0x09
+            Opcode.HALT,                    # 0x0b
+        ), [])
+        self.assertEqual(result.max_stack, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+import unittest
+from vm import BasicVM, Opcode, VmError, Status
+from testutil import program
+
+class TestVM(unittest.TestCase):
+    """
+    Basic tests for the virtual machine
+    """
+
+    def run_program(self, code, strings=[], predecode=False):
+        vm = BasicVM()
+        vm.Load(code, strings, predecode=predecode)
+        vm.Run()
+        return vm
+
+    def test_arith(self):
+        # LET a BE 2 + 3
+        vm = self.run_program(program(
+            Opcode.LITERAL2, 0, 2,
+            Opcode.LITERAL2, 0, 3,
+            Opcode.ADD,
+            Opcode.NAME, 1, ord("a"),
+            Opcode.STORENUM,
+            Opcode.HALT,
+        ))
+        self.assertTrue(vm.halted)
+        self.assertEqual(vm.VARS["a"], 5)
+
+    def test_gosub(self):
+        vm = self.run_program(program(
+            Opcode.PUSHSCOPE,               # 0x04
+            Opcode.LITERAL2, 0, 0x0b,       # 0x05
+            Opcode.GOSUB,                   # 0x08
+            Opcode.POPSCOPE,                # 0x09
+            Opcode.HALT,                    # 0x0a
+            Opcode.LITERAL1, 7,             # 0x0b
+            Opcode.NAME, 1, ord("x"),       # 0x0d
+            Opcode.STORENUM,                # 0x10
+            Opcode.RETURN,                  # 0x11
+        ))
+        self.assertTrue(vm.halted)
+        self.assertEqual(vm.VARS, {})
+        self.assertEqual(vm.VAR_STACK, [])
+
+    def test_constant_pool(self):
+        # LET a BE 100000 + 1; LET b BE "x"
+        code = program(
+            Opcode.CONST2, 1, 0x2c,
+            Opcode.LITERAL1, 1,
+            Opcode.ADD,
+            Opcode.STORESLOT, 0, 0,
+            Opcode.STRING2, 0, 0,
+            Opcode.STORESTRSLOT, 0, 1,
+            Opcode.HALT,
+        )
+        pool = ["x"] + [None] * 299 + [100000]
+        for predecode in (False, True):
+            vm = self.run_program(code, pool, predecode=predecode)
+            self.assertEqual(vm.SLOTS, [100001, "x"])
+
+    def test_literal4(self):
+        # a wide jump over a LITERAL4
+        code = program(
+            Opcode.LITERAL4, 0, 0, 0, 0x0f,     # 0x04
+            Opcode.JUMP,                        # 0x09
+            Opcode.LITERAL4, 0xff, 0, 0, 0,     # 0x0a
+            Opcode.LITERAL4, 0, 1, 0, 0,        # 0x0f
+            Opcode.HALT,                        # 0x14
+        )
+        for predecode in (False, True):
+            vm = self.run_program(code, predecode=predecode)
+            self.assertEqual(vm.STACK, [0x10000])
+
+    # COMPUTE a AS Square 3, then COMPUTE b AS Square 3 again
+    square_twice = program(
+        Opcode.LITERAL1, 3,             # 0x04
+        Opcode.LITERAL2, 0, 0x1b,       # 0x06
+        Opcode.MEMOCALL, 1,             # 0x09
+        Opcode.MEMOSTORE,               # 0x0b
+        Opcode.STORESLOT, 0, 0,         # 0x0c
+        Opcode.LITERAL1, 3,             # 0x0f
+        Opcode.LITERAL2, 0, 0x1b,       # 0x11
+        Opcode.MEMOCALL, 1,             # 0x14
+        Opcode.MEMOSTORE,               # 0x16
+        Opcode.STORESLOT, 0, 1,         # 0x17
+        Opcode.HALT,                    # 0x1a
+        Opcode.STORESLOT, 0, 2,         # 0x1b
+        Opcode.LOADSLOT, 0, 2,          # 0x1e
+        Opcode.LOADSLOT, 0, 2,          # 0x21
+        Opcode.MULTIPLY,                # 0x24
+        Opcode.POPSCOPE,                # 0x25
+        Opcode.RETURN,                  # 0x26
+    )
+
+    def test_memocall(self):
+        for predecode in (False, True):
+            vm = self.run_program(self.square_twice, predecode=predecode)
+            self.assertTrue(vm.halted)
+            self.assertEqual(vm.SLOTS, [9, 9, None])
+            self.assertEqual((vm.memo.hits, vm.memo.misses), (1, 1))
+            self.assertEqual((vm.STACK, vm.IP_STACK, vm.MEMO_STACK), ([], [], []))
+
+    def test_end_of_memory(self):
+        vm = self.run_program(program(Opcode.LITERAL1, 1))
+        self.assertTrue(vm.halted)
+
+    def test_bad_opcode(self):
+        def inner():
+            self.run_program(program(Opcode.NOOP, 199))
+
+        self.assertRaises(VmError, inner)
+        try:
+            inner()
+        except VmError, e:
+            self.assertEqual(e.args[1].e, 199)
+            self.assertEqual(e.args[1].loc, 5)
+
+    def test_step_matches_run(self):
+        code = program(
+            Opcode.LITERAL1, 4,
+            Opcode.LITERAL1, 6,
+            Opcode.MULTIPLY,
+            Opcode.NAME, 1, ord("b"),
+            Opcode.STORENUM,
+        )
+        stepped = BasicVM()
+        stepped.Load(code, [])
+        while not stepped.halted:
+            stepped.Step()
+        ran = self.run_program(code)
+        self.assertEqual(stepped.IP, ran.IP)
+        self.assertEqual(stepped.VARS["b"], ran.VARS["b"])
+
+    def test_predecode(self):
+        code = program(
+            Opcode.PUSHSCOPE,               # 0x04
+            Opcode.LITERAL2, 0, 0x0b,       # 0x05
+            Opcode.GOSUB,                   # 0x08
+            Opcode.NOOP,                    # 0x09
+            Opcode.HALT,                    # 0x0a
+            Opcode.FLOAT4, 0x40, 0, 0, 0,   # 0x0b
+            Opcode.NAME, 1, ord("x"),       # 0x10
+            Opcode.STORENUM,                # 0x13
+            Opcode.NAME, 1, ord("x"),       # 0x14
+            Opcode.RETRV,                   # 0x17
+            Opcode.POPSCOPE,                # 0x18
+            Opcode.RETURN,                  # 0x19
+        )
+        vm = self.run_program(code, predecode=True)
+        self.assertEqual(vm.OPS[:3], [Opcode.PUSHSCOPE, Opcode.LITERAL2, Opcode.GOSUB])
+        # the GOSUB destination now points at the FLOAT4 instruction
+        self.assertEqual(vm.ARGS[1], 5)
+        self.assertEqual(vm.OPS[-1], Opcode.EOM_HALT)
+        self.assertTrue(vm.halted)
+        self.assertEqual(vm.STACK[0], 2.0)
+
+    def test_predecode_error_location(self):
+        code = program(
+            Opcode.LITERAL2, 0, 1,
+            Opcode.NAME, 3, ord("a"), ord("b"), ord("c"),
+            Opcode.RETRV,
+        )
+        for predecode in (False, True):
+            try:
+                self.run_program(code, predecode=predecode)
+                self.fail("expected a VmError")
+            except VmError, e:
+                self.assertEqual(e.args[1].e, "abc")
+                self.assertEqual(e.args[1].loc, 12)
+
+    def test_slots(self):
+        code = program(
+            Opcode.LITERAL1, 1,
+            Opcode.STORESLOT, 0, 1,         # b = 1
+            Opcode.LITERAL1, 0,
+            Opcode.STORESTRSLOT, 0, 0,      # a = strtab[0]
+            Opcode.PUSHSCOPE,
+            Opcode.LITERAL1, 5,
+            Opcode.STORESLOT, 0, 1,         # b = 5 in the new scope
+            Opcode.LOADSLOT, 0, 1,
+            Opcode.POPSCOPE,
+            Opcode.LOADSLOT, 0, 1,
+        )
+        for predecode in (False, True):
+            vm = self.run_program(code, ["hi"], predecode=predecode)
+            self.assertEqual(vm.slot_count, 2)
+            self.assertEqual(vm.SLOTS[0], "hi")
+            self.assertEqual(vm.STACK, [5, 1])
+
+    def test_undefined_slot(self):
+        code = program(Opcode.NOOP, Opcode.LOADSLOT, 0, 2)
+        for predecode in (False, True):
+            try:
+                self.run_program(code, predecode=predecode)
+                self.fail("expected a VmError")
+            except VmError, e:
+                self.assertEqual(e.args[1].e, 2)
+                self.assertEqual(e.args[1].loc, 5)
+
+    def test_time_slice(self):
+        code = program(
+            Opcode.LITERAL1, 1,
+            Opcode.LITERAL1, 2,
+            Opcode.ADD,
+            Opcode.HALT,
+        )
+        for predecode in (False, True):
+            vm = BasicVM()
+            vm.Load(code, [], predecode=predecode)
+            self.assertEqual(vm.Run(max_steps=2), Status.YIELDED)
+            self.assertEqual(vm.STACK, [1, 2])
+            self.assertEqual(vm.Run(max_steps=2), Status.HALTED)
+            self.assertEqual(vm.STACK, [3])
+
+    def test_waiting_for_input(self):
+        code = program(
+            Opcode.INPUTSLOT, 0, 0,
+            Opcode.LOADSLOT, 0, 0,
+            Opcode.HALT,
+        )
+        for predecode in (False, True):
+            vm = BasicVM()
+            vm.Load(code, [], predecode=predecode)
+            vm.SetBlockingInput(False)
+            self.assertEqual(vm.Run(), Status.WAITING)
+            self.assertEqual(vm.Run(), Status.WAITING)
+            vm.Feed("hello")
+            self.assertEqual(vm.Run(), Status.HALTED)
+            self.assertEqual(vm.STACK, ["hello"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import StringIO
+import unittest
+from vm import BasicVM, Opcode, Status, VmError
+from vmio import ConsoleOutput, MemoryOutput, InputSource, ListInput, StreamInput
+from testutil import program
+
+class TestOutput(unittest.TestCase):
+    """
+    Tests for the PRINT output sinks
+    """
+
+    items = ["a", 1, "b\n", 2.5, "", "c ", "d\t", 10L, "e"]
+
+    def test_matches_print(self):
+        # the sink lays items out exactly like print with a trailing comma
+        expected = StringIO.StringIO()
+        for item in self.items:
+            print >>expected, item,
+        sink = MemoryOutput()
+        for item in self.items:
+            sink.write(item)
+        self.assertEqual(sink.getvalue(), expected.getvalue())
+
+    def test_console_buffers(self):
+        stream = StringIO.StringIO()
+        sink = ConsoleOutput(stream, limit=4)
+        sink.write("a")
+        sink.write("b")
+        self.assertEqual(stream.getvalue(), "")
+        sink.write("c")
+        self.assertEqual(stream.getvalue(), "a b c")
+        sink.flush()
+        self.assertEqual(stream.getvalue(), "a b c")
+
+    def test_console_softspace(self):
+        # a print after the sink flushes still owes the stream a space
+        stream = StringIO.StringIO()
+        sink = ConsoleOutput(stream)
+        sink.write("a")
+        sink.flush()
+        print >>stream, "b"
+        sink.write("c")
+        sink.flush()
+        self.assertEqual(stream.getvalue(), "a b\nc")
+
+    def test_vm(self):
+        # PRINT 7; PRINT "hi"
+        code = program(
+            Opcode.LITERAL1, 7,
+            Opcode.PRINT,
+            Opcode.LITERAL1, 0,
+            Opcode.PRINTSTRLIT,
+            Opcode.HALT,
+        )
+        vm = BasicVM()
+        sink = MemoryOutput()
+        vm.SetOutput(sink)
+        vm.Load(code, ["hi\n"])
+        vm.Run()
+        self.assertEqual(sink.getvalue(), "7 hi\n")
+
+    def test_flush_on_error(self):
+        stream = StringIO.StringIO()
+        code = program(
+            Opcode.LITERAL1, 7,
+            Opcode.PRINT,
+            200,
+        )
+        vm = BasicVM()
+        vm.SetOutput(ConsoleOutput(stream))
+        vm.Load(code, [])
+        self.assertRaises(VmError, vm.Run)
+        self.assertEqual(stream.getvalue(), "7")
+
+class TestInput(unittest.TestCase):
+    """
+    Tests for the INPUT sources
+    """
+
+    # INPUT a, b
+    code = program(
+        Opcode.INPUTSLOT, 0, 0,
+        Opcode.INPUTSLOT, 0, 1,
+        Opcode.HALT,
+    )
+
+    def run_vm(self, source, blocking=True):
+        vm = BasicVM()
+        vm.SetInput(source)
+        vm.SetBlockingInput(blocking)
+        vm.Load(self.code, [])
+        return (vm, vm.Run())
+
+    def test_list(self):
+        (vm, status) = self.run_vm(ListInput(["x", "y", "z"]))
+        self.assertEqual(status, Status.HALTED)
+        self.assertEqual(vm.SLOTS, ["x", "y"])
+
+    def test_stream(self):
+        (vm, status) = self.run_vm(StreamInput(StringIO.StringIO("x\ny")))
+        self.assertEqual(vm.SLOTS, ["x", "y"])
+
+    def test_iterator(self):
+        lines = (line for line in ["x", "y"])
+        (vm, status) = self.run_vm(InputSource(lines))
+        self.assertEqual(vm.SLOTS, ["x", "y"])
+        self.assertRaises(EOFError, self.run_vm, InputSource(iter(["x"])))
+        self.assertEqual(InputSource().read(False), None)
+
+    def test_exhausted(self):
+        self.assertRaises(EOFError, self.run_vm, ListInput(["x"]))
+
+    def test_waiting(self):
+        (vm, status) = self.run_vm(ListInput(["x"]), blocking=False)
+        self.assertEqual(status, Status.WAITING)
+        self.assertEqual(vm.SLOTS, ["x", None])
+        vm.Feed("y")
+        self.assertEqual(vm.Run(), Status.HALTED)
+        self.assertEqual(vm.SLOTS, ["x", "y"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,6 @@
+"""Helpers shared by the test-*.py files"""
+
+
+def program(*ops):
+    """Bytecode for ops, after the 4 bytes of metadata the VM skips"""
+    return bytearray([ord("P"), ord("B"), ord("0"), ord("1")] + list(ops))
@@ -0,0 +1,227 @@
+import struct
+import sys
+from vm import BasicVM, Opcode, VmError, Status, WaitingForInput
+from blockvm import BlockVM, Uncompilable
+
+
+class EnterHotCode(Exception):
+    """Raised by a control transfer that lands in hot code, to get out of
+    the interpreter loop"""
+    pass
+
+
+class TieredVM(BlockVM):
+    """A VM that interprets the bytecode until it finds a loop worth
+    compiling.
+
+    Every backward jump that's taken is counted against its destination.
+    When a destination has been jumped back to HOT_LOOP_THRESHOLD times,
+    the code from there to the jump is marked hot. From then on, whenever
+    execution gets into hot code, by a jump, call or return, it runs as
+    BlockVM blocks, until it leaves the hot code again. Subroutines that
+    hot code calls become hot as they run.
+
+    So straight-line and rarely run code costs no more than it does in
+    BasicVM, with nothing compiled up front, and loops get compiled once
+    they've shown they're worth it. Results, output and VmError locations
+    are the same as BasicVM.Run, whichever tier things run in. If a block
+    can't be compiled, its address goes back to being interpreted."""
+
+    HOT_LOOP_THRESHOLD = 50
+
+    HANDLERS = dict(BlockVM.HANDLERS)
+    HANDLERS.update({
+        Opcode.JUMP:        "op_jump_counted",
+        Opcode.JUMPIF0:     "op_jumpif0_counted",
+        Opcode.JUMPABS:     "op_jumpabs_counted",
+        Opcode.JUMPIFNOTEQ: "op_jumpifnoteq_counted",
+        Opcode.JUMPIFNOTLT: "op_jumpifnotlt_counted",
+        Opcode.JUMPIFNOTLTE: "op_jumpifnotlte_counted",
+        Opcode.GOSUB:       "op_gosub_checked",
+        Opcode.CALLSUB:     "op_callsub_checked",
+        Opcode.MEMOCALL:    "op_memocall_checked",
+        Opcode.RETURN:      "op_return_checked",
+    })
+
+    def Load(self, code, string_table, predecode=False, verified=None,
+            lines=None, names=None):
+        BlockVM.Load(self, code, string_table, verified=verified, lines=lines,
+            names=names)
+        self.back_edges = {}    # destination => times jumped back to
+        # address => 1 if it's in a hot loop; one longer than the code, so
+        # jumps to the end of memory can be looked up too
+        self.hot = bytearray(len(code) + 1)
+
+    def Jumped(self, source, dest):
+        """Called after a jump from source to dest that either went
+        backwards or landed in hot code"""
+        if dest <= source:
+            count = self.back_edges.get(dest, 0) + 1
+            self.back_edges[dest] = count
+            if count == self.HOT_LOOP_THRESHOLD:
+                self.hot[dest:source+1] = "\x01" * (source + 1 - dest)
+        if dest < len(self.hot) and self.hot[dest]:
+            raise EnterHotCode()
+
+    # BasicVM's control transfers, plus counting and checking for hot code.
+    # Anything that doesn't jump backwards or into hot code only pays for
+    # a comparison or two.
+
+    def op_jump_counted(self):
+        source = self.IP
+        dest = self.STACK.pop()
+        self.IP = dest - 1
+        if dest <= source or dest < len(self.hot) and self.hot[dest]:
+            self.Jumped(source, dest)
+
+    def op_jumpif0_counted(self):
+        dest = self.STACK.pop()
+        if self.STACK.pop() == 0:
+            source = self.IP
+            self.IP = dest - 1
+            if dest <= source or dest < len(self.hot) and self.hot[dest]:
+                self.Jumped(source, dest)
+
+    def fused_jump(self):
+        source = self.IP
+        dest = struct.unpack_from(">h", self.code, source + 1)[0]
+        self.IP = dest - 1
+        if dest <= source or dest < len(self.hot) and self.hot[dest]:
+            self.Jumped(source, dest)
+
+    op_jumpabs_counted = fused_jump
+
+    def op_jumpifnoteq_counted(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if op1 == op2:
+            self.IP += 2
+        else:
+            self.fused_jump()
+
+    def op_jumpifnotlt_counted(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if op1 < op2:
+            self.IP += 2
+        else:
+            self.fused_jump()
+
+    def op_jumpifnotlte_counted(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if op1 <= op2:
+            self.IP += 2
+        else:
+            self.fused_jump()
+
+    def op_gosub_checked(self):
+        self.IP_STACK.append(self.IP)
+        dest = self.STACK.pop()
+        self.IP = dest - 1
+        if dest < len(self.hot) and self.hot[dest]:
+            raise EnterHotCode()
+
+    def op_callsub_checked(self):
+        self.op_pushscope()
+        self.IP_STACK.append(self.IP + 2)
+        dest = struct.unpack_from(">h", self.code, self.IP + 1)[0]
+        self.IP = dest - 1
+        if dest < len(self.hot) and self.hot[dest]:
+            raise EnterHotCode()
+
+    def op_memocall_checked(self):
+        addr = self.STACK.pop()
+        dest = self.MemoCall(addr, self.code[self.IP + 1], self.IP + 1)
+        self.IP = dest - 1
+        if dest < len(self.hot) and self.hot[dest]:
+            raise EnterHotCode()
+
+    def op_return_checked(self):
+        self.IP = self.IP_STACK.pop()
+        if self.hot[self.IP + 1]:
+            raise EnterHotCode()
+
+    def Run(self, max_steps=None):
+        if self.debugger:
+            # step through with the plain handlers, which don't count jumps
+            # or tier up
+            (dispatch, self.dispatch) = (self.dispatch,
+                self.BuildDispatch(BlockVM.HANDLERS))
+            try:
+                return BasicVM.Run(self, max_steps)
+            finally:
+                self.dispatch = dispatch
+
+        budget = sys.maxint if max_steps is None else max_steps
+        try:
+            while not self.halted and budget > 0:
+                if self.IP < len(self.hot) and self.hot[self.IP]:
+                    budget -= self.RunHot(budget)
+                else:
+                    budget -= self.RunCold(budget)
+        except WaitingForInput:
+            return Status.WAITING
+        finally:
+            self.output.flush()
+        return Status.HALTED if self.halted else Status.YIELDED
+
+    def RunCold(self, budget):
+        """Interpret until the budget runs out, the program halts or
+        execution gets into hot code. Returns the number of instructions
+        run."""
+        code = self.code
+        dispatch = self.dispatch
+        steps = 0
+        try:
+            for steps in xrange(budget):
+                if self.halted:
+                    return steps
+                dispatch[code[self.IP]]()
+                self.IP += 1
+        except EnterHotCode:
+            self.IP += 1
+        except IndexError:
+            if self.IP < len(code):
+                raise
+            # ran off the end of memory
+            self.op_halt()
+            self.IP += 1
+        return steps + 1
+
+    def RunHot(self, budget):
+        """Run compiled blocks until the budget runs out, the program halts
+        or execution leaves hot code. Returns the number of instructions
+        run."""
+        blocks = self.blocks
+        hot = self.hot
+        ip = self.IP
+        steps = 0
+        # anything a hot loop calls is hot too, until it returns
+        depth = len(self.IP_STACK)
+        try:
+            while not self.halted and steps < budget:
+                if ip >= len(hot):
+                    break
+                if not hot[ip]:
+                    if len(self.IP_STACK) <= depth:
+                        break
+                    hot[ip] = 1
+                block = blocks.get(ip)
+                if block is None:
+                    try:
+                        block = self.CompileBlock(ip)
+                    except Uncompilable:
+                        # leave this one to the interpreter
+                        hot[ip] = 0
+                        break
+                ip = block(self, self.STACK, self.IP_STACK, self.string_table)
+                steps += block.size
+        except VmError, e:
+            self.IP = e.args[1].loc
+            raise
+        except WaitingForInput:
+            self.IP = ip
+            raise
+        self.IP = ip
+        return steps
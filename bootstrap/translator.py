@@ -5,51 +5,265 @@ import struct
 from lexer import tokenize
 from parser import parse, PClear, PLabel, PLet, PPrint, PIf, PGoto, PInput, PEnd
 from parser import PExpr, PVar, PNumber, PArith, PString
-from parser import PCall, PCompute, PReturn, PAccept
+from parser import PCall, PCompute, PReturn, PAccept, PLine
 from vm import Opcode
 
+# ranges of the numbers that fit in a LITERAL2 and a LITERAL4, bigger ones
+# are pooled
+MIN_LITERAL2 = -0x8000
+MAX_LITERAL2 = 0x7fff
+MIN_LITERAL4 = -0x80000000
+MAX_LITERAL4 = 0x7fffffff
+
+# subroutines with at most this many statements between the label and the
+# RETURN get copied into the COMPUTEs and CALLs that use them
+INLINE_MAX_STATEMENTS = 8
+
+# a subroutine that can be inlined
+#   accepts  names from its ACCEPT, or None if it doesn't have one
+#   body     statements between the ACCEPT and the RETURN
+#   result   the RETURN's expression, or None
+#   private  True if its variables can live in slots of their own, so the
+#            copy doesn't need a scope
+Inlinable = collections.namedtuple('Inlinable',
+    ['accepts', 'body', 'result', 'private'])
+
 
 class TranslatorError(RuntimeError):
     pass
 
 
 class TContext(object):
-    label_table = {}
-    string_table = []
-    label_fixups = []
-    last_label = None
-    check_accepts = {}
-    check_computes = []
-    # by convention, put a magic number at the beginning
-    # for this case, "PB01" in ASCII
-    code = bytearray([ord("P"), ord("B"), ord("0"), ord("1")])
-
-
-def translate(ast):
+    """Everything one translate() call works on. Nothing is shared between
+    instances, so translations can run one after another or side by side
+    in threads."""
+
+    def __init__(self, wide=False, inline=False, memoize=False):
+        self.wide = wide        # label addresses are LITERAL4s, not LITERAL2s
+        self.inline = inline    # copy small subroutines into their callers
+        self.inlinable = {}     # label => Inlinable
+        self.memoize = memoize  # memoize COMPUTEs of pure subroutines
+        self.pure = set()       # labels of pure subroutines
+        self.label_table = {}
+        self.string_table = []  # the constant pool, strings and big numbers
+        self.const_index = {}   # (type, value) => index in string_table
+        self.slot_table = {}
+        self.label_fixups = []
+        self.last_label = None
+        self.check_accepts = {}
+        self.check_computes = []
+        self.line_table = []    # (offset, line) for each PLine, see linetable
+        # by convention, put a magic number at the beginning
+        # for this case, "PB01" in ASCII
+        self.code = bytearray([ord("P"), ord("B"), ord("0"), ord("1")])
+
+
+def translate(ast, inline=False, memoize=False):
+    ctx = translate_context(ast, inline, memoize)
+    return (ctx.code, ctx.string_table)
+
+
+def translate_context(ast, inline=False, memoize=False):
+    """Translate a program, returning the whole TContext rather than just
+    the code and strings, for callers that want the label table too.
+
+    With inline set, small subroutines are copied into the COMPUTEs and
+    CALLs that use them instead of being called. With memoize set,
+    COMPUTEs of pure subroutines look in the VM's memo cache first."""
+    ctx = TContext(inline=inline, memoize=memoize)
+    codegen_program(ast, ctx)
+    if len(ctx.code) > MAX_LITERAL2:
+        # some label addresses may not fit in a LITERAL2, so start over
+        # with room for 4-byte ones everywhere
+        ctx = TContext(wide=True, inline=inline, memoize=memoize)
+        codegen_program(ast, ctx)
+    resolve(ctx)
+    return ctx
+
+
+def translate_stream(statements):
+    """Translate a program as its statements are generated, so the AST is
+    never all in memory; only the code and tables grow with the program.
+
+    statements is a function returning a fresh iterator of them, like
+    parse_iter over tokenize of the source. It's only called a second time
+    if the code outgrows 2-byte label addresses, as soon as it does.
+    Inlining and memoizing need the whole program first, so they aren't
+    done. Returns the TContext, like translate_context."""
     ctx = TContext()
+    for op in statements():
+        codegen_op(op, ctx)
+        if len(ctx.code) > MAX_LITERAL2:
+            ctx = TContext(wide=True)
+            codegen_program(statements(), ctx)
+            break
+    resolve(ctx)
+    return ctx
 
-    for op in ast:
-        if type(op) == PLabel:
-            codegen_label(op.id, ctx)
-            ctx.last_label = op.id
 
-        else:
-            codegen_stmt(op, ctx)
+def slot_names(ctx):
+    """The variable names in slot order, for VmError messages"""
+    return sorted(ctx.slot_table, key=ctx.slot_table.get)
 
+
+def resolve(ctx):
+    """Once all the code is there, fill in the label addresses and check
+    the argument counts"""
     # fix GOTO back-refs
     while len(ctx.label_fixups) > 0:
         (label,addr) = ctx.label_fixups.pop()
         label_addr = ctx.label_table[label]
-        val = struct.pack(">h", label_addr)
-        ctx.code[addr]   = ord(val[0])
-        ctx.code[addr+1] = ord(val[1])
+        val = struct.pack(">i" if ctx.wide else ">h", label_addr)
+        ctx.code[addr:addr+len(val)] = val
 
     # verify that all COMPUTEs have the same arg count as their ACCEPTs
     for (compute_label, compute_count) in ctx.check_computes:
         if ctx.check_accepts[compute_label] != compute_count:
             raise TranslatorError("Incorrect argument count for a COMPUTE", compute_label)
 
-    return (ctx.code, ctx.string_table)
+
+def codegen_program(ast, ctx):
+    if ctx.inline:
+        ctx.inlinable = find_inlinable(ast)
+    if ctx.memoize:
+        ctx.pure = find_pure(ast)
+    for op in ast:
+        codegen_op(op, ctx)
+
+
+def codegen_op(op, ctx):
+    if type(op) == PLabel:
+        codegen_label(op.id, ctx)
+        ctx.last_label = op.id
+
+    elif type(op) == PLine:
+        codegen_line(op.line, ctx)
+
+    else:
+        codegen_stmt(op, ctx)
+
+
+def codegen_line(line, ctx):
+    """Record that the code from here on comes from line"""
+    offset = len(ctx.code)
+    if ctx.line_table and ctx.line_table[-1][0] == offset:
+        # the last statement didn't emit anything
+        ctx.line_table[-1] = (offset, line)
+    else:
+        ctx.line_table.append((offset, line))
+
+
+def find_inlinable(ast):
+    """Find the subroutines that are worth inlining, returning a dict of
+    label => Inlinable.
+
+    That's the ones that are a label, maybe an ACCEPT, a few LETs, PRINTs
+    and INPUTs, and a RETURN. Anything that jumps, calls or halts would
+    need the subroutine's own code to behave the same, so those aren't
+    touched; the subroutine is still translated either way, for GOTOs and
+    for anything that falls into it."""
+    inlinable = {}
+    ast = [op for op in ast if type(op) != PLine]
+    for (n, op) in enumerate(ast):
+        if type(op) != PLabel:
+            continue
+        stmts = []
+        for stmt in ast[n+1:n+2+INLINE_MAX_STATEMENTS]:
+            stmts.append(stmt)
+            if type(stmt) not in (PAccept, PLet, PPrint, PInput):
+                break
+        if not stmts or type(stmts[-1]) != PReturn:
+            continue
+        accepts = None
+        if type(stmts[0]) == PAccept:
+            accepts = [var.id for var in stmts[0].rhs]
+            stmts = stmts[1:]
+        body = stmts[:-1]
+        if any(type(stmt) == PAccept for stmt in body):
+            continue
+        result = stmts[-1].expr
+        inlinable[op.id] = Inlinable(accepts, body, result,
+            private=assigned_before_use(accepts or [], body, result))
+    return inlinable
+
+
+def assigned_before_use(accepts, body, result):
+    """True if straight-line code never reads a variable it hasn't set
+    itself, so it can't tell whether it has a scope of its own"""
+    assigned = set(accepts)
+    def reads(expr):
+        return set(op.id for op in expr.expr if type(op) == PVar)
+    for stmt in body:
+        if type(stmt) == PLet:
+            if type(stmt.rhs) == PExpr and not reads(stmt.rhs) <= assigned:
+                return False
+            assigned.add(stmt.id)
+        elif type(stmt) == PPrint:
+            for printable in stmt.rhs:
+                if type(printable) == PExpr and not reads(printable) <= assigned:
+                    return False
+        elif type(stmt) == PInput:
+            assigned.update(var.id for var in stmt.rhs)
+    return result is None or reads(result) <= assigned
+
+
+def rename_vars(node, prefix):
+    """Copy of a statement or expression with prefix put in front of every
+    variable name"""
+    if type(node) == PVar:
+        return PVar(prefix + node.id)
+    if type(node) == PExpr:
+        return PExpr([rename_vars(op, prefix) for op in node.expr])
+    if type(node) == PLet:
+        return PLet(prefix + node.id, rename_vars(node.rhs, prefix))
+    if type(node) in (PPrint, PInput):
+        return type(node)([rename_vars(op, prefix) for op in node.rhs])
+    return node
+
+
+def find_pure(ast):
+    """Find the subroutines whose result only depends on their arguments,
+    so COMPUTEs of them can be memoized. Returns a set of labels.
+
+    That's the ones that start with an ACCEPT, end with a RETURN before
+    the next label, return a value everywhere, and in between only LET,
+    IF, RETURN and COMPUTE other pure subroutines (or themselves). They
+    run in a scope of their own, so everything they can read is an
+    argument or something they set, and nothing they set outlives them.
+    No PRINT, INPUT, CLEAR, END, GOTO or CALL."""
+    bodies = {}     # label => statements up to the next label
+    body = None
+    for op in ast:
+        if type(op) == PLabel:
+            body = bodies[op.id] = []
+        elif type(op) != PLine and body is not None:
+            body.append(op)
+
+    def allowed(stmt):
+        while type(stmt) == PIf:
+            stmt = stmt.stmt
+        if type(stmt) == PReturn:
+            return stmt.expr is not None
+        return type(stmt) in (PLet, PCompute)
+
+    pure = set(label for (label, body) in bodies.items()
+        if len(body) >= 2 and type(body[0]) == PAccept and
+            type(body[-1]) == PReturn and all(allowed(stmt) for stmt in body[1:]))
+
+    # drop the ones that compute impure ones, until there's nothing to drop
+    def computes(stmt):
+        while type(stmt) == PIf:
+            stmt = stmt.stmt
+        return stmt.label if type(stmt) == PCompute else None
+    changed = True
+    while changed:
+        changed = False
+        for label in list(pure):
+            if any(computes(stmt) not in pure | set([None])
+                    for stmt in bodies[label]):
+                pure.remove(label)
+                changed = True
+    return pure
 
 
 def codegen_stmt(op, ctx):
@@ -93,6 +307,10 @@ def codegen_call(op, ctx):
     """CALL means move execution to the specified label with a new scope
     of variables. Also, save the place where execution left off, since we'll
     come back here with a RETURN."""
+    sub = ctx.inlinable.get(op.label)
+    if sub is not None and sub.accepts is None and sub.result is None:
+        codegen_inline(op.label, sub, ctx)
+        return
     ctx.code.append(Opcode.PUSHSCOPE)
     codegen_label_address(op.label, ctx)
     ctx.code.append(Opcode.GOSUB)
@@ -110,13 +328,48 @@ def codegen_compute(op, ctx):
     # save the number of arguments called for later checking
     ctx.check_computes.append( (op.label, arg_count) )
 
+    sub = ctx.inlinable.get(op.label)
+    if sub is not None and sub.result is not None and \
+            len(sub.accepts or []) == arg_count:
+        codegen_inline(op.label, sub, ctx)
+        codegen_slot(Opcode.STORESLOT, op.id, ctx)
+        return
+
+    if op.label in ctx.pure and arg_count <= 0xff:
+        codegen_label_address(op.label, ctx)
+        ctx.code.append(Opcode.MEMOCALL)
+        ctx.code.append(arg_count)
+        # -- on a miss, the subroutine returns here
+        ctx.code.append(Opcode.MEMOSTORE)
+        codegen_slot(Opcode.STORESLOT, op.id, ctx)
+        return
+
     ctx.code.append(Opcode.PUSHSCOPE)
     codegen_label_address(op.label, ctx)
     ctx.code.append(Opcode.GOSUB)
     # -- execution calls out to the subroutine, and when it returns,
     #    we should have the result on the stack
-    codegen_name(op.id, ctx)
-    ctx.code.append(Opcode.STORENUM)
+    codegen_slot(Opcode.STORESLOT, op.id, ctx)
+
+def codegen_inline(label, sub, ctx):
+    """Emit a copy of a subroutine in place of a call to it, leaving its
+    result on the stack if it has one.
+
+    A subroutine that only reads variables it has set itself gets slots
+    named after it instead of a scope, which saves the allocations."""
+    if sub.private:
+        prefix = "$" + label + "."
+    else:
+        prefix = ""
+        ctx.code.append(Opcode.PUSHSCOPE)
+    for name in sub.accepts or []:
+        codegen_slot(Opcode.STORESLOT, prefix + name, ctx)
+    for stmt in sub.body:
+        codegen_stmt(rename_vars(stmt, prefix), ctx)
+    if sub.result is not None:
+        codegen_expr(rename_vars(sub.result, prefix), ctx)
+    if not sub.private:
+        ctx.code.append(Opcode.POPSCOPE)
 
 def codegen_return(op, ctx):
     """RETURN means destroy the local scope and return execution to where ever
@@ -143,9 +396,8 @@ def codegen_accept(op, ctx):
     # record these variables so we can check their count later
     ctx.check_accepts[ctx.last_label] = 0
     for var in op.rhs:
-        codegen_name(var.id, ctx)
         # TODO: allow strings as arguments to subroutines
-        ctx.code.append(Opcode.STORENUM)
+        codegen_slot(Opcode.STORESLOT, var.id, ctx)
         ctx.check_accepts[ctx.last_label] += 1
 
 def codegen_if(op, ctx):
@@ -187,9 +439,13 @@ def codegen_goto(label, ctx):
     ctx.code.append(Opcode.JUMP)            # jump to it
 
 def codegen_label_address(label, ctx):
-    # the +1 accounts for the LITERAL2 op
+    # the +1 accounts for the LITERAL op
     ctx.label_fixups.append((label,len(ctx.code)+1))
-    codegen_literal2(0, ctx)    # placeholder of 0, will be overwritten later
+    # placeholder of 0, will be overwritten later
+    if ctx.wide:
+        codegen_literal4(0, ctx)
+    else:
+        codegen_literal2(0, ctx)
 
 def codegen_print(op, ctx):
     if type(op) != PPrint:
@@ -207,8 +463,7 @@ def codegen_input(op, ctx):
         raise TranslatorError("expected an input statement", op)
     for input_var in op.rhs:
         if type(input_var) == PVar:
-            codegen_name(input_var.id, ctx)
-            ctx.code.append(Opcode.INPUT)
+            codegen_slot(Opcode.INPUTSLOT, input_var.id, ctx)
         else:
             raise TranslatorError("expected an input variable", input_var)
 
@@ -217,20 +472,28 @@ def codegen_let(op, ctx):
 
     if type(op.rhs) == PExpr:
         codegen_expr(op.rhs, ctx)
-        codegen_name(name, ctx)
-        ctx.code.append(Opcode.STORENUM)
+        codegen_slot(Opcode.STORESLOT, name, ctx)
     elif type(op.rhs) == PString:
         codegen_str(op.rhs, ctx)
-        codegen_name(name, ctx)
-        ctx.code.append(Opcode.STORESTR)
+        codegen_slot(Opcode.STORESTRSLOT, name, ctx)
     else:
         raise TranslatorError("don't know how to transform the RHS", op)
 
-def codegen_name(name, ctx):
-    ctx.code.append(Opcode.NAME)
-    ctx.code.append(len(name))
-    for letter in name:
-        ctx.code.append(ord(letter))
+def codegen_slot(opcode, name, ctx):
+    """Emit a variable access by slot number instead of by name.
+
+    Which scope a line runs in is only known at runtime (the same label can
+    be reached with GOTO and with CALL), so slot numbers are handed out once
+    per program and every scope gets its own frame with room for all of
+    them."""
+    if name not in ctx.slot_table:
+        ctx.slot_table[name] = len(ctx.slot_table)
+    slot = ctx.slot_table[name]
+    if slot > 0xffff:
+        raise TranslatorError("too many variables", name)
+    ctx.code.append(opcode)
+    ctx.code.append(slot >> 8)
+    ctx.code.append(slot & 0xff)
 
 def codegen_literal2(value, ctx):
     ctx.code.append(Opcode.LITERAL2)
@@ -238,6 +501,10 @@ def codegen_literal2(value, ctx):
     ctx.code.append(ord(val[0]))
     ctx.code.append(ord(val[1]))
 
+def codegen_literal4(value, ctx):
+    ctx.code.append(Opcode.LITERAL4)
+    ctx.code.extend(struct.pack(">i", value))
+
 def codegen_float4(value, ctx):
     ctx.code.append(Opcode.FLOAT4)
     val = struct.pack(">f", value)
@@ -255,8 +522,13 @@ def codegen_expr(expr_token, ctx):
             if "." in op.value:
                 codegen_float4(float(op.value), ctx)
             else:
-                # TODO: bug #5 (deal with numbers > 65K)
-                codegen_literal2(int(op.value), ctx)
+                value = int(op.value)
+                if MIN_LITERAL2 <= value <= MAX_LITERAL2:
+                    codegen_literal2(value, ctx)
+                elif MIN_LITERAL4 <= value <= MAX_LITERAL4:
+                    codegen_literal4(value, ctx)
+                else:
+                    codegen_pooled(Opcode.CONST2, value, ctx)
 
         elif type(op) == PArith:
             if op.op == "+":
@@ -281,19 +553,27 @@ def codegen_str(str_token, ctx):
     if type(str_token) != PString:
         raise TranslatorError("expected a string literal to parse", str_token)
 
-    # tries not to include dupe strings
-    ctx.code.append(Opcode.LITERAL1)
-    if str_token.value in ctx.string_table:
-        ctx.code.append(ctx.string_table.index(str_token.value))
-    else:
-        ctx.string_table.append(str_token.value)
-        ctx.code.append(len(ctx.string_table)-1)
+    codegen_pooled(Opcode.STRING2, str_token.value, ctx)
+
+def codegen_pooled(opcode, value, ctx):
+    """Emit an opcode whose operand is value's index in the constant pool,
+    adding it to the pool if it isn't there yet."""
+    # the type is part of the key so that 1 and 1.0 stay apart
+    key = (type(value), value)
+    index = ctx.const_index.get(key)
+    if index is None:
+        index = ctx.const_index[key] = len(ctx.string_table)
+        ctx.string_table.append(value)
+    if index > 0xffff:
+        raise TranslatorError("too many constants", value)
+    ctx.code.append(opcode)
+    ctx.code.append(index >> 8)
+    ctx.code.append(index & 0xff)
 
 def codegen_read_var(op, ctx):
     if type(op) != PVar:
         raise TranslatorError("expected a variable", op)
-    codegen_name(op.id, ctx)
-    ctx.code.append(Opcode.RETRV)
+    codegen_slot(Opcode.LOADSLOT, op.id, ctx)
 
 
 # quick and dirty disassembler
@@ -327,6 +607,23 @@ def disassemble(code, metadata_bytes=4, base_addr=0):
         elif code[i] == Opcode.JUMPIF0:
             print addr(i) + " JUMPIF0"
 
+        elif code[i] in (Opcode.JUMPABS, Opcode.JUMPIFNOTEQ, Opcode.JUMPIFNOTLT,
+                Opcode.JUMPIFNOTLTE, Opcode.CALLSUB):
+            names = {
+                Opcode.JUMPABS: "JUMPABS",
+                Opcode.JUMPIFNOTEQ: "JUMPIFNOTEQ",
+                Opcode.JUMPIFNOTLT: "JUMPIFNOTLT",
+                Opcode.JUMPIFNOTLTE: "JUMPIFNOTLTE",
+                Opcode.CALLSUB: "CALLSUB",
+            }
+            try:
+                raw = chr(code[i+1]) + chr(code[i+2])
+                dest = struct.unpack(">h", raw)[0]
+                print addr(i) + " " + names[code[i]], "{:#04x}".format(dest)
+                i += 2
+            except IndexError:
+                print "*** ran out of bytes to process"
+
         elif code[i] == Opcode.LITERAL1:
             try:
                 print addr(i) + " LITERAL1", code[i+1], "/", hex(code[i+1])
@@ -346,6 +643,27 @@ def disassemble(code, metadata_bytes=4, base_addr=0):
             except IndexError:
                 print "*** ran out of bytes to process"
 
+        elif code[i] in (Opcode.STRING2, Opcode.CONST2):
+            names = {
+                Opcode.STRING2: "STRING2",
+                Opcode.CONST2: "CONST2",
+            }
+            try:
+                index = (code[i+1] << 8) | code[i+2]
+                print addr(i) + " " + names[code[i]], index
+                i += 2
+            except IndexError:
+                print "*** ran out of bytes to process"
+
+        elif code[i] == Opcode.LITERAL4:
+            try:
+                val = struct.unpack(">i", str(code[i+1:i+5]))[0]
+                print addr(i) + " LITERAL4", val, "/", hex(val)
+                i += 4
+                print addr(i) + "         ^^^"
+            except struct.error:
+                print "*** ran out of bytes to process"
+
         elif code[i] == Opcode.NAME:
             try:
                 name = ""
@@ -358,6 +676,21 @@ def disassemble(code, metadata_bytes=4, base_addr=0):
             except IndexError:
                 print "*** ran out of bytes to process"
 
+        elif code[i] in (Opcode.LOADSLOT, Opcode.STORESLOT,
+                Opcode.STORESTRSLOT, Opcode.INPUTSLOT):
+            names = {
+                Opcode.LOADSLOT: "LOADSLOT",
+                Opcode.STORESLOT: "STORESLOT",
+                Opcode.STORESTRSLOT: "STORESTRSLOT",
+                Opcode.INPUTSLOT: "INPUTSLOT",
+            }
+            try:
+                slot = (code[i+1] << 8) | code[i+2]
+                print addr(i) + " " + names[code[i]], slot
+                i += 2
+            except IndexError:
+                print "*** ran out of bytes to process"
+
         elif code[i] == Opcode.STORENUM:
             print addr(i) + " STORENUM"
 
@@ -415,6 +748,16 @@ def disassemble(code, metadata_bytes=4, base_addr=0):
         elif code[i] == Opcode.RETURN:
             print addr(i) + " RETURN"
 
+        elif code[i] == Opcode.MEMOCALL:
+            try:
+                print addr(i) + " MEMOCALL", code[i+1]
+                i += 1
+            except IndexError:
+                print "*** ran out of bytes to process"
+
+        elif code[i] == Opcode.MEMOSTORE:
+            print addr(i) + " MEMOSTORE"
+
         elif code[i] == Opcode.HALT:
             print addr(i) + " HALT"
 
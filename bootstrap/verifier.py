@@ -0,0 +1,319 @@
+import collections
+from vm import BasicVM, Opcode, VmError, ErrCtx, decode
+from vm import ADDR_OPS, LITERAL_OPS, JUMPS
+
+
+class VerifierError(VmError):
+    pass
+
+
+# what the verifier found out about a program that passed
+#   max_stack   most values ever on the value stack, None if unbounded
+#   max_calls   deepest the IP stack ever gets, None if unbounded
+#   numeric     offsets of the arithmetic and STORESLOT instructions whose
+#               operands are always numbers
+Verified = collections.namedtuple('Verified', ['max_stack', 'max_calls', 'numeric'])
+
+# Types of the values on the abstract stack. Known integers are kept as
+# themselves, so string table indexes can be checked.
+NUM = "n"
+ANY = "?"
+
+ARITH = (Opcode.ADD, Opcode.SUBTRACT, Opcode.MULTIPLY, Opcode.DIVIDE)
+COMPARES = (Opcode.EQUAL, Opcode.LT, Opcode.LTE)
+BRANCHES = (Opcode.JUMPIFNOTEQ, Opcode.JUMPIFNOTLT, Opcode.JUMPIFNOTLTE)
+
+
+def is_num(t):
+    return t == NUM or type(t) in (int, long)
+
+
+def merge_type(a, b):
+    if a == b:
+        return a
+    if is_num(a) and is_num(b):
+        return NUM
+    return ANY
+
+
+class Frame(object):
+    """The abstract state at an instruction, relative to the start of the
+    subroutine it's in: the types of the values the subroutine has pushed,
+    and how many of its caller's values it has popped.
+
+    Paths that meet with different stack depths, like a loop around a
+    CALL that leaves its result behind, give a frame that isn't exact:
+    only the top of the stack, as deep as every path has it, is known,
+    and there may be anything under it."""
+
+    def __init__(self, borrowed, stack, exact=True):
+        self.borrowed = borrowed
+        self.stack = stack
+        self.exact = exact
+
+    def depth(self):
+        """How deep the stack is, or None if it isn't known"""
+        if not self.exact:
+            return None
+        return len(self.stack) - self.borrowed
+
+    def copy(self):
+        return Frame(self.borrowed, list(self.stack), self.exact)
+
+    def merge(self, other, loc):
+        """Merge other into this frame, returning True if it changed"""
+        borrowed = max(self.borrowed, other.borrowed)
+        exact = self.exact and other.exact and self.depth() == other.depth()
+        if exact:
+            size = self.depth() + borrowed
+        else:
+            size = min(len(self.stack), len(other.stack))
+        mine = [ANY] * (size - len(self.stack)) + self.stack[max(len(self.stack) - size, 0):]
+        theirs = [ANY] * (size - len(other.stack)) + other.stack[max(len(other.stack) - size, 0):]
+        stack = [merge_type(a, b) for (a, b) in zip(mine, theirs)]
+        if (borrowed, stack, exact) == (self.borrowed, self.stack, self.exact):
+            return False
+        (self.borrowed, self.stack, self.exact) = (borrowed, stack, exact)
+        return True
+
+
+class Subroutine(object):
+    """Everything the verifier knows about the code reachable from one
+    entry point without going through a RETURN"""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.frames = {}        # offset => Frame
+        self.returns = None     # Frame at RETURN, None if it never returns
+        self.calls = set()      # entry points it calls
+        self.max_depth = 0      # relative to the entry, not counting calls,
+                                # None if unbounded
+        self.call_depths = []   # (depth at the call or None, callee entry)
+
+
+def verify(code, strings):
+    """Check bytecode before it's run, raising VerifierError for anything
+    that would make the VM fail no matter what the program's input is:
+    unknown opcodes, truncated instructions, jumps into the middle of
+    instructions or out of the program, string table indexes that aren't
+    strings, and stack underflow on every path. Where paths meet with
+    different stack depths the depth is no longer known, so underflow
+    after that is left for the VM to catch. Returns a Verified."""
+    try:
+        insns = list(decode(code))
+    except VmError, e:
+        raise VerifierError(*e.args)
+    index = dict((offset, n) for (n, (offset, op, arg)) in enumerate(insns))
+    end = len(code)
+
+    # slots that can hold a string; every other slot only ever holds numbers
+    string_slots = set(arg for (offset, op, arg) in insns
+        if op in (Opcode.STORESTRSLOT, Opcode.INPUTSLOT))
+
+    # static checks, and where each instruction can go
+    targets = {}
+    for (n, (offset, op, arg)) in enumerate(insns):
+        if op not in BasicVM.HANDLERS:
+            raise VerifierError("unknown opcode", ErrCtx(e=op, loc=offset))
+        if op == Opcode.STRING2:
+            check_string(strings, arg, offset)
+        elif op == Opcode.CONST2:
+            if arg >= len(strings) or type(strings[arg]) is str:
+                raise VerifierError("not a numeric constant", ErrCtx(e=arg, loc=offset))
+        if op in ADDR_OPS:
+            targets[offset] = arg
+        elif op in JUMPS:
+            if n == 0 or insns[n-1][1] not in LITERAL_OPS:
+                raise VerifierError("jump to a computed address", ErrCtx(e=op, loc=offset))
+            targets[offset] = insns[n-1][2]
+        if offset in targets:
+            target = targets[offset]
+            if target != end and target not in index:
+                raise VerifierError("jump target is not an instruction boundary",
+                    ErrCtx(e=target, loc=offset))
+
+    def next_offset(n):
+        return insns[n+1][0] if n + 1 < len(insns) else end
+
+    def analyze(entry, summaries):
+        sub = Subroutine(entry)
+        # the main program has no caller whose values it could pop
+        is_main = entry == main
+        work = [(entry, Frame(0, []))]
+        while work:
+            (offset, frame) = work.pop()
+            if offset == end:
+                continue
+            if offset in sub.frames:
+                if not sub.frames[offset].merge(frame, offset):
+                    continue
+                frame = sub.frames[offset]
+            else:
+                sub.frames[offset] = frame
+            frame = frame.copy()
+
+            def pop():
+                if frame.stack:
+                    return frame.stack.pop()
+                if not frame.exact:
+                    return ANY
+                if is_main:
+                    raise VerifierError("stack underflow", ErrCtx(e=op, loc=offset))
+                frame.borrowed += 1
+                return ANY
+
+            n = index[offset]
+            (offset, op, arg) = insns[n]
+            following = next_offset(n)
+            successors = [following]
+
+            if op in LITERAL_OPS or op == Opcode.STRING2:
+                frame.stack.append(arg)
+            elif op in (Opcode.CONST2, Opcode.FLOAT4):
+                frame.stack.append(NUM)
+            elif op == Opcode.LOADSLOT:
+                frame.stack.append(ANY if arg in string_slots else NUM)
+            elif op == Opcode.RETRV:
+                frame.stack.append(ANY)
+            elif op in (Opcode.PRINT, Opcode.PRINTNUMLIT, Opcode.STORENUM,
+                    Opcode.STORESLOT):
+                pop()
+            elif op in (Opcode.PRINTSTRLIT, Opcode.STORESTR, Opcode.STORESTRSLOT):
+                check_string(strings, pop(), offset)
+            elif op in ARITH or op in COMPARES:
+                pop()
+                pop()
+                frame.stack.append(NUM)
+            elif op == Opcode.JUMP:
+                pop()
+                successors = [targets[offset]]
+            elif op == Opcode.JUMPIF0:
+                pop()
+                pop()
+                successors = [following, targets[offset]]
+            elif op == Opcode.JUMPABS:
+                successors = [targets[offset]]
+            elif op in BRANCHES:
+                pop()
+                pop()
+                successors = [following, targets[offset]]
+            elif op in (Opcode.GOSUB, Opcode.CALLSUB, Opcode.MEMOCALL):
+                # a MEMOCALL that hits the cache does what the call would
+                # have done, and skips the MEMOSTORE, which doesn't change
+                # the stack anyway
+                if op != Opcode.CALLSUB:
+                    pop()
+                callee = targets[offset]
+                sub.calls.add(callee)
+                sub.call_depths.append((frame.depth(), callee))
+                returned = summaries.get(callee)
+                if callee == end:
+                    # calling the end of memory halts
+                    successors = []
+                elif returned is None:
+                    # doesn't return, or we don't know yet how it does
+                    successors = []
+                else:
+                    for _ in range(returned.borrowed):
+                        pop()
+                    if not returned.exact:
+                        (frame.stack, frame.exact) = ([], False)
+                    frame.stack.extend(returned.stack)
+            elif op == Opcode.MEMOSTORE:
+                frame.stack.append(pop())
+            elif op == Opcode.RETURN:
+                if is_main:
+                    raise VerifierError("RETURN without a GOSUB", ErrCtx(e=op, loc=offset))
+                if sub.returns is None:
+                    sub.returns = frame.copy()
+                else:
+                    sub.returns.merge(frame, offset)
+                successors = []
+            elif op in (Opcode.HALT, Opcode.EOM_HALT):
+                successors = []
+
+            if frame.depth() is None:
+                sub.max_depth = None
+            elif sub.max_depth is not None:
+                sub.max_depth = max(sub.max_depth, frame.depth())
+            for successor in successors:
+                work.append((successor, frame.copy()))
+        return sub
+
+    main = insns[0][0] if insns else end
+
+    # work out what each subroutine does to the stack, going round until
+    # nothing changes, since they can call each other
+    summaries = {}
+    subs = {}
+    pending = [main]
+    changed = True
+    while changed:
+        changed = False
+        for entry in pending + list(subs):
+            sub = analyze(entry, summaries)
+            subs[entry] = sub
+            if sub.returns is not None:
+                old = summaries.get(entry)
+                summary = (sub.returns.borrowed, sub.returns.stack, sub.returns.exact)
+                if old is None or (old.borrowed, old.stack, old.exact) != summary:
+                    summaries[entry] = sub.returns
+                    changed = True
+        pending = [callee for sub in subs.values() for callee in sub.calls
+            if callee not in subs and callee != end]
+        if pending:
+            changed = True
+
+    # arithmetic that's always on numbers, wherever it's reached from
+    numeric = set()
+    unproven = set()
+    for sub in subs.values():
+        for (offset, frame) in sub.frames.items():
+            op = insns[index[offset]][1]
+            if op in ARITH:
+                operands = frame.stack[-2:]
+                proven = len(operands) == 2 and \
+                    is_num(operands[0]) and is_num(operands[1])
+            elif op == Opcode.STORESLOT:
+                proven = bool(frame.stack) and is_num(frame.stack[-1])
+            else:
+                continue
+            (numeric if proven else unproven).add(offset)
+    numeric -= unproven
+
+    # how deep the stacks get; a recursive call makes both unbounded, and
+    # a stack of unknown depth makes the value stack's
+    depths = {}
+    def deepest(entry, active):
+        if entry in depths:
+            return depths[entry]
+        if entry in active:
+            return (None, None)
+        active.add(entry)
+        sub = subs[entry]
+        (stack, calls) = (sub.max_depth, 0)
+        for (depth, callee) in sub.call_depths:
+            if callee == end:
+                continue
+            (callee_stack, callee_calls) = deepest(callee, active)
+            if callee_calls is None:
+                (stack, calls) = (None, None)
+                break
+            calls = max(calls, callee_calls + 1)
+            if None in (stack, depth, callee_stack):
+                stack = None
+            else:
+                stack = max(stack, depth + callee_stack)
+        active.remove(entry)
+        depths[entry] = (stack, calls)
+        return depths[entry]
+
+    (max_stack, max_calls) = deepest(main, set()) if main != end else (0, 0)
+    return Verified(max_stack, max_calls, numeric)
+
+
+def check_string(strings, index, loc):
+    if type(index) not in (int, long):
+        raise VerifierError("string table index isn't a constant", ErrCtx(e=index, loc=loc))
+    if not 0 <= index < len(strings) or type(strings[index]) is not str:
+        raise VerifierError("not a string table index", ErrCtx(e=index, loc=loc))
@@ -1,10 +1,11 @@
-import os
 import pprint
 import struct
+import sys
 import collections
-
-def real_clear():
-    os.system('cls' if os.name == 'nt' else 'clear')
+import itertools
+from vmio import ConsoleInput, ConsoleOutput
+from linetable import line_for
+from memo import LruCache
 
 
 class VmError(RuntimeError):
@@ -14,16 +15,19 @@ class VmError(RuntimeError):
 ErrCtx = collections.namedtuple('ErrCtx', ['e', 'loc'])
 
 
-class Var(object):
-    def __init__(self, typ, value):
-        self.typ = typ
-        self.value = value
+class WaitingForInput(Exception):
+    """Raised by INPUT when there's no input yet and the VM isn't allowed to
+    block for it. The instruction hasn't done anything yet, so running it
+    again later picks up where it left off."""
+    pass
+
 
-    NUMERIC = "numeric"
-    STRING = "string"
+class Status(object):
+    """Why BasicVM.Run returned"""
+    HALTED      = "halted"
+    YIELDED     = "yielded"     # used up its max_steps
+    WAITING     = "waiting"     # for input, see BasicVM.Feed
 
-    def __repr__(self):
-        return "<Var:{0}={1}>".format(self.typ, self.value)
 
 class Opcode(object):
     """Opcodes for this virtual machine.
@@ -35,9 +39,19 @@ class Opcode(object):
 
     There is also one register, the name register.
 
+    Variables live in the current scope, either by name (through the name
+    register) or in a numbered slot of the scope's frame.
+
     Numbers and strings are stored in tables separate from main memory,
     they're accessed by certain opcodes using the name register.
 
+    String literals and numbers too big for a LITERAL2 live in the constant
+    pool (strtab), which the translator hands over along with the code.
+
+    Values are plain Python objects: numbers are ints, longs or floats and
+    strings are strs, so the type of a value is the type of the object.
+    Nothing gets wrapped on its way on or off the stack.
+
     In the notes, top of stack is on the right"""
 
     NOOP        = 0
@@ -52,9 +66,20 @@ class Opcode(object):
     JUMP        = 10    # [addr] => [], jumps to addr
     JUMPIF0     = 11    # [a, addr] => [], jumps to addr if a==0
 
+    # fused flow control, with addr in the next 2 bytes
+    JUMPABS     = 12    # [] => [], jumps to addr
+    JUMPIFNOTEQ = 13    # [b, a] => [], jumps to addr unless a==b
+    JUMPIFNOTLT = 14    # [b, a] => [], jumps to addr unless a<b
+    JUMPIFNOTLTE = 15   # [b, a] => [], jumps to addr unless a<=b
+
     # working with data
     LITERAL1    = 20    # [] => [a] where a is the next byte
     LITERAL2    = 21    # [] => [ab] where ab is the next 2 bytes
+    LITERAL4    = 24    # [] => [abcd] where abcd is the next 4 bytes
+
+    # constant pool entries; a is the next 2 bytes, an index into the pool
+    STRING2     = 22    # [] => [a], for the opcodes that take a strtab index
+    CONST2      = 23    # [] => [pool[a]]
 
     FLOAT4      = 25    # [] => [float] where float comes from the next 4 bytes
 
@@ -66,6 +91,13 @@ class Opcode(object):
     RETRV       = 34    # [] => [heap[@(namereg)]]
     INPUT       = 35    # await input, store it in heap[@(namereg)]
 
+    # variables by slot; s is the next 2 bytes, an index into the frame of
+    # the current scope
+    LOADSLOT    = 36    # [] => [frame[s]]
+    STORESLOT   = 37    # [a] => [], frame[s] = a
+    STORESTRSLOT = 38   # [a] => [], frame[s] = strtab[a]
+    INPUTSLOT   = 39    # await input, store it in frame[s]
+
     # math
     ADD         = 40    # [b, a] => [a+b]
     SUBTRACT    = 41    # [b, a] => [a-b]
@@ -85,212 +117,702 @@ class Opcode(object):
     POPSCOPE    = 61
     GOSUB       = 62
     RETURN      = 63
+    CALLSUB     = 64    # PUSHSCOPE then GOSUB to addr in the next 2 bytes
+
+    # memoized COMPUTE, n is the next byte: the argument count
+    MEMOCALL    = 65    # [args, addr] => [result] if (addr, args) is in
+                        #   the memo cache, skipping the MEMOSTORE after
+                        #   it; otherwise PUSHSCOPE then GOSUB to addr
+    MEMOSTORE   = 66    # [a] => [a], a goes in the memo cache for the
+                        #   MEMOCALL that's returning
 
     # make HALT really obvious
     EOM_HALT    = 254
     HALT        = 255
 
 
+SLOT_OPS = (Opcode.LOADSLOT, Opcode.STORESLOT, Opcode.STORESTRSLOT, Opcode.INPUTSLOT)
+
+# opcodes that pop their destination off the stack; the translator always
+# pushes it with the instruction right before them
+JUMPS = (Opcode.JUMP, Opcode.JUMPIF0, Opcode.GOSUB, Opcode.MEMOCALL)
+
+# opcodes that push an inline integer, which is how the translator
+# pushes the destination of JUMPS
+LITERAL_OPS = (Opcode.LITERAL1, Opcode.LITERAL2, Opcode.LITERAL4)
+
+# opcodes with a constant pool index inline
+POOL_OPS = (Opcode.STRING2, Opcode.CONST2)
+
+# opcodes with their destination address inline
+ADDR_OPS = (Opcode.JUMPABS, Opcode.JUMPIFNOTEQ, Opcode.JUMPIFNOTLT,
+    Opcode.JUMPIFNOTLTE, Opcode.CALLSUB)
+
+
+def decode(code, start=4):
+    """Walk the bytecode and yield (offset, opcode, operand) for every
+    instruction, starting after the metadata.
+
+    Operands are decoded the same way the VM reads them: a number for the
+    LITERALs, FLOAT4, MEMOCALL, the slot, pool and inline-address opcodes, a string
+    for NAME, and None for everything else."""
+    i = start
+    end = len(code)
+    while i < end:
+        op = code[i]
+        try:
+            if op == Opcode.LITERAL1 or op == Opcode.MEMOCALL:
+                yield (i, op, code[i+1])
+                i += 2
+            elif op == Opcode.LITERAL2 or op in ADDR_OPS:
+                if i + 3 > end:
+                    raise IndexError
+                yield (i, op, struct.unpack_from(">h", code, i+1)[0])
+                i += 3
+            elif op == Opcode.LITERAL4:
+                if i + 5 > end:
+                    raise IndexError
+                yield (i, op, struct.unpack_from(">i", code, i+1)[0])
+                i += 5
+            elif op == Opcode.FLOAT4:
+                if i + 5 > end:
+                    raise IndexError
+                yield (i, op, struct.unpack_from(">f", code, i+1)[0])
+                i += 5
+            elif op == Opcode.NAME:
+                name_len = code[i+1]
+                if i + 2 + name_len > end:
+                    raise IndexError
+                name = str(code[i+2:i+2+name_len])
+                yield (i, op, name)
+                i += 2 + name_len
+            elif op in SLOT_OPS or op in POOL_OPS:
+                if i + 3 > end:
+                    raise IndexError
+                yield (i, op, struct.unpack_from(">H", code, i+1)[0])
+                i += 3
+            else:
+                yield (i, op, None)
+                i += 1
+        except IndexError:
+            raise VmError("ran out of bytes to decode", ErrCtx(e=op, loc=i))
+
+
 class BasicVM(object):
+    # opcode => name of the method that implements it. NEQUAL, GT and GTE
+    # currently share their values with EQUAL, LT and LTE, so they don't
+    # get entries of their own.
+    HANDLERS = {
+        Opcode.NOOP:        "op_noop",
+        Opcode.CLEAR:       "op_clear",
+        Opcode.PRINT:       "op_print",
+        Opcode.PRINTNUMLIT: "op_print",
+        Opcode.PRINTSTRLIT: "op_printstrlit",
+        Opcode.JUMP:        "op_jump",
+        Opcode.JUMPIF0:     "op_jumpif0",
+        Opcode.JUMPABS:     "op_jumpabs",
+        Opcode.JUMPIFNOTEQ: "op_jumpifnoteq",
+        Opcode.JUMPIFNOTLT: "op_jumpifnotlt",
+        Opcode.JUMPIFNOTLTE: "op_jumpifnotlte",
+        Opcode.LITERAL1:    "op_literal1",
+        Opcode.LITERAL2:    "op_literal2",
+        Opcode.LITERAL4:    "op_literal4",
+        Opcode.STRING2:     "op_string2",
+        Opcode.CONST2:      "op_const2",
+        Opcode.FLOAT4:      "op_float4",
+        Opcode.NAME:        "op_name",
+        Opcode.STORENUM:    "op_storenum",
+        Opcode.STORESTR:    "op_storestr",
+        Opcode.RETRV:       "op_retrv",
+        Opcode.INPUT:       "op_input",
+        Opcode.LOADSLOT:    "op_loadslot",
+        Opcode.STORESLOT:   "op_storeslot",
+        Opcode.STORESTRSLOT: "op_storestrslot",
+        Opcode.INPUTSLOT:   "op_inputslot",
+        Opcode.ADD:         "op_add",
+        Opcode.SUBTRACT:    "op_subtract",
+        Opcode.MULTIPLY:    "op_multiply",
+        Opcode.DIVIDE:      "op_divide",
+        Opcode.EQUAL:       "op_equal",
+        Opcode.LT:          "op_lt",
+        Opcode.LTE:         "op_lte",
+        Opcode.PUSHSCOPE:   "op_pushscope",
+        Opcode.POPSCOPE:    "op_popscope",
+        Opcode.GOSUB:       "op_gosub",
+        Opcode.RETURN:      "op_return",
+        Opcode.CALLSUB:     "op_callsub",
+        Opcode.MEMOCALL:    "op_memocall",
+        Opcode.MEMOSTORE:   "op_memostore",
+        Opcode.EOM_HALT:    "op_halt",
+        Opcode.HALT:        "op_halt",
+    }
+
+    # when the code is pre-decoded, operands come from self.ARGS instead
+    # of being read out of the bytecode
+    DECODED_HANDLERS = dict(HANDLERS)
+    DECODED_HANDLERS.update({
+        Opcode.LITERAL1:    "op_const",
+        Opcode.LITERAL2:    "op_const",
+        Opcode.LITERAL4:    "op_const",
+        Opcode.STRING2:     "op_const",
+        Opcode.CONST2:      "op_const",
+        Opcode.FLOAT4:      "op_const",
+        Opcode.NAME:        "op_setname",
+        Opcode.LOADSLOT:    "op_loadslot_arg",
+        Opcode.STORESLOT:   "op_storeslot_arg",
+        Opcode.STORESTRSLOT: "op_storestrslot_arg",
+        Opcode.INPUTSLOT:   "op_inputslot_arg",
+        Opcode.JUMPABS:     "op_jumpabs_arg",
+        Opcode.JUMPIFNOTEQ: "op_jumpifnoteq_arg",
+        Opcode.JUMPIFNOTLT: "op_jumpifnotlt_arg",
+        Opcode.JUMPIFNOTLTE: "op_jumpifnotlte_arg",
+        Opcode.CALLSUB:     "op_callsub_arg",
+        Opcode.MEMOCALL:    "op_memocall_arg",
+    })
+
+    # for predecoded code that's been verified, where the verifier proved
+    # the operands are always numbers
+    UNCHECKED_HANDLERS = {
+        Opcode.ADD:         "op_add_unchecked",
+        Opcode.SUBTRACT:    "op_subtract_unchecked",
+        Opcode.MULTIPLY:    "op_multiply_unchecked",
+        Opcode.DIVIDE:      "op_divide_unchecked",
+        Opcode.STORESLOT:   "op_storeslot_unchecked",
+    }
+
+    JUMPS = JUMPS
+
+    # how many results of memoized COMPUTEs are kept
+    MEMO_SIZE = 4096
+
     def __init__(self):
         self.code = None
         self.string_table = None
         self.debugger = False
+        self.blocking_input = True
+        self.input_queue = collections.deque()
+        self.input = ConsoleInput()
+        self.output = ConsoleOutput()
+        self.OPS = None
+        self.memo_size = self.MEMO_SIZE
+        self.dispatch = self.BuildDispatch(self.HANDLERS)
+        self.decoded_dispatch = self.BuildDispatch(self.DECODED_HANDLERS)
+        self.unchecked_dispatch = self.BuildDispatch(self.UNCHECKED_HANDLERS)
+
+    def BuildDispatch(self, handlers):
+        """Build the opcode => bound handler table used by Step and Run.
+
+        Every one of the 256 possible opcodes gets an entry, so dispatch
+        is a single index with no bounds or membership checks."""
+        table = [self.op_unknown] * 256
+        for (opcode, handler) in handlers.items():
+            table[opcode] = getattr(self, handler)
+        return table
 
     def SetDebugger(self, debug):
         self.debugger = debug
 
-    def Load(self, code, string_table):
+    def SetOutput(self, sink):
+        """Send PRINT output to an OutputSink from vmio"""
+        self.output = sink
+
+    def SetInput(self, source):
+        """Take INPUT lines from an InputSource from vmio"""
+        self.input = source
+
+    def SetMemoSize(self, size):
+        """How many results of memoized COMPUTEs to keep, from the next
+        Load on"""
+        self.memo_size = size
+
+    def SetBlockingInput(self, blocking):
+        """Whether INPUT waits on the input source when nothing has been
+        fed in. If not, Run returns Status.WAITING when the source has
+        nothing ready."""
+        self.blocking_input = blocking
+
+    def Feed(self, data):
+        """Queue up a line for a future INPUT"""
+        self.input_queue.append(data)
+
+    def ReadInput(self):
+        if self.input_queue:
+            return self.input_queue.popleft()
+        # anything printed so far is the prompt for this line
+        self.output.flush()
+        line = self.input.read(self.blocking_input)
+        if line is None:
+            raise WaitingForInput()
+        return line
+
+    def Load(self, code, string_table, predecode=False, verified=None,
+            lines=None, names=None):
+        """Load a translated program.
+
+        With predecode, the bytecode is decoded once up front and the VM
+        runs from an instruction list instead, where IP is an instruction
+        index rather than a byte offset. self.code is kept either way, and
+        VmError locations are always byte offsets into it.
+
+        verified is what verifier.verify said about the code. Predecoded
+        code then skips the type checks the verifier proved can't fail.
+
+        lines is the program's line table from linetable, if it has one,
+        for Line.
+
+        names is its variable names in slot order, from
+        translator.slot_names, if it has them, so errors can say which
+        variable rather than which slot."""
         self.code = code
         self.string_table = string_table
+        self.verified = verified
+        self.line_table = lines
+        self.slot_names = names
+        # results stay good for as long as the code does
+        self.memo = LruCache(self.memo_size)
+        self.OPS = None
+        self.slot_count = self.CountSlots()
+        if predecode:
+            self.Predecode()
         self.Reset()
 
+    def CountSlots(self):
+        """Size of a scope's frame: one more than the highest slot used"""
+        count = 0
+        try:
+            for (offset, op, arg) in decode(self.code):
+                if op in SLOT_OPS and arg >= count:
+                    count = arg + 1
+        except VmError:
+            # truncated code only fails if it's actually reached
+            pass
+        return count
+
+    def Predecode(self):
+        ops = []
+        args = []
+        offsets = []
+        for (offset, op, arg) in decode(self.code):
+            if op == Opcode.CONST2:
+                # fetch the constant now, so it's pushed like a literal
+                arg = self.string_table[arg]
+            ops.append(op)
+            args.append(arg)
+            offsets.append(offset)
+
+        # running off the end of memory halts, so end with an explicit
+        # halt and the main loop never needs a bounds check
+        ops.append(Opcode.EOM_HALT)
+        args.append(None)
+        offsets.append(len(self.code))
+
+        # turn jump destinations into instruction indexes
+        index = dict((offset, i) for (i, offset) in enumerate(offsets))
+        for i in range(len(ops)):
+            if ops[i] in ADDR_OPS:
+                j = i
+            elif i > 0 and ops[i] in self.JUMPS and \
+                    ops[i-1] in LITERAL_OPS:
+                j = i - 1
+            else:
+                continue
+            target = args[j]
+            if target >= len(self.code):
+                args[j] = len(ops) - 1
+            elif target in index:
+                args[j] = index[target]
+            else:
+                raise VmError("jump target is not an instruction boundary",
+                    ErrCtx(e=target, loc=offsets[i]))
+
+        self.OPS = ops
+        self.ARGS = args
+        self.OFFSETS = offsets
+        self.INSNS = [self.decoded_dispatch[op] for op in ops]
+        if self.verified:
+            for i in range(len(ops)):
+                if offsets[i] in self.verified.numeric:
+                    self.INSNS[i] = self.unchecked_dispatch[ops[i]]
+
+    def Loc(self):
+        """Byte offset of the current instruction, for error reporting"""
+        if self.OPS is None:
+            return self.IP
+        return self.OFFSETS[self.IP]
+
+    def Line(self, loc=None):
+        """Source line of the instruction at byte offset loc, by default
+        the current one, or None if the program has no line table"""
+        if not self.line_table:
+            return None
+        return line_for(self.line_table, self.Loc() if loc is None else loc)
+
+    def SlotName(self, slot):
+        """Name of the variable in slot, or the slot number if the program
+        didn't come with names"""
+        if self.slot_names is None or slot >= len(self.slot_names):
+            return slot
+        return self.slot_names[slot]
+
     def Reset(self):
-        self.IP = 4     # skip metadata
+        self.IP = 4 if self.OPS is None else 0     # skip metadata
         self.STACK = []
         self.IP_STACK = []
         self.NAME_REG = None
         self.VARS = {}
         self.VAR_STACK = []
+        self.SLOTS = [None] * self.slot_count
+        self.SLOT_STACK = []
+        self.MEMO_STACK = []
         self.halted = False
 
     def Step(self):
-        try:
-            op = self.code[self.IP]
-        except IndexError:
-            # ran off the end of memory
-            op = Opcode.EOM_HALT
+        if self.OPS is not None:
+            op = self.OPS[self.IP]
+            handler = self.INSNS[self.IP]
+        else:
+            try:
+                op = self.code[self.IP]
+            except IndexError:
+                # ran off the end of memory
+                op = Opcode.EOM_HALT
+            handler = self.dispatch[op]
 
         if self.debugger:
             print "opcode =",op
 
-        if op == Opcode.CLEAR:
-            if self.debugger:
-                print "{clearscreen}"
-            else:
-                real_clear()
+        handler()
+        self.IP += 1
 
-        elif op == Opcode.LITERAL1:
-            var = Var(typ=Var.NUMERIC, value=self.code[self.IP + 1])
-            self.STACK.append(var)
-            self.IP += 1
+    def op_noop(self):
+        pass
+
+    def op_unknown(self):
+        raise VmError("unexpected opcode", ErrCtx(e=self.code[self.Loc()], loc=self.Loc()))
+
+    def op_const(self):
+        self.STACK.append(self.ARGS[self.IP])
 
-        elif op == Opcode.LITERAL2:
-            raw = chr(self.code[self.IP+1]) + chr(self.code[self.IP+2])
-            val = struct.unpack(">h", raw)
-            var = Var(typ=Var.NUMERIC, value=val[0])
-            self.STACK.append(var)
+    def op_setname(self):
+        self.NAME_REG = self.ARGS[self.IP]
+
+    def op_clear(self):
+        if self.debugger:
+            self.output.flush()
+            print "{clearscreen}"
+        else:
+            self.output.clear()
+
+    def op_literal1(self):
+        self.STACK.append(self.code[self.IP + 1])
+        self.IP += 1
+
+    def op_literal2(self):
+        self.STACK.append(struct.unpack_from(">h", self.code, self.IP + 1)[0])
+        self.IP += 2
+
+    def op_literal4(self):
+        self.STACK.append(struct.unpack_from(">i", self.code, self.IP + 1)[0])
+        self.IP += 4
+
+    def op_string2(self):
+        self.STACK.append((self.code[self.IP+1] << 8) | self.code[self.IP+2])
+        self.IP += 2
+
+    def op_const2(self):
+        index = (self.code[self.IP+1] << 8) | self.code[self.IP+2]
+        self.STACK.append(self.string_table[index])
+        self.IP += 2
+
+    def op_float4(self):
+        self.STACK.append(struct.unpack_from(">f", self.code, self.IP + 1)[0])
+        self.IP += 4
+
+    def op_name(self):
+        name_len = self.code[self.IP + 1]
+        name = "".join([chr(i) for i in
+            self.code[self.IP + 2:self.IP + 2 + name_len]])
+        self.NAME_REG = name
+        self.IP += 1 + name_len
+
+    def op_retrv(self):
+        name = self.NAME_REG
+        if name in self.VARS:
+            val = self.VARS[name]
+            self.STACK.append(val)
+        else:
+            raise VmError("RETRV: variable is not defined", ErrCtx(e=name, loc=self.Loc()))
+
+    def op_input(self):
+        name = self.NAME_REG
+        self.VARS[name] = self.ReadInput()
+
+    # the slot opcodes come in pairs: op_X reads the slot number out of the
+    # bytecode, op_X_arg gets it already decoded from self.ARGS
+
+    def op_loadslot(self):
+        slot = (self.code[self.IP+1] << 8) | self.code[self.IP+2]
+        val = self.SLOTS[slot]
+        if val is None:
+            raise VmError("LOADSLOT: variable is not defined",
+                ErrCtx(e=self.SlotName(slot), loc=self.Loc()))
+        self.STACK.append(val)
+        self.IP += 2
+
+    def op_loadslot_arg(self):
+        val = self.SLOTS[self.ARGS[self.IP]]
+        if val is None:
+            raise VmError("LOADSLOT: variable is not defined",
+                ErrCtx(e=self.SlotName(self.ARGS[self.IP]), loc=self.Loc()))
+        self.STACK.append(val)
+
+    def op_storeslot(self):
+        num = self.STACK.pop()
+        if type(num) is not str:
+            self.SLOTS[(self.code[self.IP+1] << 8) | self.code[self.IP+2]] = num
             self.IP += 2
+        else:
+            raise VmError("expected a number", ErrCtx(e=num, loc=self.Loc()))
 
-        elif op == Opcode.FLOAT4:
-            raw = chr(self.code[self.IP+1]) +   \
-                    chr(self.code[self.IP+2]) + \
-                    chr(self.code[self.IP+3]) + \
-                    chr(self.code[self.IP+4])
-            val = struct.unpack(">f", raw)
-            var = Var(typ=Var.NUMERIC, value=val[0])
-            self.STACK.append(var)
-            self.IP += 4
-
-        elif op == Opcode.NAME:
-            name_len = self.code[self.IP + 1]
-            name = "".join([chr(i) for i in
-                self.code[self.IP + 2:self.IP + 2 + name_len]])
-            self.NAME_REG = name
-            self.IP += 1 + name_len
-
-        elif op == Opcode.RETRV:
-            name = self.NAME_REG
-            if name in self.VARS:
-                val = self.VARS[name]
-                self.STACK.append(val)
-            else:
-                raise VmError("RETRV: variable is not defined", ErrCtx(e=name, loc=self.IP))
-
-        elif op == Opcode.INPUT:
-            name = self.NAME_REG
-            data = raw_input('> ')
-            self.VARS[name] = Var(typ=Var.STRING, value=data)
-
-        elif op == Opcode.ADD:
-            op2 = self.STACK.pop()
-            op1 = self.STACK.pop()
-            if op1.typ == Var.NUMERIC and op2.typ == Var.NUMERIC:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=(op1.value + op2.value)))
-            else:
-                raise VmError("ADD: expected both operands to be numeric",
-                    ErrCtx(e=(op1,op2), loc=self.IP))
-
-        elif op == Opcode.SUBTRACT:
-            op2 = self.STACK.pop()
-            op1 = self.STACK.pop()
-            if op1.typ == Var.NUMERIC and op2.typ == Var.NUMERIC:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=(op1.value - op2.value)))
-            else:
-                raise VmError("SUBTRACT: expected both operands to be numeric",
-                    ErrCtx(e=(op1,op2), loc=self.IP))
-
-        elif op == Opcode.MULTIPLY:
-            op2 = self.STACK.pop()
-            op1 = self.STACK.pop()
-            if op1.typ == Var.NUMERIC and op2.typ == Var.NUMERIC:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=(op1.value * op2.value)))
-            else:
-                raise VmError("MULTIPLY: expected both operands to be numeric",
-                    ErrCtx(e=(op1,op2), loc=self.IP))
-
-        elif op == Opcode.DIVIDE:
-            op2 = self.STACK.pop()
-            op1 = self.STACK.pop()
-            if op1.typ == Var.NUMERIC and op2.typ == Var.NUMERIC:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=(op1.value / op2.value)))
-            else:
-                raise VmError("DIVIDE: expected both operands to be numeric",
-                    ErrCtx(e=(op1,op2), loc=self.IP))
-
-        elif op == Opcode.EQUAL:
-            op1 = self.STACK.pop()
-            op2 = self.STACK.pop()
-            if op1.typ == op2.typ and op1.value == op2.value:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=1))
-            else:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=0))
+    def op_storeslot_arg(self):
+        num = self.STACK.pop()
+        if type(num) is not str:
+            self.SLOTS[self.ARGS[self.IP]] = num
+        else:
+            raise VmError("expected a number", ErrCtx(e=num, loc=self.Loc()))
 
-        elif op == Opcode.LT:
-            op1 = self.STACK.pop()
-            op2 = self.STACK.pop()
-            if op1.value < op2.value:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=1))
-            else:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=0))
+    def op_storestrslot(self):
+        index = self.STACK.pop()
+        self.SLOTS[(self.code[self.IP+1] << 8) | self.code[self.IP+2]] = self.string_table[index]
+        self.IP += 2
 
-        elif op == Opcode.LTE:
-            op1 = self.STACK.pop()
-            op2 = self.STACK.pop()
-            if op1.value <= op2.value:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=1))
-            else:
-                self.STACK.append(Var(typ=Var.NUMERIC, value=0))
+    def op_storestrslot_arg(self):
+        index = self.STACK.pop()
+        self.SLOTS[self.ARGS[self.IP]] = self.string_table[index]
 
-        elif op == Opcode.STORENUM:
-            num = self.STACK.pop()
-            if num.typ == Var.NUMERIC:
-                self.VARS[self.NAME_REG] = num
-            else:
-                raise VmError("expected a number", ErrCtx(e=num, loc=self.IP))
+    def op_inputslot(self):
+        self.SLOTS[(self.code[self.IP+1] << 8) | self.code[self.IP+2]] = self.ReadInput()
+        self.IP += 2
 
-        elif op == Opcode.STORESTR:
-            index = self.STACK.pop()
-            string = self.string_table[index.value]
-            self.VARS[self.NAME_REG] = Var(Var.STRING, string)
+    def op_inputslot_arg(self):
+        self.SLOTS[self.ARGS[self.IP]] = self.ReadInput()
 
-        elif op == Opcode.PRINTSTRLIT:
-            index = self.STACK.pop()
-            print self.string_table[index.value],
+    def op_add(self):
+        op2 = self.STACK.pop()
+        op1 = self.STACK.pop()
+        if type(op1) is not str and type(op2) is not str:
+            self.STACK.append(op1 + op2)
+        else:
+            raise VmError("ADD: expected both operands to be numeric",
+                ErrCtx(e=(op1,op2), loc=self.Loc()))
+
+    def op_subtract(self):
+        op2 = self.STACK.pop()
+        op1 = self.STACK.pop()
+        if type(op1) is not str and type(op2) is not str:
+            self.STACK.append(op1 - op2)
+        else:
+            raise VmError("SUBTRACT: expected both operands to be numeric",
+                ErrCtx(e=(op1,op2), loc=self.Loc()))
+
+    def op_multiply(self):
+        op2 = self.STACK.pop()
+        op1 = self.STACK.pop()
+        if type(op1) is not str and type(op2) is not str:
+            self.STACK.append(op1 * op2)
+        else:
+            raise VmError("MULTIPLY: expected both operands to be numeric",
+                ErrCtx(e=(op1,op2), loc=self.Loc()))
+
+    def op_divide(self):
+        op2 = self.STACK.pop()
+        op1 = self.STACK.pop()
+        if type(op1) is not str and type(op2) is not str:
+            self.STACK.append(op1 / op2)
+        else:
+            raise VmError("DIVIDE: expected both operands to be numeric",
+                ErrCtx(e=(op1,op2), loc=self.Loc()))
 
-        elif op == Opcode.PRINTNUMLIT:
-            val = self.STACK.pop()
-            print val.value,
+    # the operands are known to be numbers
 
-        elif op == Opcode.PRINT:
-            val = self.STACK.pop()
-            print val.value,
+    def op_add_unchecked(self):
+        op2 = self.STACK.pop()
+        self.STACK[-1] += op2
 
-        elif op == Opcode.JUMP:
-            addr = self.STACK.pop()
-            self.IP = addr.value - 1  # the 1 gets added back below
+    def op_subtract_unchecked(self):
+        op2 = self.STACK.pop()
+        self.STACK[-1] -= op2
 
-        elif op == Opcode.JUMPIF0:
-            addr = self.STACK.pop()
-            test = self.STACK.pop()
-            if test.value == 0:
-                self.IP = addr.value - 1  # the 1 gets added back below
+    def op_multiply_unchecked(self):
+        op2 = self.STACK.pop()
+        self.STACK[-1] *= op2
 
-        elif op == Opcode.PUSHSCOPE:
-            self.VAR_STACK.append(self.VARS)
-            self.VARS = {}
+    def op_divide_unchecked(self):
+        op2 = self.STACK.pop()
+        self.STACK[-1] /= op2
 
-        elif op == Opcode.POPSCOPE:
-            self.VARS = self.VAR_STACK.pop()
+    def op_storeslot_unchecked(self):
+        self.SLOTS[self.ARGS[self.IP]] = self.STACK.pop()
 
-        elif op == Opcode.GOSUB:
-            self.IP_STACK.append(self.IP)
-            addr = self.STACK.pop()
-            self.IP = addr.value - 1  # the 1 gets added back below
+    # a string never compares equal to a number, so plain == covers the
+    # type check as well. Results are the cached small ints 1 and 0.
 
-        elif op == Opcode.RETURN:
-            self.IP = self.IP_STACK.pop()
+    def op_equal(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        self.STACK.append(1 if op1 == op2 else 0)
 
-        elif op == Opcode.HALT or op == Opcode.EOM_HALT:
-            self.halted = True
+    def op_lt(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        self.STACK.append(1 if op1 < op2 else 0)
 
-        elif op == Opcode.NOOP:
-            pass
+    def op_lte(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        self.STACK.append(1 if op1 <= op2 else 0)
 
+    def op_storenum(self):
+        num = self.STACK.pop()
+        if type(num) is not str:
+            self.VARS[self.NAME_REG] = num
         else:
-            raise VmError("unexpected opcode", ErrCtx(e=op, loc=self.IP))
+            raise VmError("expected a number", ErrCtx(e=num, loc=self.Loc()))
 
-        self.IP += 1
+    def op_storestr(self):
+        index = self.STACK.pop()
+        self.VARS[self.NAME_REG] = self.string_table[index]
+
+    def op_printstrlit(self):
+        index = self.STACK.pop()
+        self.output.write(self.string_table[index])
+
+    def op_print(self):
+        self.output.write(self.STACK.pop())
+
+    def op_jump(self):
+        addr = self.STACK.pop()
+        self.IP = addr - 1  # the 1 gets added back after dispatch
+
+    def op_jumpif0(self):
+        addr = self.STACK.pop()
+        test = self.STACK.pop()
+        if test == 0:
+            self.IP = addr - 1  # the 1 gets added back after dispatch
+
+    # fused jumps: op_X reads the address out of the bytecode, op_X_arg
+    # gets it already decoded from self.ARGS
+
+    def op_jumpabs(self):
+        self.IP = struct.unpack_from(">h", self.code, self.IP + 1)[0] - 1
+
+    def op_jumpabs_arg(self):
+        self.IP = self.ARGS[self.IP] - 1
+
+    def op_jumpifnoteq(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if op1 == op2:
+            self.IP += 2
+        else:
+            self.IP = struct.unpack_from(">h", self.code, self.IP + 1)[0] - 1
+
+    def op_jumpifnoteq_arg(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if not op1 == op2:
+            self.IP = self.ARGS[self.IP] - 1
+
+    def op_jumpifnotlt(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if op1 < op2:
+            self.IP += 2
+        else:
+            self.IP = struct.unpack_from(">h", self.code, self.IP + 1)[0] - 1
+
+    def op_jumpifnotlt_arg(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if not op1 < op2:
+            self.IP = self.ARGS[self.IP] - 1
+
+    def op_jumpifnotlte(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if op1 <= op2:
+            self.IP += 2
+        else:
+            self.IP = struct.unpack_from(">h", self.code, self.IP + 1)[0] - 1
+
+    def op_jumpifnotlte_arg(self):
+        op1 = self.STACK.pop()
+        op2 = self.STACK.pop()
+        if not op1 <= op2:
+            self.IP = self.ARGS[self.IP] - 1
+
+    def op_pushscope(self):
+        self.VAR_STACK.append(self.VARS)
+        self.VARS = {}
+        self.SLOT_STACK.append(self.SLOTS)
+        self.SLOTS = [None] * self.slot_count
+
+    def op_popscope(self):
+        self.VARS = self.VAR_STACK.pop()
+        self.SLOTS = self.SLOT_STACK.pop()
+
+    def op_gosub(self):
+        self.IP_STACK.append(self.IP)
+        addr = self.STACK.pop()
+        self.IP = addr - 1  # the 1 gets added back after dispatch
+
+    def op_callsub(self):
+        self.op_pushscope()
+        # return to the last byte of this instruction, like GOSUB does
+        self.IP_STACK.append(self.IP + 2)
+        self.IP = struct.unpack_from(">h", self.code, self.IP + 1)[0] - 1
+
+    def op_callsub_arg(self):
+        self.op_pushscope()
+        self.IP_STACK.append(self.IP)
+        self.IP = self.ARGS[self.IP] - 1
+
+    def MemoCall(self, addr, count, ret):
+        """Look up the result of a memoized COMPUTE of the subroutine at
+        addr with the top count values on the stack as its arguments. On
+        a miss, call it, returning to ret, where the MEMOSTORE is one
+        instruction on. Returns the address to carry on at."""
+        STACK = self.STACK
+        args = STACK[len(STACK) - count:]
+        # 1 and 1.0 are equal as keys, but not as arguments
+        key = (addr, tuple(args), tuple(map(type, args)))
+        value = self.memo.get(key)
+        if value is not None:
+            del STACK[len(STACK) - count:]
+            STACK.append(value)
+            # past the MEMOSTORE
+            return ret + 2
+        self.MEMO_STACK.append(key)
+        self.op_pushscope()
+        self.IP_STACK.append(ret)
+        return addr
+
+    def op_memocall(self):
+        addr = self.STACK.pop()
+        self.IP = self.MemoCall(addr, self.code[self.IP + 1], self.IP + 1) - 1
+
+    def op_memocall_arg(self):
+        addr = self.STACK.pop()
+        self.IP = self.MemoCall(addr, self.ARGS[self.IP], self.IP) - 1
+
+    def op_memostore(self):
+        self.memo.put(self.MEMO_STACK.pop(), self.STACK[-1])
+
+    def op_return(self):
+        self.IP = self.IP_STACK.pop()
+
+    def op_halt(self):
+        self.halted = True
 
     def PrintState(self):
         pprint.pprint({
@@ -298,17 +820,67 @@ class BasicVM(object):
             "STACK": self.STACK,
             "NAME_REG": self.NAME_REG,
             "VARs": self.VARS,
+            "SLOTS": self.SLOTS,
             "IP_STACK": self.IP_STACK,
             "VAR_STACK": self.VAR_STACK,
+            "MEMO_STACK": self.MEMO_STACK,
         })
 
-    def Run(self):
-        if(self.debugger):
-            self.PrintState()
-        while not self.halted:
+    def Run(self, max_steps=None):
+        """Run until the program halts, or for at most max_steps
+        instructions. Returns a Status.
+
+        Calling Run again after it yields, or after it's waiting and more
+        input has been fed in, carries on where it stopped."""
+        budget = sys.maxint if max_steps is None else max_steps
+        try:
+            if self.debugger:
+                self.RunDebug(budget)
+            elif self.OPS is not None:
+                self.RunDecoded(budget)
+            else:
+                self.RunBytes(budget)
+        except WaitingForInput:
+            return Status.WAITING
+        finally:
+            self.output.flush()
+        return Status.HALTED if self.halted else Status.YIELDED
+
+    def RunBytes(self, budget):
+        # fast path: no debugger checks and no Step() call per instruction,
+        # just index the dispatch table with the current opcode
+        code = self.code
+        dispatch = self.dispatch
+        try:
+            for _ in itertools.repeat(None, budget):
+                if self.halted:
+                    break
+                dispatch[code[self.IP]]()
+                self.IP += 1
+        except IndexError:
+            if self.IP < len(code):
+                raise
+            # ran off the end of memory
+            self.op_halt()
+            self.IP += 1
+
+    def RunDecoded(self, budget):
+        # the trailing halt means IP never leaves the instruction list
+        insns = self.INSNS
+        for _ in itertools.repeat(None, budget):
+            if self.halted:
+                break
+            insns[self.IP]()
+            self.IP += 1
+
+    def RunDebug(self, budget):
+        self.PrintState()
+        for _ in itertools.repeat(None, budget):
+            if self.halted:
+                break
             self.Step()
-            if(self.debugger):
-                self.PrintState()
+            self.output.flush()
+            self.PrintState()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+import os
+import sys
+
+def real_clear():
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+
+class OutputSink(object):
+    """Where the PRINT opcodes send their output.
+
+    Items are formatted the way Python 2's print statement with a trailing
+    comma does it: str() of the item, with a space in front unless it's the
+    first thing on the line. Subclasses decide when and where the text
+    goes."""
+
+    def __init__(self):
+        self.parts = []
+        self.softspace = 0
+
+    def write(self, value):
+        if self.softspace:
+            self.parts.append(" ")
+        text = str(value)
+        self.parts.append(text)
+        # same rule as print: no space after a string ending in a newline
+        # or other non-space whitespace
+        self.softspace = not (type(value) is str and text and
+            text[-1].isspace() and text[-1] != " ")
+
+    def flush(self):
+        pass
+
+    def clear(self):
+        """CLEAR was executed"""
+        pass
+
+
+class ConsoleOutput(OutputSink):
+    """Buffers output and writes it to a stream (stdout by default) in
+    batches: when the buffer fills up, and whenever the VM flushes it, which
+    is before INPUT or CLEAR and whenever Run returns or raises."""
+
+    def __init__(self, stream=None, limit=512):
+        OutputSink.__init__(self)
+        self.stream = stream
+        self.limit = limit
+
+    def target(self):
+        return self.stream if self.stream is not None else sys.stdout
+
+    def write(self, value):
+        if not self.parts:
+            # something else may have written to the stream since the last
+            # flush, and print and raw_input both track the space they owe
+            # in the stream's softspace
+            self.softspace = getattr(self.target(), "softspace", 0)
+        OutputSink.write(self, value)
+        if len(self.parts) >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if not self.parts:
+            return
+        stream = self.target()
+        stream.write("".join(self.parts))
+        self.parts = []
+        stream.softspace = self.softspace
+        stream.flush()
+
+    def clear(self):
+        self.flush()
+        real_clear()
+
+
+class MemoryOutput(OutputSink):
+    """Keeps all output in memory, for embedding and grading"""
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class InputSource(object):
+    """Where INPUT gets its lines from.
+
+    read(blocking) returns the next line without its newline. When there
+    isn't one, it raises EOFError if blocking, like raw_input does at the
+    end of its input, and otherwise returns None so the VM can report that
+    it's waiting.
+
+    This one reads the lines from an iterator, which subclasses with some
+    other way of getting them replace."""
+
+    def __init__(self, lines=()):
+        self.lines = iter(lines)
+
+    def read(self, blocking):
+        for line in self.lines:
+            return line
+        if blocking:
+            raise EOFError()
+        return None
+
+
+class ConsoleInput(InputSource):
+    """Prompts for each line at the console"""
+
+    def __init__(self, prompt="> "):
+        self.prompt = prompt
+
+    def read(self, blocking):
+        if not blocking:
+            return None
+        return raw_input(self.prompt)
+
+
+class ListInput(InputSource):
+    """Lines given up front"""
+
+    def __init__(self, lines):
+        InputSource.__init__(self, list(lines))
+
+
+class StreamInput(InputSource):
+    """Lines read from a file or any other object with readline"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, blocking):
+        line = self.stream.readline()
+        if not line:
+            if blocking:
+                raise EOFError()
+            return None
+        if line.endswith("\n"):
+            line = line[:-1]
+        return line